@@ -34,6 +34,29 @@ MSG_FAILED = 'WOKASYNC0002L'
 MSG_SUCCESS = 'WOKASYNC0001L'
 tasks_queue = {}
 
+# number of changes of the tasks, to tell clients whether their copy is up to
+# date, and an identifier of the server run, as the count starts over on
+# every run
+_tasks_version = 0
+_tasks_run_id = uuid.uuid4().hex
+_tasks_version_lock = threading.Lock()
+
+
+def _tasks_changed():
+    global _tasks_version
+
+    with _tasks_version_lock:
+        _tasks_version += 1
+
+
+def get_tasks_version():
+    """
+    Return a value which changes whenever a task is added, removed or changes
+    its status or message.
+    """
+    with _tasks_version_lock:
+        return f'{_tasks_run_id}-{_tasks_version}'
+
 
 def clean_old_tasks():
     """
@@ -78,6 +101,7 @@ class AsyncTask(object):
         # let's prevent memory leak in tasks_queue
         clean_old_tasks()
         tasks_queue[self.id] = self
+        _tasks_changed()
 
     def _log(self, code, status, exception=None):
         log_request(
@@ -103,6 +127,8 @@ class AsyncTask(object):
         if message.strip():
             self.message = message
 
+        _tasks_changed()
+
     def _run_helper(self, opaque, cb):
         cherrypy.serving.request = self._cp_request
         try:
@@ -119,6 +145,7 @@ class AsyncTask(object):
     def remove(self):
         try:
             del tasks_queue[self.id]
+            _tasks_changed()
         except KeyError:
             msg = f"There's no task_id {self.id} in tasks_queue."
             cherrypy.log.error_log.error(msg)
@@ -134,3 +161,5 @@ class AsyncTask(object):
         except Exception as e:
             self.message = str(e)
             raise OperationFailed('WOKASYNC0004E', {'err': str(e)})
+        finally:
+            _tasks_changed()
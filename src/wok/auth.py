@@ -20,16 +20,19 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 import base64
 import fcntl
+import hashlib
+import hmac
+import json
 import multiprocessing
 import os
 import pty
 import re
 import termios
+import threading
 import time
 import urllib.parse
 
 import cherrypy
-import ldap
 try:
     import PAM
 except ModuleNotFoundError:
@@ -37,14 +40,32 @@ except ModuleNotFoundError:
 
 from wok import template
 from wok.config import config
+from wok.config import get_api_token_key_path
 from wok.exception import InvalidOperation
 from wok.exception import OperationFailed
+from wok.metrics import timed
 from wok.utils import run_command
 
 USER_NAME = 'username'
 USER_ROLE = 'role'
 USER_GROUPS = 'groups'
 
+# PBKDF2 rounds to hash the cached passwords
+AUTH_CACHE_HASH_ROUNDS = 1000
+# Expired entries are removed from the cache when it reaches this size
+AUTH_CACHE_PURGE_SIZE = 256
+
+# Maximum number of idle connections kept for each LDAP server
+LDAP_POOL_SIZE = 4
+
+# API tokens are '<prefix>.<claims>.<signature>', with the claims JSON and
+# its HMAC-SHA256 signature encoded in base64url
+TOKEN_PREFIX = 'wok1'
+TOKEN_KEY_SIZE = 32
+
+_token_key = None
+_token_key_lock = threading.Lock()
+
 
 def redirect_login():
     url = '/login.html'
@@ -60,14 +81,109 @@ def debug(msg):
     pass
 
 
+class AuthCache(object):
+    """
+    Cache of the successful users authentications, and of their groups and
+    role, kept for auth_cache_ttl seconds.
+
+    Passwords are not kept: only a salted hash of them, to check whether a
+    later request has the same credentials. Failed authentications are never
+    cached.
+    """
+
+    def __init__(self):
+        self._credentials = {}
+        self._users = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_ttl():
+        return config.getint('authentication', 'auth_cache_ttl')
+
+    @staticmethod
+    def _hash(password, salt):
+        return hashlib.pbkdf2_hmac(
+            'sha256', password.encode('utf-8'), salt, AUTH_CACHE_HASH_ROUNDS)
+
+    def _get(self, cache, key):
+        with self._lock:
+            entry = cache.get(key)
+        if entry is None or entry[-1] <= time.monotonic():
+            return None
+        return entry
+
+    def _add(self, cache, key, entry):
+        with self._lock:
+            if len(cache) >= AUTH_CACHE_PURGE_SIZE:
+                now = time.monotonic()
+                for k in [k for k, v in cache.items() if v[-1] <= now]:
+                    del cache[k]
+            cache[key] = entry
+
+    def check_credentials(self, auth_type, username, password):
+        entry = self._get(self._credentials, (auth_type, username))
+        if entry is None:
+            return False
+
+        salt, digest, _ = entry
+        return hmac.compare_digest(digest, self._hash(password, salt))
+
+    def add_credentials(self, auth_type, username, password):
+        ttl = self.get_ttl()
+        if ttl <= 0:
+            return
+
+        salt = os.urandom(16)
+        entry = (salt, self._hash(password, salt), time.monotonic() + ttl)
+        self._add(self._credentials, (auth_type, username), entry)
+
+    def get_user_info(self, auth_type, username):
+        """
+        Return a tuple (groups, role) of the user, or None if not cached.
+        """
+        entry = self._get(self._users, (auth_type, username))
+        if entry is None:
+            return None
+
+        groups, role, _ = entry
+        return (list(groups) if groups is not None else None), role
+
+    def add_user_info(self, auth_type, username, groups, role):
+        ttl = self.get_ttl()
+        if ttl <= 0:
+            return
+
+        if groups is not None:
+            groups = tuple(groups)
+        entry = (groups, role, time.monotonic() + ttl)
+        self._add(self._users, (auth_type, username), entry)
+
+    def clear(self):
+        with self._lock:
+            self._credentials.clear()
+            self._users.clear()
+
+
+auth_cache = AuthCache()
+
+
 class User(object):
     def __init__(self, username):
         self.name = username
-        self.groups = self._get_groups()
-        # after adding support to change user roles that info should be read
-        # from a specific objstore and fallback to default only if any entry is
-        # found
-        self.role = self._get_role()
+
+        # groups and role are looked up in the system, which is slow
+        auth_type = getattr(self, 'auth_type', None)
+        user_info = auth_cache.get_user_info(auth_type, username)
+        if user_info is None:
+            self.groups = self._get_groups()
+            # after adding support to change user roles that info should be
+            # read from a specific objstore and fallback to default only if
+            # any entry is found
+            self.role = self._get_role()
+            auth_cache.add_user_info(
+                auth_type, username, self.groups, self.role)
+        else:
+            self.groups, self.role = user_info
 
     def _get_groups(self):
         pass
@@ -80,13 +196,20 @@ class User(object):
         auth_type = auth_args.pop('auth_type')
         for klass in cls.__subclasses__():
             if auth_type == klass.auth_type:
+                username = auth_args['username']
+                password = auth_args['password']
+                if auth_cache.check_credentials(auth_type, username, password):
+                    return klass(username)
+
                 try:
                     if not klass.authenticate(**auth_args):
                         debug('cannot verify user with the given password')
                         return None
                 except OperationFailed as e:
                     raise cherrypy.HTTPError(401, str(e))
-                return klass(auth_args['username'])
+
+                auth_cache.add_credentials(auth_type, username, password)
+                return klass(username)
 
 
 class PAMUser(User):
@@ -194,6 +317,36 @@ class PAMUser(User):
         return True
 
 
+class LDAPConnectionPool(object):
+    """
+    Idle connections to the LDAP servers, reused to authenticate the users
+    instead of connecting for each of them.
+    """
+
+    def __init__(self, max_idle=LDAP_POOL_SIZE):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, uri, connect):
+        with self._lock:
+            idle = self._idle.get(uri)
+            if idle:
+                return idle.pop()
+        return connect(uri)
+
+    def put(self, uri, conn):
+        with self._lock:
+            idle = self._idle.setdefault(uri, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.unbind_s()
+
+
+ldap_pool = LDAPConnectionPool()
+
+
 class LDAPUser(User):
     auth_type = 'ldap'
 
@@ -202,6 +355,9 @@ class LDAPUser(User):
 
     @staticmethod
     def authenticate(username, password):
+        # python-ldap is only needed with the ldap authentication method
+        import ldap
+
         ldap_server = config.get('authentication', 'ldap_server').strip('"')
         ldap_search_base = config.get(
             'authentication', 'ldap_search_base').strip('"')
@@ -211,17 +367,21 @@ class LDAPUser(User):
             vars={'username': username.encode('utf-8')},
         ).strip('"')
 
-        connect = ldap.open(ldap_server)
+        uri = ldap_server if '://' in ldap_server else f'ldap://{ldap_server}'
+        connect = ldap_pool.get(uri, ldap.initialize)
+        reusable = True
         try:
             result = connect.search_s(
                 ldap_search_base, ldap.SCOPE_SUBTREE, ldap_search_filter
             )
             if len(result) == 0:
                 entity = ldap_search_filter % {'username': username}
-                raise ldap.LDAPError(f'Invalid ldap entity: {entity}')
+                raise OperationFailed(
+                    'WOKAUTH0001E', {'username': username,
+                                     'code': f'Invalid ldap entity: {entity}'}
+                )
 
             connect.bind_s(result[0][0], password)
-            connect.unbind_s()
             return True
         except ldap.INVALID_CREDENTIALS:
             # invalid user password
@@ -233,8 +393,25 @@ class LDAPUser(User):
                                  'value': ldap_search_base}
             )
         except ldap.LDAPError as e:
+            # the connection may be broken
+            reusable = False
             arg = {'username': username, 'code': str(e)}
             raise OperationFailed('WOKAUTH0001E', arg)
+        finally:
+            LDAPUser._release_connection(ldap, uri, connect, reusable)
+
+    @staticmethod
+    def _release_connection(ldap, uri, connect, reusable):
+        try:
+            if reusable:
+                # bind anonymously again, as the next search must not be done
+                # with the credentials of this user
+                connect.simple_bind_s()
+                ldap_pool.put(uri, connect)
+            else:
+                connect.unbind_s()
+        except ldap.LDAPError:
+            pass
 
     def _get_groups(self):
         return None
@@ -256,20 +433,136 @@ def from_browser():
     return requestHeader == 'XMLHttpRequest'
 
 
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def get_token_key():
+    """
+    Return the key to sign the API tokens, which is created, readable by the
+    server user only, on first use.
+    """
+    global _token_key
+
+    with _token_key_lock:
+        if _token_key is not None:
+            return _token_key
+
+        path = get_api_token_key_path()
+        try:
+            with open(path, 'rb') as f:
+                key = f.read()
+        except FileNotFoundError:
+            key = b''
+
+        if len(key) < TOKEN_KEY_SIZE:
+            key = os.urandom(TOKEN_KEY_SIZE)
+            tmp_path = f'{path}.tmp'
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(key)
+            os.replace(tmp_path, path)
+
+        _token_key = key
+        return _token_key
+
+
+def _sign_token(message):
+    return hmac.new(get_token_key(), message.encode('ascii'),
+                    hashlib.sha256).digest()
+
+
+def issue_token(username, groups, role, expires_in):
+    """
+    Return a tuple (token, expiration time) of a new API token for the user.
+    """
+    now = int(time.time())
+    claims = {
+        'sub': username,
+        'role': role,
+        'groups': list(groups or []),
+        'iat': now,
+        'exp': now + expires_in,
+    }
+    payload = _b64encode(
+        json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    message = f'{TOKEN_PREFIX}.{payload}'
+    return f'{message}.{_b64encode(_sign_token(message))}', claims['exp']
+
+
+def verify_token(token):
+    """
+    Return the claims of an API token, or None if it is invalid or expired.
+    """
+    try:
+        prefix, payload, signature = token.split('.')
+        if prefix != TOKEN_PREFIX:
+            return None
+
+        expected = _sign_token(f'{prefix}.{payload}')
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+
+    if not isinstance(claims, dict) or not claims.get('sub'):
+        return None
+
+    exp = claims.get('exp')
+    if not isinstance(exp, int) or exp <= time.time():
+        return None
+
+    return claims
+
+
+def check_auth_token():
+    """
+    REST API users may authenticate with a token issued by POST /token, sent
+    in an 'Authorization: Bearer <token>' header. Tokens are verified locally,
+    with no session, PAM or LDAP access.
+    """
+    authheader = cherrypy.request.headers.get('AUTHORIZATION', '')
+    scheme, _, token = authheader.partition(' ')
+    if scheme.lower() != 'bearer':
+        return False
+
+    claims = verify_token(token.strip())
+    if claims is None:
+        e = InvalidOperation('WOKAUTH0009E')
+        raise cherrypy.HTTPError(401, str(e))
+
+    debug(f"Token authenticated for user {claims['sub']}")
+    template.set_request_identity({
+        USER_NAME: claims['sub'],
+        USER_GROUPS: claims.get('groups', []),
+        USER_ROLE: claims.get('role', 'user'),
+    })
+    return True
+
+
 def check_auth_session():
     """
     A user is considered authenticated if we have an established session open
     for the user.
     """
-    cherrypy.session.acquire_lock()
-    session = cherrypy.session.get(USER_NAME, None)
-    cherrypy.session.release_lock()
+    if template.get_request_identity() is not None:
+        # authenticated with no session, which must not be refreshed
+        return True
+
+    session = template.get_session_value(USER_NAME)
     if session is not None:
         debug(f'Session authenticated for user {session}')
         wokRobot = cherrypy.request.headers.get('Wok-Robot')
         if wokRobot == 'wok-robot':
             if (
-                time.time() - cherrypy.session[template.REFRESH]
+                time.time() - template.get_session_value(template.REFRESH, 0)
                 > int(config.get('server', 'session_timeout')) * 60
             ):
                 cherrypy.session[USER_NAME] = None
@@ -342,8 +635,12 @@ def logout():
     cherrypy.lib.sessions.close()
 
 
+@timed('auth')
 def wokauth():
     debug('Entering wokauth...')
+    if check_auth_token():
+        return
+
     session_missing = cherrypy.session.missing
     if check_auth_session():
         return
@@ -0,0 +1,150 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import mimetypes
+import os
+import urllib.parse
+
+import cherrypy
+from cherrypy.lib import encoding
+from cherrypy.lib import static
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESS_MIME_TYPES = [
+    'application/json',
+    'application/javascript',
+    'text/css',
+    'text/html',
+    'text/plain',
+    'text/xml',
+    'image/svg+xml',
+]
+
+# Precompressed variants looked up for static files, in order of preference
+PRECOMPRESSED_EXTENSIONS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def get_accepted_encodings():
+    accepted = []
+    for element in cherrypy.request.headers.elements('Accept-Encoding'):
+        if element.qvalue > 0:
+            accepted.append(element.value.lower())
+    return accepted
+
+
+def _add_vary_header():
+    response = cherrypy.serving.response
+    varies = response.headers.get('Vary', '')
+    varies = [x.strip() for x in varies.split(',') if x.strip()]
+    if 'Accept-Encoding' not in varies:
+        varies.append('Accept-Encoding')
+    response.headers['Vary'] = ', '.join(varies)
+
+
+def compress(min_size=1024, mime_types=None, level=5):
+    """
+    Compress the response body with brotli or gzip, according to the
+    Accept-Encoding request header.
+
+    Bodies smaller than min_size bytes are sent as is, as the compression
+    overhead is not worth it. Streamed responses are only compressed with
+    gzip. Clients accepting none of the supported encodings get the body
+    uncompressed.
+    """
+    request = cherrypy.serving.request
+    response = cherrypy.serving.response
+
+    if mime_types is None:
+        mime_types = COMPRESS_MIME_TYPES
+
+    # static files may already be precompressed
+    if getattr(request, 'cached', False) or \
+            'Content-Encoding' in response.headers:
+        return
+
+    content_type = response.headers.get('Content-Type', '').split(';')[0]
+    if content_type.strip() not in mime_types:
+        return
+
+    if not response.stream and len(response.collapse_body()) < min_size:
+        return
+
+    _add_vary_header()
+    accepted = get_accepted_encodings()
+    if not response.stream and brotli is not None and 'br' in accepted:
+        response.body = brotli.compress(response.collapse_body(),
+                                        quality=level)
+        response.headers['Content-Encoding'] = 'br'
+        response.headers['Content-Length'] = str(len(response.body))
+    elif 'gzip' in accepted or 'x-gzip' in accepted or '*' in accepted:
+        # CherryPy answers 406 (Not Acceptable) when the client accepts
+        # neither gzip nor identity, so only call it when gzip is accepted
+        encoding.gzip(compress_level=level, mime_types=mime_types)
+
+
+def serve_precompressed():
+    """
+    Replace a static file served by the staticdir tool by its precompressed
+    variant (<file>.br or <file>.gz), if any, when the client accepts it.
+
+    This tool must run after staticdir in the before_handler hook.
+    """
+    request = cherrypy.serving.request
+    if request.handler is not None or request.method not in ('GET', 'HEAD'):
+        return
+
+    directory = request.config.get('tools.staticdir.dir')
+    section = request.config.get('tools.staticdir.section')
+    if not request.config.get('tools.staticdir.on') or not directory:
+        return
+
+    branch = request.path_info
+    if section is not None and section != '/':
+        branch = branch[len(section):]
+    branch = urllib.parse.unquote(branch.lstrip('/'))
+
+    directory = os.path.normpath(directory)
+    filename = os.path.normpath(os.path.join(directory, branch))
+    if not filename.startswith(directory + os.sep):
+        return
+
+    accepted = get_accepted_encodings()
+    for content_encoding, ext in PRECOMPRESSED_EXTENSIONS:
+        if content_encoding not in accepted:
+            continue
+
+        if not os.path.isfile(filename + ext):
+            continue
+
+        content_types = request.config.get(
+            'tools.staticdir.content_types') or {}
+        file_ext = os.path.splitext(filename)[1].lstrip('.')
+        content_type = content_types.get(file_ext) or \
+            mimetypes.guess_type(filename)[0]
+        if content_type is None:
+            return
+
+        static.serve_file(filename + ext, content_type)
+        cherrypy.serving.response.headers['Content-Encoding'] = \
+            content_encoding
+        _add_vary_header()
+        return
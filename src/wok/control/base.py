@@ -19,8 +19,10 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
-import re
+import itertools
+import threading
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 import cherrypy
 import wok.template
@@ -29,15 +31,24 @@ from wok.auth import USER_GROUPS
 from wok.auth import USER_NAME
 from wok.auth import USER_ROLE
 from wok.auth import wokauth
+from wok.config import config
+from wok.control.filters import compile_filter
+from wok.control.utils import apply_paging_params
 from wok.control.utils import get_class_name
+from wok.control.utils import get_function_params
 from wok.control.utils import internal_redirect
 from wok.control.utils import model_fn
+from wok.control.utils import parse_paging_params
 from wok.control.utils import parse_request
 from wok.control.utils import validate_method
+from wok.control.utils import validate_model_version
 from wok.control.utils import validate_params
 from wok.exception import InvalidOperation
 from wok.exception import UnauthorizedError
 from wok.exception import WokException
+from wok.metrics import request_phase
+from wok.metrics import set_request_route
+from wok.metrics import untimed
 from wok.reqlogger import log_request
 from wok.stringutils import encode_value
 from wok.stringutils import utf8_dict
@@ -49,6 +60,107 @@ RESOURCE_DEFAULT_LOG = 'WOKRES0001L'
 
 LOG_DISABLED_METHODS = ['GET']
 
+# Maximum number of idents sent to a model lookup_many call
+BULK_LOOKUP_SIZE = 200
+
+_lookup_executor = None
+_lookup_executor_lock = threading.Lock()
+
+
+def get_lookup_executor():
+    """
+    Return the thread pool shared by all collections to look up their
+    resources concurrently.
+    """
+    global _lookup_executor
+
+    with _lookup_executor_lock:
+        if _lookup_executor is None:
+            _lookup_executor = ThreadPoolExecutor(
+                max_workers=config.getint('server', 'lookup_threads'),
+                thread_name_prefix='wok-lookup',
+            )
+    return _lookup_executor
+
+
+def get_user_info():
+    """
+    Return a tuple (name, groups, role) for the logged in user
+    """
+    return (
+        wok.template.get_session_value(USER_NAME, ''),
+        frozenset(wok.template.get_session_value(USER_GROUPS) or []),
+        wok.template.get_session_value(USER_ROLE),
+    )
+
+
+def _get_controllers(node):
+    for name, value in sorted(vars(node).items()):
+        if isinstance(value, (Resource, Collection)):
+            yield name, value
+
+
+def _get_model_methods(model, controller, operations):
+    methods = {}
+    for operation in operations:
+        name = model_fn(controller, operation)
+        methods[operation] = name if hasattr(model, name) else None
+    return methods
+
+
+def _walk_controllers(node, route, table, path):
+    # path holds the controllers of the route being walked, so a controller
+    # referring to one of its parents is not walked again and again
+    for name, controller in _get_controllers(node):
+        if id(controller) in path:
+            continue
+
+        route_name = f'{route}/{name}'
+        if isinstance(controller, Collection):
+            table[route_name] = _get_model_methods(
+                controller.model, controller, ['get_list', 'create'])
+
+            # resources are created on request, so create one to find out its
+            # methods and sub-controllers. A new one is created on each
+            # level, so a resource nested in itself is found by its class
+            if controller.resource in path:
+                continue
+            try:
+                res = controller._new_resource(None)
+            except Exception:
+                continue
+            _walk_resource(res, f'{route_name}/<ident>', table,
+                           path | {id(controller), controller.resource})
+        else:
+            _walk_resource(controller, route_name, table,
+                           path | {id(controller)})
+
+
+def _walk_resource(res, route, table, path):
+    actions = [
+        value.action_name for value in vars(res).values()
+        if getattr(value, 'action_name', None) is not None
+    ]
+    table[route] = _get_model_methods(
+        res.model, res, ['lookup', 'update', 'delete'] + sorted(actions))
+    _walk_controllers(res, route, table, path)
+
+
+def build_dispatch_table(root):
+    """
+    Map each route of the controller tree under root to the model functions
+    handling its operations, eg.:
+
+        {'/rectangles': {'get_list': 'rectangles_get_list', 'create': None},
+         '/rectangles/<ident>': {'lookup': 'rectangle_lookup', ...}}
+
+    Operations not implemented by the model are mapped to None, as requests
+    for them are answered with 405 (Method Not Allowed) or ignored.
+    """
+    table = {}
+    _walk_controllers(root, '', table, frozenset([id(root)]))
+    return table
+
 
 class Resource(object):
     """
@@ -67,6 +179,10 @@ class Resource(object):
 
     - Set the 'data' property to a JSON-serializable representation of the
       Resource.
+
+    - Optionally set self.etag to True to answer conditional GET requests. The
+      ETag is computed from the version returned by the model 'get_version'
+      method, if any, or from the response content otherwise.
     """
 
     def __init__(self, model, ident=None):
@@ -79,6 +195,7 @@ class Resource(object):
         self.admin_methods = []
         self.log_map = {}
         self.log_args = {'ident': self.ident if self.ident else ''}
+        self.etag = False
 
     def _redirect(self, action_result, code=303):
         uri_params = []
@@ -135,6 +252,7 @@ class Resource(object):
         def wrapper(*args, **kwargs):
             # status must be always set in order to request be logged.
             # use 500 as fallback for "exception not handled" cases.
+            set_request_route(f'{get_class_name(self)}/{action_name}')
             if protected is not None and protected:
                 wokauth()
 
@@ -158,7 +276,8 @@ class Resource(object):
                     )
 
                 action_fn = getattr(self.model, model_fn(self, action_name))
-                action_result = action_fn(*model_args)
+                with request_phase('model'):
+                    action_result = action_fn(*model_args)
                 status = 200
 
                 if destructive is False or (
@@ -190,20 +309,23 @@ class Resource(object):
                     save_request_log_id(log_id, action_result['id'])
 
         wrapper.__name__ = action_name
+        wrapper.action_name = action_name
         wrapper.exposed = True
         return wrapper
 
     def lookup(self):
         try:
             lookup = getattr(self.model, model_fn(self, 'lookup'))
-            self.info = lookup(*self.model_args)
+            with request_phase('model'):
+                self.info = lookup(*self.model_args)
         except AttributeError:
             self.info = {}
 
     def delete(self):
         try:
             fn = getattr(self.model, model_fn(self, 'delete'))
-            fn(*self.model_args)
+            with request_phase('model'):
+                fn(*self.model_args)
             cherrypy.response.status = 204
         except AttributeError:
             e = InvalidOperation(
@@ -217,7 +339,9 @@ class Resource(object):
         details = None
         status = 500
 
+        set_request_route(get_class_name(self))
         method = validate_method(('GET', 'DELETE', 'PUT'), self.admin_methods)
+        kargs.pop(wok.template.PRETTY_PARAM, None)
 
         try:
             self.lookup()
@@ -253,18 +377,26 @@ class Resource(object):
 
         return result
 
-    def is_authorized(self):
-        user_name = cherrypy.session.get(USER_NAME, '')
-        user_groups = cherrypy.session.get(USER_GROUPS, [])
-        user_role = cherrypy.session.get(USER_ROLE, None)
+    def is_authorized(self, data=None, user=None):
+        """
+        Check whether the logged in user can access the Resource.
+
+        data is the Resource data and user a tuple (name, groups, role), as
+        returned by get_user_info(), to avoid computing them again when
+        checking many Resources.
+        """
+        if data is None:
+            data = self.data
+        user_name, user_groups, user_role = user or get_user_info()
 
-        users = self.data.get('users', None)
-        groups = self.data.get('groups', None)
+        users = data.get('users', None)
+        groups = data.get('groups', None)
 
         if (users is None and groups is None) or user_role == 'admin':
             return True
 
-        return user_name in users or len(set(user_groups) & set(groups)) > 0
+        return (users is not None and user_name in users) or (
+            groups is not None and not user_groups.isdisjoint(groups))
 
     def update(self, *args, **kargs):
         params = parse_request()
@@ -279,14 +411,16 @@ class Resource(object):
         validate_params(params, self, 'update')
 
         args = list(self.model_args) + [params]
-        ident = update(*args)
+        with request_phase('model'):
+            ident = update(*args)
         self._redirect(ident)
         cherrypy.response.status = 200
         self.lookup()
         return self.get()
 
     def get(self):
-        return wok.template.render(get_class_name(self), self.data)
+        etag = self.etag and not validate_model_version(self)
+        return wok.template.render(get_class_name(self), self.data, etag)
 
     def getRequestMessage(self, method, action='default'):
         """
@@ -315,7 +449,8 @@ class AsyncResource(Resource):
     def lookup(self):
         try:
             lookup = getattr(self.model, model_fn(self, 'lookup'))
-            self.info = lookup(*self.model_args)
+            with request_phase('model'):
+                self.info = lookup(*self.model_args)
         except AttributeError:
             self.info = {}
 
@@ -325,7 +460,8 @@ class AsyncResource(Resource):
     def delete(self):
         try:
             fn = getattr(self.model, model_fn(self, 'delete'))
-            task = fn(*self.model_args)
+            with request_phase('model'):
+                task = fn(*self.model_args)
         except AttributeError:
             e = InvalidOperation(
                 'WOKAPI0002E', {'resource': get_class_name(self)})
@@ -366,6 +502,23 @@ class Collection(object):
       needs additional information to identify this Collection.
 
     - Implement the base operations of 'create' and 'get_list' in the model.
+      To list the Collection in a single model call, also implement either
+      'get_list_detailed', in the Collection model, returning (ident, info)
+      pairs or 'lookup_many', in the Resource model, returning a dict of
+      infos for a list of idents. Neither is used if the Resource class
+      overrides lookup().
+
+    - Optionally set self.etag to True to answer conditional GET requests
+      (see Resource).
+
+    - Optionally set self.parallel_lookup to True to look up the Resources
+      concurrently when listing the Collection. This is useful when the model
+      lookup is slow (eg. it runs a command) and thread-safe.
+
+    - Optionally set self.model_paging to True to hand _limit and _offset
+      over to the model get_list, when it accepts them. Only do it if no
+      Resource returned by the model may be dropped afterwards, ie. the
+      lookups do not fail and the user is authorized to see all of them.
     """
 
     def __init__(self, model):
@@ -376,6 +529,9 @@ class Collection(object):
         self.admin_methods = []
         self.log_map = {}
         self.log_args = {}
+        self.etag = False
+        self.parallel_lookup = False
+        self.model_paging = False
 
     def create(self, params, *args):
         try:
@@ -387,7 +543,8 @@ class Collection(object):
 
         validate_params(params, self, 'create')
         args = self.model_args + [params]
-        name = create(*args)
+        with request_phase('model'):
+            name = create(*args)
         cherrypy.response.status = 201
         args = self.resource_args + [name]
         res = self.resource(self.model, *args)
@@ -395,32 +552,201 @@ class Collection(object):
         return res.get()
 
     def _get_resources(self, flag_filter):
+        return list(self._iter_resources(flag_filter))
+
+    def _overrides(self, name):
+        # subclasses customizing the listing override _get_resources or
+        # filter_data, which return lists, rather than their iterators
+        return getattr(type(self), name) is not getattr(Collection, name)
+
+    def _iter_resources(self, flag_filter):
+        """
+        Yield the looked up resources of the collection, in the order
+        returned by the model. Lookups are done as the resources are
+        consumed.
+        """
+        get_list_detailed = self._get_list_detailed()
+        if get_list_detailed is not None:
+            with request_phase('model'):
+                infos = get_list_detailed(*self.model_args, **flag_filter)
+            for ident, info in infos:
+                res = self._new_resource(ident)
+                res.info = info
+                yield res
+            return
+
         try:
             get_list = getattr(self.model, model_fn(self, 'get_list'))
-            idents = get_list(*self.model_args, **flag_filter)
-            res_list = []
-            for ident in idents:
-                # internal text, get_list changes ident to unicode for sorted
-                args = self.resource_args + [ident]
-                res = self.resource(self.model, *args)
-                try:
-                    res.lookup()
-                except Exception as e:
-                    # In case of errors when fetching a resource info, pass and
-                    # log the error, so, other resources are returned
-                    # Encoding error message as ident is also encoded value.
-                    # This has to be done to avoid unicode error,
-                    # as combination of encoded and unicode value results into
-                    # unicode error.
-                    wok_log.error(
-                        f"Problem in lookup of resource '{ident}'. "
-                        f'Detail: {encode_value(str(e))}'
-                    )
-                    continue
-                res_list.append(res)
-            return res_list
+            with request_phase('model'):
+                idents = get_list(*self.model_args, **flag_filter)
         except AttributeError:
-            return []
+            return
+
+        lookup_many = self._get_lookup_many()
+        if lookup_many is not None:
+            resources = self._lookup_bulk(lookup_many, idents)
+        elif self.parallel_lookup:
+            resources = self._lookup_parallel(idents)
+        else:
+            resources = (self._lookup_resource(ident) for ident in idents)
+
+        for res in resources:
+            if res is not None:
+                yield res
+
+    def _new_resource(self, ident):
+        # internal text, get_list changes ident to unicode for sorted
+        args = self.resource_args + [ident]
+        return self.resource(self.model, *args)
+
+    def _get_list_detailed(self):
+        # resources overriding lookup must be looked up one by one
+        if self.resource.lookup is not Resource.lookup:
+            return None
+        return getattr(self.model, model_fn(self, 'get_list_detailed'), None)
+
+    def _get_lookup_many(self):
+        # resources overriding lookup must be looked up one by one
+        if self.resource.lookup is not Resource.lookup:
+            return None
+
+        # same name model_fn() gives for the resource instances
+        name = f'{self.resource.__name__.lower()}_lookup_many'
+        return getattr(self.model, name, None)
+
+    def _lookup_bulk(self, lookup_many, idents):
+        """
+        Look up the resources through the model lookup_many method, which
+        receives the resource model arguments with a list of idents in place
+        of the ident, and returns a dict mapping each ident to its info.
+
+        Idents are sent in batches of BULK_LOOKUP_SIZE. If a batch fails, its
+        resources are looked up one by one.
+        """
+        idents = iter(idents)
+        while True:
+            batch = list(itertools.islice(idents, BULK_LOOKUP_SIZE))
+            if not batch:
+                return
+
+            resources = [self._new_resource(ident) for ident in batch]
+            model_args = list(resources[0].model_args[:-1])
+            try:
+                with request_phase('model'):
+                    infos = lookup_many(*model_args, batch)
+            except Exception as e:
+                wok_log.error(
+                    f'Problem in bulk lookup of resources {batch}. '
+                    f'Detail: {encode_value(str(e))}'
+                )
+                for ident in batch:
+                    yield self._lookup_resource(ident)
+                continue
+
+            for ident, res in zip(batch, resources):
+                if ident not in infos:
+                    wok_log.error(f"Problem in lookup of resource '{ident}'.")
+                    continue
+                res.info = infos[ident]
+                yield res
+
+    def _lookup_resource(self, ident):
+        res = self._new_resource(ident)
+        try:
+            res.lookup()
+        except Exception as e:
+            # In case of errors when fetching a resource info, pass and
+            # log the error, so, other resources are returned
+            # Encoding error message as ident is also encoded value.
+            # This has to be done to avoid unicode error,
+            # as combination of encoded and unicode value results into
+            # unicode error.
+            wok_log.error(
+                f"Problem in lookup of resource '{ident}'. "
+                f'Detail: {encode_value(str(e))}'
+            )
+            return None
+        return res
+
+    def _lookup_parallel(self, idents):
+        """
+        Look up the resources concurrently in the shared lookup thread pool,
+        yielding them in the same order of idents.
+
+        Idents are submitted in batches of the pool size, so a partially
+        consumed collection does not look up all of its resources.
+
+        The time waiting for a batch is measured as model time of the
+        request, not the time of each lookup, as they run concurrently.
+        """
+        executor = get_lookup_executor()
+        batch_size = config.getint('server', 'lookup_threads')
+
+        # lookups may rely on the request context (eg. session)
+        serving = dict(cherrypy.serving.__dict__)
+
+        def _lookup(ident):
+            cherrypy.serving.__dict__.update(serving)
+            try:
+                with untimed():
+                    return self._lookup_resource(ident)
+            finally:
+                cherrypy.serving.clear()
+
+        idents = iter(idents)
+        while True:
+            batch = list(itertools.islice(idents, batch_size))
+            if not batch:
+                return
+
+            with request_phase('model'):
+                resources = list(executor.map(_lookup, batch))
+            yield from resources
+
+    def _push_paging_params(self, paging, flag_filter, fields_filter):
+        """
+        Hand the paging parameters over to the model method listing the
+        collection when it accepts them by name (eg. def get_list(self,
+        _sort=None)), so the model can avoid fetching the whole collection.
+
+        _limit and _offset are only handed over together, when the collection
+        allows it (see model_paging), when there is no field filter, as
+        filtering is done after get_list, when the listing is not customized
+        by overriding _get_resources or filter_data, and when the sort, if
+        any, is done by the model too.
+
+        Returns the names of the parameters handled by the model.
+        """
+        get_list = self._get_list_detailed()
+        if get_list is None:
+            try:
+                get_list = getattr(self.model, model_fn(self, 'get_list'))
+            except AttributeError:
+                return set()
+
+        accepted = get_function_params(get_list)
+        pushed = set()
+
+        if '_sort' in paging and '_sort' in accepted:
+            pushed.add('_sort')
+
+        if not fields_filter:
+            if (
+                self.model_paging
+                and not self._overrides('_get_resources')
+                and not self._overrides('filter_data')
+                and {'_limit', '_offset'} <= accepted
+                and ('_sort' not in paging or '_sort' in pushed)
+            ):
+                pushed.update({'_limit', '_offset'})
+            if '_fields' in paging and '_fields' in accepted:
+                pushed.add('_fields')
+
+        for param in pushed:
+            if param in paging:
+                flag_filter[param] = paging[param]
+
+        return pushed
 
     def _cp_dispatch(self, vpath):
         if vpath:
@@ -431,22 +757,23 @@ class Collection(object):
             return self.resource(self.model, *args)
 
     def filter_data(self, resources, fields_filter):
-        data = []
+        return list(self._iter_filtered_data(resources, fields_filter))
+
+    def _iter_filtered_data(self, resources, fields_filter):
+        matches = compile_filter(fields_filter)
+        user = get_user_info()
+
         for res in resources:
-            if not res.is_authorized():
-                continue
+            # data may be computed on each access
+            data = res.data
 
-            if all(
-                key in res.data and
-                (
-                    res.data[key] == val or
-                    re.match(str(val), res.data[key]) or
-                    (isinstance(val, list) and res.data[key] in val)
-                )
-                for key, val in fields_filter.items()
-            ):
-                data.append(res.data)
-        return data
+            if type(res).is_authorized is Resource.is_authorized:
+                authorized = res.is_authorized(data, user)
+            else:
+                authorized = res.is_authorized()
+
+            if authorized and matches(data):
+                yield data
 
     def get(self, filter_params):
         def _split_filter(params):
@@ -457,10 +784,20 @@ class Collection(object):
                     flag_filter[key] = fields_filter.pop(key)
             return flag_filter, fields_filter
 
+        etag = self.etag and not validate_model_version(self, filter_params)
         flag_filter, fields_filter = _split_filter(filter_params)
-        resources = self._get_resources(flag_filter)
-        data = self.filter_data(resources, fields_filter)
-        return wok.template.render(get_class_name(self), data)
+        paging = parse_paging_params(flag_filter)
+        pushed = self._push_paging_params(paging, flag_filter, fields_filter)
+        if self._overrides('_get_resources'):
+            resources = self._get_resources(flag_filter)
+        else:
+            resources = self._iter_resources(flag_filter)
+        if self._overrides('filter_data'):
+            data = self.filter_data(resources, fields_filter)
+        else:
+            data = self._iter_filtered_data(resources, fields_filter)
+        data = apply_paging_params(data, paging, pushed)
+        return wok.template.render(get_class_name(self), data, etag)
 
     def getRequestMessage(self, method):
         """
@@ -478,11 +815,13 @@ class Collection(object):
         status = 500
 
         params = {}
+        set_request_route(get_class_name(self))
         method = validate_method(('GET', 'POST'), self.admin_methods)
 
         try:
             if method == 'GET':
-                params = cherrypy.request.params
+                params = dict(cherrypy.request.params)
+                params.pop(wok.template.PRETTY_PARAM, None)
                 validate_params(params, self, 'get_list')
                 return self.get(params)
             elif method == 'POST':
@@ -530,7 +869,8 @@ class AsyncCollection(Collection):
 
         validate_params(params, self, 'create')
         args = self.model_args + [params]
-        task = create(*args)
+        with request_phase('model'):
+            task = create(*args)
         cherrypy.response.status = 202
 
         # log request
@@ -562,7 +902,8 @@ class SimpleCollection(Collection):
         res_list = []
         try:
             get_list = getattr(self.model, model_fn(self, 'get_list'))
-            res_list = get_list(*self.model_args)
+            with request_phase('model'):
+                res_list = get_list(*self.model_args)
         except AttributeError:
             pass
         return wok.template.render(get_class_name(self), res_list)
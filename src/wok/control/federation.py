@@ -0,0 +1,44 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# Code derived from Kimchi Project
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import cherrypy
+import wok.template
+from wok.control.base import SimpleCollection
+from wok.control.utils import get_class_name
+from wok.control.utils import model_fn
+from wok.control.utils import UrlSubNode
+
+
+@UrlSubNode('federation', True)
+class Federation(SimpleCollection):
+    """
+    Get a path from all Wok peers at once, eg. GET /federation?path=/tasks
+    """
+
+    def __init__(self, model):
+        super(Federation, self).__init__(model)
+        self.admin_methods = ['GET']
+
+    def get(self, filter_params):
+        get_list = getattr(self.model, model_fn(self, 'get_list'))
+        # peers accept the same credentials as this server
+        authorization = cherrypy.request.headers.get('Authorization')
+        data = get_list(filter_params['path'], authorization)
+        return wok.template.render(get_class_name(self), data)
@@ -0,0 +1,141 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import operator
+import re
+
+from wok.exception import InvalidParameter
+
+# Separator between a field name and a comparison operator in a filter
+# parameter, eg. GET /tasks?status__in=running,failed
+OPERATOR_SEP = '__'
+
+NUMBER_OPERATORS = {
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'lt': operator.lt,
+    'le': operator.le,
+}
+
+
+def _to_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _split_values(value):
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    return str(value).split(',')
+
+
+def _match_default(val):
+    """
+    The value matches if it is equal to val, if it is a string matching the
+    val regular expression or if it is one of the val items when val is a
+    list.
+    """
+    if isinstance(val, list):
+        choices = set(val)
+        return lambda value: str(value) in choices
+
+    try:
+        regex = re.compile(str(val))
+    except re.error:
+        regex = None
+
+    def _match(value):
+        if value == val or str(value) == val:
+            return True
+        return (
+            regex is not None
+            and isinstance(value, str)
+            and regex.match(value) is not None
+        )
+
+    return _match
+
+
+def _match_number(op, field, val):
+    fn = NUMBER_OPERATORS[op]
+    number = _to_number(val)
+    if number is None:
+        raise InvalidParameter(
+            'WOKAPI0010E', {'param': f'{field}{OPERATOR_SEP}{op}',
+                            'value': str(val)})
+
+    def _match(value):
+        value = _to_number(value)
+        return value is not None and fn(value, number)
+
+    return _match
+
+
+def compile_predicate(key, val):
+    """
+    Return a tuple (field, predicate) for a filter parameter, where predicate
+    is a function that receives a field value and tells whether it matches.
+
+    The parameter key may end with an operator: gt, ge, lt, le (numeric
+    comparisons), prefix, in (comma-separated list of values) or ne.
+    """
+    field, sep, op = key.rpartition(OPERATOR_SEP)
+    if not sep or not field:
+        return key, _match_default(val)
+
+    if op in NUMBER_OPERATORS:
+        return field, _match_number(op, field, val)
+
+    if op == 'prefix':
+        prefix = str(val)
+        return field, lambda value: str(value).startswith(prefix)
+
+    if op == 'in':
+        choices = set(_split_values(val))
+        return field, lambda value: str(value) in choices
+
+    if op == 'ne':
+        return field, lambda value: value != val and str(value) != str(val)
+
+    # not an operator: the separator is part of the field name
+    return key, _match_default(val)
+
+
+def compile_filter(fields_filter):
+    """
+    Compile the filter parameters of a request into a single function which
+    receives a resource data and returns True if it matches all of them.
+
+    Predicates are built once per request, so filtering a collection does
+    not compile regular expressions or parse values for each resource.
+    """
+    predicates = [compile_predicate(k, v) for k, v in fields_filter.items()]
+
+    def _matches(data):
+        for field, predicate in predicates:
+            if field not in data or not predicate(data[field]):
+                return False
+        return True
+
+    return _matches
@@ -0,0 +1,37 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import cherrypy
+from wok.control.base import SimpleCollection
+from wok.control.utils import UrlSubNode
+from wok.metrics import render_metrics
+
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+@UrlSubNode('metrics', True)
+class Metrics(SimpleCollection):
+    def __init__(self, model):
+        super(Metrics, self).__init__(model)
+        self.admin_methods = ['GET']
+
+    def get(self, filter_params):
+        # served in the Prometheus text format, whatever the Accept header
+        cherrypy.response.headers['Content-Type'] = PROMETHEUS_CONTENT_TYPE
+        return render_metrics().encode('utf-8')
@@ -26,6 +26,7 @@ class Notifications(Collection):
     def __init__(self, model):
         super(Notifications, self).__init__(model)
         self.resource = Notification
+        self.etag = True
 
 
 class Notification(Resource):
@@ -18,7 +18,10 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import wok.template
 from wok.control.base import SimpleCollection
+from wok.control.utils import get_class_name
+from wok.control.utils import model_fn
 from wok.control.utils import UrlSubNode
 
 
@@ -27,3 +30,10 @@ class Peers(SimpleCollection):
     def __init__(self, model):
         super(Peers, self).__init__(model)
         self.admin_methods = ['GET']
+
+    def get(self, filter_params):
+        # peers are discovered in background, unless a refresh is requested
+        refresh = filter_params.get('refresh') in ('1', 'true')
+        get_list = getattr(self.model, model_fn(self, 'get_list'))
+        res_list = get_list(*self.model_args, refresh=refresh)
+        return wok.template.render(get_class_name(self), res_list)
@@ -28,6 +28,7 @@ class Tasks(Collection):
     def __init__(self, model):
         super(Tasks, self).__init__(model)
         self.resource = Task
+        self.etag = True
 
 
 class Task(Resource):
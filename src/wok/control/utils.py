@@ -19,20 +19,45 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 #
+import hashlib
+import inspect
+import itertools
 import json
 
 import cherrypy
+import wok.template
 from jsonschema import Draft3Validator
 from jsonschema import FormatChecker
+from jsonschema import RefResolver
 from jsonschema.exceptions import ValidationError
+from wok.auth import USER_NAME
 from wok.auth import USER_ROLE
 from wok.exception import InvalidParameter
 from wok.exception import OperationFailed
+from wok.metrics import timed
 from wok.utils import import_module
 from wok.utils import list_path_modules
 
 
+# controller class -> class name and (controller class, method) -> model
+# function name, as they are computed on every request
+_class_names = {}
+_model_fns = {}
+
+
 def get_class_name(cls):
+    if isinstance(cls, type):
+        return _get_class_name(cls)
+
+    klass = type(cls)
+    try:
+        return _class_names[klass]
+    except KeyError:
+        name = _class_names[klass] = _get_class_name(cls)
+        return name
+
+
+def _get_class_name(cls):
     try:
         sub_class = cls.__subclasses__()[0]
     except AttributeError:
@@ -41,7 +66,150 @@ def get_class_name(cls):
 
 
 def model_fn(cls, fn_name):
-    return f'{get_class_name(cls)}_{fn_name}'
+    key = (type(cls), fn_name)
+    try:
+        return _model_fns[key]
+    except KeyError:
+        pass
+
+    name = f'{get_class_name(cls)}_{fn_name}'
+    if not isinstance(cls, type):
+        _model_fns[key] = name
+    return name
+
+
+def validate_model_version(instance, params=None):
+    """
+    Answer a conditional GET using the version provided by the model.
+
+    Models may implement <name>_get_version() returning a value that changes
+    whenever the data changes. If it is available, the ETag is computed from
+    that version, so requests with a matching If-None-Match header are
+    answered with 304 (Not Modified) before any data is looked up or rendered.
+
+    Returns False if the model does not provide a version.
+    """
+    try:
+        get_version = getattr(instance.model, model_fn(instance, 'get_version'))
+    except AttributeError:
+        return False
+
+    version = get_version(*instance.model_args)
+    if version is None or not wok.template.can_accept('application/json'):
+        return False
+
+    # the same version may be represented differently depending on the
+    # request parameters, the user and the language
+    tag = json.dumps(
+        [
+            str(version),
+            sorted((params or {}).items()),
+            wok.template.get_session_value(USER_NAME),
+            wok.template.get_lang(),
+            wok.template.is_pretty_requested(),
+        ],
+        default=str,
+    )
+    wok.template.validate_etag(hashlib.sha1(tag.encode('utf-8')).hexdigest())
+    return True
+
+
+def get_function_params(fn):
+    """
+    Return the names of the parameters accepted by fn
+    """
+    try:
+        return set(inspect.signature(fn).parameters)
+    except (TypeError, ValueError):
+        return set()
+
+
+def parse_paging_params(flag_filter):
+    """
+    Remove the paging parameters (_limit, _offset, _sort and _fields) from
+    flag_filter and return them parsed in a dict.
+
+    _sort and _fields are comma-separated lists of field names. Prefix a sort
+    field with '-' for descending order.
+    """
+    paging = {}
+    for param in ('_limit', '_offset'):
+        if param not in flag_filter:
+            continue
+
+        value = flag_filter.pop(param)
+        try:
+            paging[param] = int(value)
+            if paging[param] < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise InvalidParameter(
+                'WOKAPI0010E', {'param': param, 'value': str(value)})
+
+    for param in ('_sort', '_fields'):
+        if param not in flag_filter:
+            continue
+
+        value = flag_filter.pop(param)
+        if isinstance(value, list):
+            value = ','.join(value)
+        fields = [field.strip() for field in str(value).split(',')]
+        if not all(field.lstrip('-') for field in fields):
+            raise InvalidParameter(
+                'WOKAPI0010E', {'param': param, 'value': str(value)})
+        paging[param] = fields
+
+    return paging
+
+
+def _sort_data(data, sort_fields):
+    data = list(data)
+
+    # stable sorts from the least to the most significant field
+    for field in reversed(sort_fields):
+        reverse = field.startswith('-')
+        key = field.lstrip('-')
+
+        def _sort_key(item):
+            value = item.get(key)
+            return (value is None, value)
+
+        try:
+            data.sort(key=_sort_key, reverse=reverse)
+        except TypeError:
+            # values of different types: compare them as text
+            data.sort(key=lambda item: str(item.get(key)), reverse=reverse)
+
+    return data
+
+
+def apply_paging_params(data, paging, pushed=()):
+    """
+    Sort, slice and project data according to the paging parameters, except
+    for the ones already handled by the model (pushed).
+
+    data may be any iterable. When no sort is needed, it is consumed only
+    up to the last element of the requested page.
+    """
+    if '_sort' in paging and '_sort' not in pushed:
+        data = _sort_data(data, paging['_sort'])
+
+    if not {'_limit', '_offset'} & set(pushed):
+        offset = paging.get('_offset', 0)
+        limit = paging.get('_limit')
+        stop = None if limit is None else offset + limit
+        data = itertools.islice(data, offset, stop)
+
+    data = list(data)
+
+    fields = paging.get('_fields')
+    if fields is not None:
+        data = [
+            {key: item[key] for key in fields if key in item}
+            for item in data
+        ]
+
+    return data
 
 
 def validate_method(allowed, admin_methods):
@@ -49,7 +217,7 @@ def validate_method(allowed, admin_methods):
     if method not in allowed:
         raise cherrypy.HTTPError(405)
 
-    user_role = cherrypy.session.get(USER_ROLE, None)
+    user_role = wok.template.get_session_value(USER_ROLE)
     if user_role and user_role != 'admin' and method in admin_methods:
         raise cherrypy.HTTPError(403)
 
@@ -96,20 +264,54 @@ def internal_redirect(url):
     raise cherrypy.InternalRedirect(url)
 
 
+_format_checker = FormatChecker()
+
+
+def get_validator(root, operation):
+    """
+    Return the schema validator for an API operation of the application root,
+    or None if there is no schema for it.
+
+    Validators are built on first use, against the operation sub-schema only,
+    and kept in the root object, as creating a validator is costly.
+    """
+    validators = getattr(root, '_schema_validators', None)
+    if validators is None:
+        validators = root._schema_validators = {}
+
+    try:
+        return validators[operation]
+    except KeyError:
+        pass
+
+    api_schema = root.api_schema
+    schema = api_schema.get('properties', {}).get(operation)
+    validator = None
+    if schema is not None:
+        # the operation schema may refer to the API.json definitions
+        validator = Draft3Validator(
+            schema,
+            resolver=RefResolver.from_schema(api_schema),
+            format_checker=_format_checker,
+        )
+
+    validators[operation] = validator
+    return validator
+
+
+@timed('validation')
 def validate_params(params, instance, action):
     root = cherrypy.request.app.root
 
-    if hasattr(root, 'api_schema'):
-        api_schema = root.api_schema
-    else:
+    if not hasattr(root, 'api_schema'):
         return
 
-    operation = model_fn(instance, action)
-    validator = Draft3Validator(api_schema, format_checker=FormatChecker())
-    request = {operation: params}
+    validator = get_validator(root, model_fn(instance, action))
+    if validator is None:
+        return
 
     try:
-        validator.validate(request)
+        validator.validate(params)
     except ValidationError as e:
         if e.schema.get('error'):
             raise InvalidParameter(e.schema['error'], {
@@ -31,6 +31,7 @@ messages = {
     'WOKAPI0007E': _('This API only supports JSON'),
     'WOKAPI0008E': _('Parameters does not match requirement in schema: %(err)s'),
     'WOKAPI0009E': _("You don't have permission to perform this operation."),
+    'WOKAPI0010E': _("Invalid value '%(value)s' for parameter %(param)s."),
 
     'WOKASYNC0001E': _('Unable to find task id: %(id)s'),
     'WOKASYNC0002E': _('There is no callback to execute the kill task process.'),
@@ -45,6 +46,9 @@ messages = {
     'WOKAUTH0006E': _('Specify password to login into Wok.'),
     'WOKAUTH0007E': _('You need to specify username and password to login into Wok.'),
     'WOKAUTH0008E': _('The username or password you entered is incorrect. Please try again'),
+    'WOKAUTH0009E': _('Invalid or expired API token.'),
+    'WOKAUTH0010E': _('API tokens can only be issued to users authenticated with a password or a session.'),
+    'WOKAUTH0011E': _('Token lifetime must be an integer between 60 and 2592000 seconds.'),
 
     'WOKLOG0001E': _('Invalid filter parameter. Filter parameters allowed: %(filters)s'),
     'WOKLOG0002E': _('Creation of log file failed: %(err)s'),
@@ -62,6 +66,15 @@ messages = {
 
     'WOKPLUGIN0001E': _('Unable to find plug-in %(name)s'),
 
+    'WOKFED0001E': _("Federation requires an absolute 'path' parameter, such as /plugins/kimchi/vms"),
+    'WOKFED0002E': _('Federated requests can not get the federation API itself.'),
+
+    'WOKPROF0001E': _('The profiler is already running.'),
+    'WOKPROF0002E': _('The profiler is not running.'),
+    'WOKPROF0003E': _('Unable to save the profile: %(err)s'),
+    'WOKPROF0004E': _('Profiling duration must be an integer between 1 and 3600 seconds.'),
+    'WOKPROF0005E': _('Sampling interval must be an integer between 1 and 1000 milliseconds.'),
+
     # These messages (ending with L) are for user log purposes
     'WOKASYNC0001L': _("Successfully completed task '%(target_uri)s'"),
     'WOKASYNC0002L': _("Failed to complete task '%(target_uri)s'"),
@@ -70,6 +83,9 @@ messages = {
     'WOKRES0001L': _('Request made on resource'),
     'WOKROOT0001L': _("User '%(username)s' login"),
     'WOKROOT0002L': _("User '%(username)s' logout"),
+    'WOKROOT0003L': _("User '%(username)s' got an API token"),
     'WOKPLUGIN0001L': _('Enable plug-in %(ident)s.'),
     'WOKPLUGIN0002L': _('Disable plug-in %(ident)s.'),
+    'WOKPROF0001L': _('Start the sampling profiler.'),
+    'WOKPROF0002L': _('Stop the sampling profiler.'),
 }
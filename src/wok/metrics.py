@@ -0,0 +1,304 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+import cherrypy
+
+# wok.utils is not imported here, as this module is imported by wok.template
+# which is imported, through wok.message, by wok.utils itself
+wok_log = cherrypy.log.error_log
+
+# Upper bounds, in seconds, of the request duration histograms buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0)
+
+# Phases of a request measured apart. The time of a phase does not include
+# the time of the phases nested in it, eg. the model lookups done while the
+# response of a collection is rendered.
+PHASES = ('auth', 'validation', 'model', 'render', 'log')
+
+# Route of the requests not handled by a Resource or Collection, eg. static
+# files and login pages
+OTHER_ROUTE = 'other'
+
+_histograms = {}
+_requests = {}
+_metrics_lock = threading.Lock()
+_timings_lock = threading.Lock()
+
+# stack of the phases running in the current thread: [phase, start]
+_local = threading.local()
+
+
+class Histogram(object):
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        Return a list of tuples (upper bound, number of observations less or
+        equal to it), ending with the '+Inf' bound.
+        """
+        total = 0
+        counts = []
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            counts.append((bound, total))
+        return counts
+
+
+def _get_timings():
+    if getattr(_local, 'untimed', False):
+        return None
+    return getattr(cherrypy.serving.request, 'wok_timings', None)
+
+
+def _get_phases_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _add_time(timings, phase, elapsed):
+    with _timings_lock:
+        timings[phase] = timings.get(phase, 0.0) + elapsed
+
+
+@contextlib.contextmanager
+def untimed():
+    """
+    Context manager to not measure the phases run in a block by a helper
+    thread of the current request, eg. a parallel lookup. The thread of the
+    request measures the time it waits for its helpers instead, so the time
+    spent concurrently is not counted more than once.
+    """
+    previous = getattr(_local, 'untimed', False)
+    _local.untimed = True
+    try:
+        yield
+    finally:
+        _local.untimed = previous
+
+
+class request_phase(object):
+    """
+    Context manager to add the time spent in a block to a phase of the
+    current request. It does nothing out of a measured request.
+    """
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.timings = _get_timings()
+        if self.timings is None:
+            return
+
+        now = time.perf_counter()
+        stack = _get_phases_stack()
+        if stack:
+            # pause the outer phase
+            outer = stack[-1]
+            _add_time(self.timings, outer[0], now - outer[1])
+        stack.append([self.phase, now])
+
+    def __exit__(self, *exc_info):
+        if self.timings is None:
+            return
+
+        now = time.perf_counter()
+        stack = _get_phases_stack()
+        phase, start = stack.pop()
+        _add_time(self.timings, phase, now - start)
+        if stack:
+            # resume the outer phase
+            stack[-1][1] = now
+
+
+def timed(phase):
+    """
+    Decorator to add the time spent in a function to a request phase.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with request_phase(phase):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_request_route(route):
+    """
+    Set the route label of the current request metrics, usually the name of
+    the controller class handling it.
+    """
+    cherrypy.serving.request.wok_route = route
+
+
+def start_request(slow_threshold=0):
+    """
+    CherryPy tool to measure the current request. It must run on the
+    on_start_resource hook, and records the metrics once the response is
+    sent.
+
+    Requests taking slow_threshold seconds or more are logged with the time
+    spent in each phase. Zero disables the logging.
+    """
+    request = cherrypy.serving.request
+    request.wok_timings = {}
+    request.wok_route = OTHER_ROUTE
+    request.wok_start = time.perf_counter()
+    request.wok_slow_threshold = float(slow_threshold)
+    _local.stack = []
+    request.hooks.attach('on_end_request', end_request)
+
+
+def end_request():
+    request = cherrypy.serving.request
+    response = cherrypy.serving.response
+    total = time.perf_counter() - request.wok_start
+    timings = request.wok_timings
+    request.wok_timings = None
+
+    app = request.app.script_name if request.app is not None else ''
+    labels = (app, request.wok_route, request.method)
+    status = str(response.status).split(' ', 1)[0]
+
+    with _metrics_lock:
+        for phase, elapsed in [('total', total)] + list(timings.items()):
+            key = labels + (phase,)
+            histogram = _histograms.get(key)
+            if histogram is None:
+                histogram = _histograms[key] = Histogram()
+            histogram.observe(elapsed)
+
+        key = labels + (status,)
+        _requests[key] = _requests.get(key, 0) + 1
+
+    if 0 < request.wok_slow_threshold <= total:
+        _log_slow_request(request, status, total, timings)
+
+
+def _log_slow_request(request, status, total, timings):
+    other = total - sum(timings.values())
+    breakdown = [f'{phase}: {timings[phase]:.3f}s'
+                 for phase in PHASES if phase in timings]
+    breakdown.append(f'other: {max(other, 0.0):.3f}s')
+    wok_log.warning(
+        f'Slow request: {request.method} {request.path_info} ({status}) took '
+        f"{total:.3f}s ({', '.join(breakdown)})"
+    )
+
+
+def reset_metrics():
+    with _metrics_lock:
+        _histograms.clear()
+        _requests.clear()
+
+
+def _format_labels(**labels):
+    def _escape(value):
+        return str(value).replace('\\', r'\\').replace('"', r'\"') \
+            .replace('\n', r'\n')
+
+    items = [f'{name}="{_escape(value)}"' for name, value in labels.items()]
+    return '{' + ','.join(items) + '}'
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render_metrics():
+    """
+    Return the server metrics in the Prometheus text exposition format.
+    """
+    from wok.utils import get_command_cache_stats
+    from wok.utils import plugins_load_stats
+
+    with _metrics_lock:
+        histograms = [(key, h.cumulative_counts(), h.sum, h.count)
+                      for key, h in sorted(_histograms.items())]
+        requests = sorted(_requests.items())
+
+    lines = [
+        '# HELP wok_request_duration_seconds Time spent serving requests, '
+        'by phase.',
+        '# TYPE wok_request_duration_seconds histogram',
+    ]
+    for (app, route, method, phase), counts, total, count in histograms:
+        labels = dict(app=app, route=route, method=method, phase=phase)
+        for bound, value in counts:
+            lines.append(
+                'wok_request_duration_seconds_bucket'
+                f'{_format_labels(**labels, le=bound)} {value}')
+        labels = _format_labels(**labels)
+        lines.append(f'wok_request_duration_seconds_sum{labels} '
+                     f'{_format_number(total)}')
+        lines.append(f'wok_request_duration_seconds_count{labels} {count}')
+
+    lines.append('# HELP wok_requests_total Requests served, by status.')
+    lines.append('# TYPE wok_requests_total counter')
+    for (app, route, method, status), count in requests:
+        labels = _format_labels(app=app, route=route, method=method,
+                                status=status)
+        lines.append(f'wok_requests_total{labels} {count}')
+
+    stats = get_command_cache_stats()
+    for name in ('hits', 'misses', 'shared'):
+        lines.append(f'# HELP wok_command_cache_{name}_total Cached system '
+                     f'commands calls ({name}).')
+        lines.append(f'# TYPE wok_command_cache_{name}_total counter')
+        lines.append(f'wok_command_cache_{name}_total {stats[name]}')
+    lines.append('# HELP wok_command_cache_entries Cached system commands '
+                 'results.')
+    lines.append('# TYPE wok_command_cache_entries gauge')
+    lines.append(f"wok_command_cache_entries {stats['size']}")
+
+    plugins = sorted(plugins_load_stats.items())
+    lines.append('# HELP wok_plugin_load_seconds Time spent loading each '
+                 'plugin.')
+    lines.append('# TYPE wok_plugin_load_seconds gauge')
+    for plugin, stats in plugins:
+        lines.append(f'wok_plugin_load_seconds{_format_labels(plugin=plugin)} '
+                     f"{_format_number(stats['time'])}")
+    lines.append('# HELP wok_plugin_load_rss_bytes Memory used by the server '
+                 'to load each plugin.')
+    lines.append('# TYPE wok_plugin_load_rss_bytes gauge')
+    for plugin, stats in plugins:
+        lines.append(f'wok_plugin_load_rss_bytes{_format_labels(plugin=plugin)} '
+                     f"{stats['rss']}")
+
+    return '\n'.join(lines) + '\n'
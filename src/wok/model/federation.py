@@ -0,0 +1,171 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import http.client
+import json
+import ssl
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from wok.config import config
+from wok.exception import InvalidParameter
+from wok.model.peers import get_peers
+from wok.utils import wok_log
+
+
+# Maximum number of idle connections kept open to each peer
+MAX_IDLE_CONNECTIONS = 4
+# Maximum number of peers queried at the same time
+MAX_PEER_REQUESTS = 16
+
+
+class PeerConnectionPool(object):
+    """
+    Keep the HTTPS connections to the peers open between federated requests.
+    """
+
+    def __init__(self, timeout, verify_ssl):
+        self.timeout = timeout
+        self.context = ssl.create_default_context()
+        if not verify_ssl:
+            # peers usually run with the self-signed certificate created by
+            # Wok when it is installed
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, netloc):
+        """
+        Return a tuple (connection, reused), where reused tells whether the
+        connection was already used, and may have been closed by the peer.
+        """
+        with self._lock:
+            idle = self._idle.get(netloc)
+            if idle:
+                return idle.pop(), True
+        conn = http.client.HTTPSConnection(
+            netloc, timeout=self.timeout, context=self.context)
+        return conn, False
+
+    def put(self, netloc, conn):
+        with self._lock:
+            idle = self._idle.setdefault(netloc, [])
+            if len(idle) < MAX_IDLE_CONNECTIONS:
+                idle.append(conn)
+                return
+        conn.close()
+
+
+class FederationModel(object):
+    def __init__(self, **kargs):
+        verify_ssl = config.get('server', 'federation_verify_ssl') == 'on'
+        self.pool = PeerConnectionPool(
+            config.getint('server', 'federation_timeout'), verify_ssl)
+        self.executor = None
+        self._lock = threading.Lock()
+
+        # peers are discovered with no authentication, so the credentials
+        # are only sent to the ones holding a valid certificate
+        self.forward_auth = False
+        if config.get('server', 'federation_forward_auth') == 'on':
+            if verify_ssl:
+                self.forward_auth = True
+            else:
+                wok_log.warning(
+                    'Credentials are not forwarded to the federation peers '
+                    'as federation_verify_ssl is off.'
+                )
+
+    def _get_executor(self):
+        with self._lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=MAX_PEER_REQUESTS,
+                    thread_name_prefix='wok-federation',
+                )
+            return self.executor
+
+    def _request(self, peer, path, headers):
+        netloc = urllib.parse.urlsplit(peer).netloc
+        while True:
+            conn, reused = self.pool.get(netloc)
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionError):
+                conn.close()
+                # the peer closed the idle connection, try a new one
+                if not reused:
+                    raise
+            except Exception:
+                conn.close()
+                raise
+
+        self.pool.put(netloc, conn)
+        if resp.status != 200:
+            raise http.client.HTTPException(f'{resp.status} {resp.reason}')
+        return json.loads(body.decode('utf-8'))
+
+    def get_list(self, path, authorization=None):
+        """
+        Get path from all peers at the same time.
+
+        Return a dict with the 'results' of the peers which answered, by
+        peer URL, and the 'errors' of the ones which did not, in time or
+        successfully.
+        """
+        if not path.startswith('/') or path.startswith('//'):
+            raise InvalidParameter('WOKFED0001E')
+
+        # peers would query their own peers, and so on
+        if 'federation' in urllib.parse.urlsplit(path).path.split('/'):
+            raise InvalidParameter('WOKFED0002E')
+
+        headers = {'Accept': 'application/json'}
+        if authorization is not None and self.forward_auth:
+            headers['Authorization'] = authorization
+
+        executor = self._get_executor()
+        futures = {
+            executor.submit(self._request, peer, path, headers): peer
+            for peer in get_peers()
+        }
+        # connect and read timeouts apply to each request, this one bounds
+        # the time spent waiting for a free worker too
+        done, not_done = wait(futures, timeout=self.pool.timeout * 2)
+
+        results = {}
+        errors = {}
+        for future, peer in futures.items():
+            if future in not_done:
+                future.cancel()
+                errors[peer] = 'Timeout'
+                continue
+
+            try:
+                results[peer] = future.result()
+            except Exception as e:
+                wok_log.debug(f'Federated request to {peer}{path} failed: {e}')
+                errors[peer] = str(e) or type(e).__name__
+
+        return {'results': results, 'errors': errors}
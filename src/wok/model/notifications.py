@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import threading
+import uuid
 from datetime import datetime
 
 from wok.exception import NotFoundError
@@ -26,6 +28,18 @@ from wok.utils import wok_log
 
 
 notificationsStore = {}
+# number of changes of notificationsStore, and an identifier of the server
+# run, as the count starts over on every run
+_notifications_version = 0
+_notifications_run_id = uuid.uuid4().hex
+_notifications_version_lock = threading.Lock()
+
+
+def _notifications_changed():
+    global _notifications_version
+
+    with _notifications_version_lock:
+        _notifications_version += 1
 
 
 def add_notification(code, args=None, plugin_name=None):
@@ -50,6 +64,7 @@ def add_notification(code, args=None, plugin_name=None):
 
     args.update({'_plugin_name': plugin_name, 'timestamp': timestamp})
     notificationsStore[code] = args
+    _notifications_changed()
 
     send_wok_notification('', 'notifications', 'POST')
 
@@ -62,6 +77,7 @@ def del_notification(code):
     except Exception as e:
         raise OperationFailed('WOKNOT0002E', {'id': str(code), 'msg': e.msg()})
 
+    _notifications_changed()
     send_wok_notification('', 'notification', 'DELETE')
 
 
@@ -73,6 +89,10 @@ class NotificationsModel(object):
         global notificationsStore
         return notificationsStore.keys()
 
+    def get_version(self):
+        with _notifications_version_lock:
+            return f'{_notifications_run_id}-{_notifications_version}'
+
 
 class NotificationModel(object):
     def __init__(self, **kargs):
@@ -20,15 +20,43 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 import re
 import socket
+import threading
+import time
 
 import cherrypy
+from cherrypy.process.plugins import BackgroundTask
 from wok.config import config
+from wok.pushserver import send_wok_notification
 from wok.utils import run_command
 from wok.utils import wok_log
 
 
+# the PeersModel discovering the peers, if federation is on
+_peers_model = None
+
+
+def get_peers():
+    """
+    Return the URLs of the Wok peers found by the last discovery.
+    """
+    if _peers_model is None:
+        return []
+    return _peers_model.get_list()
+
+
 class PeersModel(object):
+    """
+    The peers are discovered through openSLP in background, every
+    peers_refresh_interval seconds, so listing them does not wait for the
+    multicast query.
+    """
+
     def __init__(self, **kargs):
+        self.peers = {}
+        self.last_refresh = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
         # check federation feature is enabled on Wok server
         if not config.get('server', 'federation') == 'on':
             return
@@ -45,6 +73,19 @@ class PeersModel(object):
                 f'Unable to register server on openSLP. ' f'Details: {out}')
         cherrypy.engine.subscribe('exit', self._peer_deregister)
 
+        global _peers_model
+        _peers_model = self
+
+        interval = config.getint('server', 'peers_refresh_interval')
+        self.refresh_task = BackgroundTask(interval, self.refresh)
+        self.refresh_task.start()
+        cherrypy.engine.subscribe('exit', self.refresh_task.cancel)
+
+        # first discovery, without waiting for the refresh interval
+        self.discovery_thread = threading.Thread(
+            target=self.refresh, name='wok-peers', daemon=True)
+        self.discovery_thread.start()
+
     def _peer_deregister(self):
         cmd = ['slptool', 'deregister', f'service:wokd://{self.url}']
         out, error, ret = run_command(cmd)
@@ -52,21 +93,62 @@ class PeersModel(object):
             wok_log.error(
                 f'Unable to deregister server on openSLP.' f' Details: {out}')
 
-    def get_list(self):
-        # check federation feature is enabled on Wok server
-        if not config.get('server', 'federation') == 'on':
-            return []
-
+    def _discover(self):
         cmd = ['slptool', 'findsrvs', 'service:wokd']
         out, error, ret = run_command(cmd)
         if ret != 0:
-            return []
+            return None
 
         peers = []
         for server in out.strip().split('\n'):
             match = re.match('service:wokd://(.*?),.*', server)
+            if match is None:
+                continue
             peer = match.group(1)
             if peer != self.url:
                 peers.append('https://' + peer)
 
         return peers
+
+    def refresh(self):
+        """
+        Discover the peers again, and notify the UI when they changed.
+        """
+        # a refresh requested while another one runs only waits for it
+        if not self._refresh_lock.acquire(blocking=False):
+            with self._refresh_lock:
+                return
+
+        try:
+            found = self._discover()
+            now = time.time()
+            with self._lock:
+                self.last_refresh = now
+                if found is None:
+                    return
+
+                changed = set(found) != set(self.peers)
+                self.peers = {
+                    peer: {
+                        'first_seen': self.peers.get(
+                            peer, {}).get('first_seen', now),
+                        'last_seen': now,
+                    }
+                    for peer in found
+                }
+        finally:
+            self._refresh_lock.release()
+
+        if changed:
+            send_wok_notification('', 'peers', 'PUT')
+
+    def get_list(self, refresh=False):
+        # check federation feature is enabled on Wok server
+        if not config.get('server', 'federation') == 'on':
+            return []
+
+        if refresh:
+            self.refresh()
+
+        with self._lock:
+            return sorted(self.peers)
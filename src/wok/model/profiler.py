@@ -0,0 +1,114 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import os
+import threading
+from tempfile import NamedTemporaryFile
+
+from wok.asynctask import AsyncTask
+from wok.config import get_log_download_path
+from wok.exception import InvalidOperation
+from wok.exception import OperationFailed
+from wok.model.tasks import TaskModel
+from wok.profiler import SamplingProfiler
+from wok.reqlogger import LOG_DOWNLOAD_URI
+
+
+# Default profiling duration, in seconds, and sampling interval, in
+# milliseconds
+DEFAULT_DURATION = 30
+DEFAULT_INTERVAL = 10
+
+
+class ProfilerModel(object):
+    def __init__(self, **kargs):
+        self.task = TaskModel(**kargs)
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.task_id = None
+        self.duration = None
+        self.interval = None
+        self.profile = None
+
+    def lookup(self, name):
+        with self.lock:
+            return {
+                'running': self.profiler is not None,
+                'task_id': self.task_id,
+                'duration': self.duration,
+                'interval': self.interval,
+                'profile': self.profile,
+            }
+
+    def start(self, name, duration=None, interval=None):
+        if duration is None:
+            duration = DEFAULT_DURATION
+        if interval is None:
+            interval = DEFAULT_INTERVAL
+
+        with self.lock:
+            if self.profiler is not None:
+                raise InvalidOperation('WOKPROF0001E')
+
+            profiler = SamplingProfiler(interval / 1000.0)
+            task = AsyncTask('/profiler', self._run,
+                             {'profiler': profiler, 'duration': duration})
+            self.profiler = profiler
+            self.task_id = task.id
+            self.duration = duration
+            self.interval = interval
+
+        return self.task.lookup(task.id)
+
+    def stop(self, name):
+        with self.lock:
+            if self.profiler is None:
+                raise InvalidOperation('WOKPROF0002E')
+            self.profiler.stop()
+
+    def _run(self, cb, params):
+        profiler = params['profiler']
+        cb('Profiling')
+        uri = None
+        try:
+            profiler.run(params['duration'])
+            uri = self._save_profile(profiler)
+        finally:
+            with self.lock:
+                self.profiler = None
+                if uri is not None:
+                    self.profile = uri
+
+        cb(uri, True)
+
+    def _save_profile(self, profiler):
+        """
+        Write the collapsed stacks to a file served under /data/logs, like
+        the request logs downloads, and return its URI.
+        """
+        try:
+            fd = NamedTemporaryFile(
+                mode='w', dir=get_log_download_path(), prefix='profile-',
+                suffix='.txt', delete=False
+            )
+            with fd:
+                fd.write(profiler.collapsed())
+        except IOError as e:
+            raise OperationFailed('WOKPROF0003E', {'err': str(e)})
+
+        return LOG_DOWNLOAD_URI % os.path.basename(fd.name)
@@ -20,6 +20,7 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 import time
 
+from wok.asynctask import get_tasks_version
 from wok.asynctask import tasks_queue
 from wok.exception import NotFoundError
 from wok.exception import TimeoutExpired
@@ -32,6 +33,9 @@ class TasksModel(object):
     def get_list(self):
         return tasks_queue.keys()
 
+    def get_version(self):
+        return get_tasks_version()
+
 
 class TaskModel(object):
     def __init__(self, **kargs):
@@ -33,6 +33,11 @@ from wok.exception import NotFoundError
 from wok.utils import wok_log
 
 
+# sqlite default limit of host parameters in a single statement, minus the
+# one used by the object type
+SQLITE_MAX_VARIABLES = 998
+
+
 class ObjectStoreSession(object):
     def __init__(self, conn):
         self.conn = conn
@@ -65,6 +70,25 @@ class ObjectStoreSession(object):
                 raise NotFoundError('WOKOBJST0001E', {'item': ident})
         return json.loads(jsonstr)
 
+    def get_many(self, obj_type, idents):
+        """
+        Return a dict mapping each ident found to its data, using a single
+        query per SQLITE_MAX_VARIABLES idents.
+        """
+        idents = list(idents)
+        result = {}
+        c = self.conn.cursor()
+        for i in range(0, len(idents), SQLITE_MAX_VARIABLES):
+            chunk = idents[i:i + SQLITE_MAX_VARIABLES]
+            marks = ','.join('?' * len(chunk))
+            res = c.execute(
+                f'SELECT id, json FROM objects WHERE type=? AND id IN ({marks})',
+                [obj_type] + chunk,
+            )
+            for ident, jsonstr in res:
+                result[ident] = json.loads(jsonstr)
+        return result
+
     def get_object_version(self, obj_type, ident):
         c = self.conn.cursor()
         res = c.execute(
@@ -97,6 +97,14 @@ class RectangleModel(object):
             raise NotFoundError('SPRET0002E', {'name': name})
         return {'length': rectangle.length, 'width': rectangle.width}
 
+    def lookup_many(self, names):
+        # used by the Rectangles collection to look up all rectangles at once
+        return {
+            name: {'length': self._rectangles[name].length,
+                   'width': self._rectangles[name].width}
+            for name in names if name in self._rectangles
+        }
+
     def update(self, name, params):
         if name not in self._rectangles:
             raise NotFoundError('SPRET0002E', {'name': name})
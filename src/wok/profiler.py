@@ -0,0 +1,215 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# This module must only import from the standard library, as it is used to
+# measure the time spent importing the other ones.
+import builtins
+import collections
+import contextlib
+import sys
+import threading
+import time
+
+
+_startup_profiler = None
+
+
+class StartupProfiler(object):
+    """
+    Measure the time spent in each phase of the server startup and in each
+    module imported while it is running.
+
+    Phases may be nested and the time of a module import includes the time
+    to import the modules it imports.
+    """
+
+    def __init__(self):
+        self.start_time = None
+        self.phases = []
+        self.imports = {}
+        self._local = threading.local()
+        self._import = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def stop(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(),
+                      level=0):
+        if level or name in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+
+        start = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            with self._lock:
+                if name not in self.imports:
+                    self.imports[name] = time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # phases may run in other threads, eg. the proxy configuration
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            with self._lock:
+                self.phases.append(
+                    (start, depth, name, time.perf_counter() - start))
+
+    def report(self, max_imports=25):
+        lines = ['Startup profile']
+        if self.start_time is not None:
+            total = time.perf_counter() - self.start_time
+            lines.append(f'  total: {total:.3f}s')
+
+        lines.append('Phases:')
+        with self._lock:
+            phases = sorted(self.phases)
+        for _, depth, name, elapsed in phases:
+            lines.append(f"  {'  ' * depth}{name}: {elapsed:.3f}s")
+
+        lines.append(f'Slowest imports (of {len(self.imports)}):')
+        imports = sorted(self.imports.items(), key=lambda i: i[1],
+                         reverse=True)
+        for name, elapsed in imports[:max_imports]:
+            lines.append(f'  {name}: {elapsed:.3f}s')
+
+        return '\n'.join(lines)
+
+
+def start_startup_profiler():
+    global _startup_profiler
+
+    _startup_profiler = StartupProfiler()
+    _startup_profiler.start()
+    return _startup_profiler
+
+
+def get_startup_profiler():
+    return _startup_profiler
+
+
+def startup_phase(name):
+    """
+    Context manager to measure a startup phase. It does nothing when the
+    startup is not being profiled.
+    """
+    if _startup_profiler is None:
+        return contextlib.nullcontext()
+    return _startup_profiler.phase(name)
+
+
+def stop_startup_profiler():
+    """
+    Stop profiling the startup and return the report, or None if it was not
+    being profiled.
+    """
+    global _startup_profiler
+
+    profiler, _startup_profiler = _startup_profiler, None
+    if profiler is None:
+        return None
+
+    profiler.stop()
+    return profiler.report()
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler for a running server: the stacks of all threads,
+    but the one running the profiler, are sampled every interval seconds.
+
+    Stacks are aggregated in the collapsed format read by flame graph tools:
+    one line per distinct stack, from the thread name down to the sampled
+    function, with frames separated by semicolons and followed by the number
+    of samples.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._labels = {}
+        self._stop = threading.Event()
+
+    def _get_label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'
+            label = self._labels[code] = label.replace(';', ':')
+        return label
+
+    def sample(self):
+        own_ident = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(self._get_label(frame.f_code))
+                frame = frame.f_back
+            name = names.get(ident, f'thread-{ident}')
+            stack.append(name.replace(';', ':'))
+            stack.reverse()
+            self.stacks[';'.join(stack)] += 1
+
+        self.samples += 1
+
+    def run(self, duration):
+        """
+        Sample the threads stacks during duration seconds, or until stop() is
+        called.
+        """
+        deadline = time.monotonic() + duration
+        next_sample = time.monotonic()
+
+        while not self._stop.is_set():
+            self.sample()
+
+            # keep the sampling rate, but skip the samples missed when
+            # sampling takes longer than the interval
+            now = time.monotonic()
+            next_sample += self.interval
+            if next_sample < now:
+                next_sample = now + self.interval
+            if now >= deadline:
+                break
+            self._stop.wait(min(next_sample, deadline) - now)
+
+    def stop(self):
+        self._stop.set()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n'
+                       for stack, count in self.stacks.most_common())
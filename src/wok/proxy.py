@@ -24,12 +24,22 @@
 # and configure the Nginx proxy.
 import os
 
-from wok import sslcert
 from wok.config import paths
 from wok.utils import run_command
 
 
-DH_COMMAND = 'openssl dhparam -dsaparam -out %s 2048'
+# 2048-bit finite field Diffie-Hellman group ffdhe2048, from RFC 7919. A well
+# known group is as safe as a generated one and is written at once, while
+# generating one takes from seconds to minutes on each new installation.
+FFDHE2048_PEM = b"""-----BEGIN DH PARAMETERS-----
+MIIBCAKCAQEA//////////+t+FRYortKmq/cViAnPTzx2LnFg84tNpWp4TZBFGQz
++8yTnc4kmz75fS/jY2MMddj2gbICrsRhetPfHtXV/WVhJDP1H18GbtCFY2VVPe0a
+87VXE15/V8k1mE8McODmi3fipona8+/och3xWKE2rec1MKzKT0g6eXq8CrGCsyT7
+YdEIqUuyyOP7uWrat2DX9GgdT0Kj3jlN9K5W7edjcrsZCwenyO4KbXCeAvzhzffi
+7MA0BM0oNC9hkXL+nOmFg/+OTxIy7vKBg8P+OxtMb61zO7X8vC7CIAXFjvGDfRaD
+ssbzSibBsu/6iGtCOGEoXJf//////////wIBAg==
+-----END DH PARAMETERS-----
+"""
 
 
 def check_proxy_config():
@@ -54,16 +64,20 @@ def check_proxy_config():
                 os.remove(link)
             os.symlink(item['target'], link)
 
-    # Generate unique Diffie-Hellman group with 2048-bit
+    # Diffie-Hellman group with 2048-bit
     dh_file = os.path.join(paths.sys_conf_dir, 'dhparams.pem')
     if not os.path.exists(dh_file):
-        os.system(DH_COMMAND % dh_file)
+        with open(dh_file, 'wb') as f:
+            f.write(FFDHE2048_PEM)
 
     # Create cert files if they don't exist
     cert = os.path.join(paths.sys_conf_dir, 'wok-cert.pem')
     key = os.path.join(paths.sys_conf_dir, 'wok-key.pem')
 
     if not os.path.exists(cert) or not os.path.exists(key):
+        # pyOpenSSL is only needed to create the certificate
+        from wok import sslcert
+
         ssl_gen = sslcert.SSLCert()
         with open(cert, 'wb') as f:
             f.write(ssl_gen.cert_pem())
@@ -33,8 +33,10 @@ from wok.config import paths
 from wok.exception import InvalidParameter
 from wok.exception import OperationFailed
 from wok.message import WokMessage
+from wok.metrics import timed
 from wok.pushserver import send_wok_notification
 from wok.stringutils import ascii_dict
+from wok.template import get_session_value
 from wok.utils import remove_old_files
 
 
@@ -71,6 +73,7 @@ WOK_REQUEST_LOGGER = 'wok_request_logger'
 ASYNCTASK_REQUEST_METHOD = 'TASK'
 
 
+@timed('log')
 def log_request(
     code,
     params,
@@ -111,7 +114,7 @@ def log_request(
         app = cherrypy.request.app.script_name
 
     if user is None:
-        user = cherrypy.session.get(USER_NAME, 'N/A') or 'N/A'
+        user = get_session_value(USER_NAME, 'N/A') or 'N/A'
 
     if ip is None:
         ip = cherrypy.request.remote.ip
@@ -27,10 +27,13 @@ from distutils.version import LooseVersion
 import cherrypy
 from wok import auth
 from wok import template
+from wok.config import config
 from wok.config import paths as wok_paths
 from wok.control import sub_nodes
+from wok.control.base import build_dispatch_table
 from wok.control.base import Resource
 from wok.control.utils import parse_request
+from wok.control.utils import validate_method
 from wok.control.utils import validate_params
 from wok.exception import OperationFailed
 from wok.exception import UnauthorizedError
@@ -38,9 +41,16 @@ from wok.exception import WokException
 from wok.i18n import messages
 from wok.pushserver import send_wok_notification
 from wok.reqlogger import log_request
+from wok.utils import wok_log
 
 
-ROOT_REQUESTS = {'POST': {'login': 'WOKROOT0001L', 'logout': 'WOKROOT0002L'}}
+ROOT_REQUESTS = {
+    'POST': {
+        'login': 'WOKROOT0001L',
+        'logout': 'WOKROOT0002L',
+        'token': 'WOKROOT0003L',
+    }
+}
 
 
 class Root(Resource):
@@ -68,6 +78,31 @@ class Root(Resource):
                  for key in self._handled_error]
             )
 
+    @property
+    def dispatch_table(self):
+        """
+        Table of the model functions handling each API route, built on first
+        use as it is only needed for introspection. The operations the model
+        does not implement are logged then.
+        """
+        table = self.__dict__.get('_dispatch_table')
+        if table is not None:
+            return table
+
+        table = self._dispatch_table = build_dispatch_table(self)
+        missing = [
+            f'{route} {operation}'
+            for route, methods in sorted(table.items())
+            for operation, name in methods.items()
+            if name is None
+        ]
+        if missing:
+            wok_log.debug(
+                f'{type(self).__name__}: operations not implemented by the '
+                f'model: {", ".join(missing)}'
+            )
+        return table
+
     def _set_CSP(self):
         # set Content-Security-Policy to prevent XSS attacks
         headers = cherrypy.response.headers
@@ -255,11 +290,51 @@ class WokRoot(Root):
 
         return json.dumps(user_info)
 
+    @cherrypy.expose
+    def token(self, *args):
+        """
+        Issue an API token for the logged in user, to authenticate the next
+        requests with an 'Authorization: Bearer <token>' header.
+        """
+        method = 'POST'
+        code = self.getRequestMessage(method, 'token')
+        validate_method((method,), [])
+        auth.wokauth()
+
+        # a token must not be renewed with itself, or it would never expire
+        if template.get_request_identity() is not None:
+            e = UnauthorizedError('WOKAUTH0010E')
+            raise cherrypy.HTTPError(403, str(e))
+
+        username = template.get_session_value(auth.USER_NAME)
+        params = {'username': username}
+        try:
+            request = parse_request()
+            validate_params(request, self, 'token')
+        except WokException as e:
+            log_request(code, params, e, method, 400)
+            raise cherrypy.HTTPError(400, str(e))
+
+        # the role is kept in the token, so its lifetime is capped by the
+        # configuration to bound how long a revoked role may still be used
+        token_expiry = config.getint('authentication', 'token_expiry')
+        expires_in = min(request.get('expires_in', token_expiry), token_expiry)
+        token, expires = auth.issue_token(
+            username,
+            template.get_session_value(auth.USER_GROUPS),
+            template.get_session_value(auth.USER_ROLE),
+            expires_in,
+        )
+        log_request(code, params, None, method, 200)
+
+        return json.dumps({'token': token, 'expires': expires})
+
     @cherrypy.expose
     def logout(self):
         method = 'POST'
         code = self.getRequestMessage(method, 'logout')
-        params = {'username': cherrypy.session.get(auth.USER_NAME, 'N/A')}
+        username = template.get_session_value(auth.USER_NAME, 'N/A')
+        params = {'username': username or 'N/A'}
 
         auth.logout()
 
@@ -21,24 +21,31 @@
 #
 import logging.handlers
 import os
+import sys
+import threading
 from time import gmtime
 from time import strftime
 
 import cherrypy
 from wok import auth
+from wok import compression
 from wok import config
+from wok import metrics
 from wok import websocket
 from wok.config import config as configParser
 from wok.config import WokConfig
 from wok.control import sub_nodes
 from wok.model import model
+from wok.profiler import startup_phase
+from wok.profiler import stop_startup_profiler
 from wok.proxy import check_proxy_config
 from wok.pushserver import start_push_server
 from wok.reqlogger import RequestLogger
 from wok.root import WokRoot
 from wok.safewatchedfilehandler import SafeWatchedFileHandler
 from wok.utils import get_enabled_plugins
-from wok.utils import load_plugin
+from wok.utils import load_plugins
+from wok.utils import reload_plugins_cache
 
 
 LOGGING_LEVEL = {
@@ -52,12 +59,16 @@ LOGGING_LEVEL = {
 
 def set_no_cache():
     last_modified = strftime('%a, %d %b %Y %H:%M:%S GMT', gmtime())
+    cache_control = b'no-store, no-cache, must-revalidate, post-check=0, ' \
+                    b'pre-check=0'
+    # responses with ETag may be stored by the client as long as they are
+    # revalidated on every request
+    if 'ETag' in cherrypy.response.headers:
+        cache_control = b'no-cache, must-revalidate'
+
     h = [
         (b'Expires', b'Mon, 26 Jul 1997 05:00:00 GMT'),
-        (
-            b'Cache-Control',
-            b'no-store, no-cache, must-revalidate, post-check=0, pre-check=0',
-        ),
+        (b'Cache-Control', cache_control),
         (b'Pragma', b'no-cache'),
         (b'Last-Modified', last_modified.encode('utf-8')),
     ]
@@ -77,9 +88,13 @@ class Server(object):
                 if hasattr(options, item):
                     config.config.set(sec, item, str(getattr(options, item)))
 
-        # Check proxy configuration
+        # Check proxy configuration. It may need to generate the certificate
+        # files, so do not wait for it: nginx is reloaded once it is done
         if not hasattr(options, 'no_proxy') or not options.no_proxy:
-            check_proxy_config()
+            threading.Thread(
+                target=self._check_proxy_config, name='wok-proxy-config',
+                daemon=True
+            ).start()
 
         make_dirs = [
             os.path.abspath(config.get_log_download_path()),
@@ -93,6 +108,11 @@ class Server(object):
             if not os.path.isdir(directory):
                 os.makedirs(directory)
 
+        # file sessions hold the logged in users data
+        if configParser.get('server', 'session_storage') == 'file':
+            os.makedirs(config.get_session_storage_path(), mode=0o700,
+                        exist_ok=True)
+
         self.configObj = WokConfig()
         # We'll use the session timeout (= 10 minutes) and the
         # nginx timeout (= 10 minutes). This monitor isn't involved
@@ -103,8 +123,18 @@ class Server(object):
         except AttributeError:
             pass
 
+        cherrypy.tools.metrics = cherrypy.Tool(
+            'on_start_resource', metrics.start_request
+        )
         cherrypy.tools.nocache = cherrypy.Tool('on_end_resource', set_no_cache)
         cherrypy.tools.wokauth = cherrypy.Tool('before_handler', auth.wokauth)
+        cherrypy.tools.compress = cherrypy.Tool(
+            'before_finalize', compression.compress, priority=80
+        )
+        # run after staticdir (priority 50) to replace the file it serves
+        cherrypy.tools.precompressed = cherrypy.Tool(
+            'before_handler', compression.serve_precompressed, priority=60
+        )
 
         # Setting host to 127.0.0.1. This makes wok run
         # as a localhost app, inaccessible to the outside
@@ -165,37 +195,66 @@ class Server(object):
         if not dev_env:
             cherrypy.config.update({'environment': 'production'})
 
+        # measure the requests of wok and all the plugins
+        cherrypy.config.update({
+            'tools.metrics.on': True,
+            'tools.metrics.slow_threshold': configParser.getfloat(
+                'server', 'slow_request_threshold'),
+        })
+
         for ident, node in sub_nodes.items():
             if node.url_auth:
                 cfg = self.configObj
                 ident = f'/{ident}'
                 cfg[ident] = {'tools.wokauth.on': True}
 
-        cherrypy.tree.mount(
-            WokRoot(model.Model(), dev_env),
-            options.server_root,
-            self.configObj
-        )
+        with startup_phase('mount wok root'):
+            wok_root = WokRoot(model.Model(), dev_env)
+            cherrypy.tree.mount(wok_root, options.server_root, self.configObj)
+
+        with startup_phase('start websocket server'):
+            self._start_websocket_server()
+
+        with startup_phase('load plugins'):
+            self._load_plugins()
+        # SIGUSR1 makes the plugins configurations and tabs be read again
+        cherrypy.engine.subscribe('graceful', reload_plugins_cache)
 
-        self._start_websocket_server()
-        self._load_plugins()
         cherrypy.lib.sessions.init()
 
+    def _check_proxy_config(self):
+        with startup_phase('check proxy configuration'):
+            try:
+                check_proxy_config()
+            except Exception as e:
+                cherrypy.log.error_log.error(
+                    f'Failed to configure the proxy, error: {str(e)}')
+
     def _start_websocket_server(self):
         start_push_server()
         ws_proxy = websocket.new_ws_proxy()
         cherrypy.engine.subscribe('exit', ws_proxy.terminate)
 
     def _load_plugins(self):
-        for plugin_name, plugin_config in get_enabled_plugins():
-            load_plugin(plugin_name, plugin_config)
+        load_plugins(
+            get_enabled_plugins(),
+            lazy=configParser.get('server', 'lazy_plugins') == 'on',
+            max_workers=configParser.getint('server', 'plugin_init_threads'),
+        )
 
     def start(self):
         # Subscribe to SignalHandler plugin
         if hasattr(cherrypy.engine, 'signal_handler'):
             cherrypy.engine.signal_handler.subscribe()
 
-        cherrypy.engine.start()
+        with startup_phase('start engine'):
+            cherrypy.engine.start()
+
+        report = stop_startup_profiler()
+        if report is not None:
+            cherrypy.log.error_log.info(report)
+            sys.stderr.write(report + '\n')
+
         cherrypy.engine.block()
 
     def stop(self):
@@ -19,18 +19,96 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 import errno
+import hashlib
 import json
 import os
+import threading
 import time
+from functools import lru_cache
 
 import cherrypy
 from Cheetah.Template import Template
 from wok import config as config
 from wok.config import paths
+from wok.metrics import timed
 
 EXPIRES_ON = 'Session-Expires-On'
 REFRESH = 'robot-refresh'
 
+# Query string parameter to request an indented JSON response
+PRETTY_PARAM = 'pretty'
+
+# Lists with at least this number of items are encoded and sent in chunks
+STREAM_THRESHOLD = 500
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Compiled Cheetah template classes: {filename: (mtime, class)}
+_templates_cache = {}
+_templates_lock = threading.Lock()
+
+_json_encoder = json.JSONEncoder(separators=(',', ':'))
+_json_pretty_encoder = json.JSONEncoder(indent=2, separators=(',', ':'))
+
+
+def set_json_encoder(encoder):
+    """
+    Replace the encoder used for compact JSON responses.
+
+    encoder must provide encode(data) returning the JSON document as str or
+    bytes. If it also provides iterencode(data), yielding str or bytes parts
+    of the document, large lists are streamed through it; otherwise they are
+    encoded in one shot.
+    """
+    global _json_encoder
+    _json_encoder = encoder
+
+
+@lru_cache(maxsize=None)
+def get_session_timeout():
+    # wok.config.config is only updated on server start up, so there is no
+    # need to parse it on every request
+    return float(config.config.get('server', 'session_timeout'))
+
+
+def set_request_identity(identity):
+    """
+    Set the user of the current request, when it is authenticated with no
+    session (eg. with an API token), as a dict with the same keys as the
+    session.
+    """
+    cherrypy.serving.request.wok_identity = identity
+
+
+def get_request_identity():
+    return getattr(cherrypy.serving.request, 'wok_identity', None)
+
+
+def get_session_value(key, default=None):
+    """
+    Read a value of the current session, or of the request identity if it
+    was authenticated with no session.
+
+    RAM sessions are read with no lock, so the concurrent requests of a
+    session (eg. the UI AJAX calls) do not wait for each other just to check
+    it: their data is a dict in memory, only replaced on login and logout.
+    Other storages are shared with other processes and may be read while
+    they are written, so the session lock is held.
+    """
+    identity = get_request_identity()
+    if identity is not None:
+        return identity.get(key, default)
+
+    # cherrypy.session is a proxy to the session of the current thread
+    session = cherrypy.serving.session
+    if isinstance(session, cherrypy.lib.sessions.RamSession):
+        return session.get(key, default)
+
+    session.acquire_lock()
+    try:
+        return session.get(key, default)
+    finally:
+        session.release_lock()
+
 
 def get_lang():
     cookie = cherrypy.request.cookie
@@ -59,6 +137,11 @@ def get_accept_language():
 
 
 def validate_language(langs, domain):
+    return _validate_language(tuple(langs), domain)
+
+
+@lru_cache(maxsize=256)
+def _validate_language(langs, domain):
     for lang in langs:
         filepath = os.path.join(
             paths.mo_dir, lang, 'LC_MESSAGES', domain + '.mo')
@@ -90,6 +173,27 @@ def can_accept_html():
     )
 
 
+def get_template_class(filename):
+    """
+    Return the compiled Cheetah template class for filename.
+
+    Templates are compiled only once and recompiled when the file is
+    modified, so the .tmpl file is not parsed on every request.
+    """
+    mtime = os.stat(filename).st_mtime
+    cached = _templates_cache.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with _templates_lock:
+        cached = _templates_cache.get(filename)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, Template.compile(file=filename))
+            _templates_cache[filename] = cached
+
+    return cached[1]
+
+
 def render_cheetah_file(resource, data):
     paths = cherrypy.request.app.root.paths
     domain = cherrypy.request.app.root.domain
@@ -101,7 +205,8 @@ def render_cheetah_file(resource, data):
                         'localedir': paths.mo_dir, 'lang': [lang]}
         params['lang'] = gettext_conf
         params['data'] = data
-        return Template(file=filename, searchList=params).respond()
+        template_class = get_template_class(filename)
+        return template_class(searchList=params).respond()
     except OSError as e:
         if e.errno == errno.ENOENT:
             raise cherrypy.HTTPError(404)
@@ -109,12 +214,78 @@ def render_cheetah_file(resource, data):
             raise
 
 
-def render(resource, data):
+def is_pretty_requested():
+    return cherrypy.request.params.get(PRETTY_PARAM) in ('1', 'true')
+
+
+def _stream_json(data):
+    chunk = []
+    size = 0
+    for part in _json_encoder.iterencode(data):
+        # custom encoders may return bytes
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        chunk.append(part)
+        size += len(part)
+        if size >= STREAM_CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+
+    if chunk:
+        yield b''.join(chunk)
+
+
+def validate_etag(etag):
+    """
+    Set the ETag response header and answer with 304 (Not Modified) when the
+    client already has the same representation of the requested URI.
+
+    The ETag is weak, as it is computed before the response is compressed
+    and the same tag is sent for all the content codings of the response.
+    """
+    etag = f'W/"{etag}"'
+    cherrypy.response.headers['ETag'] = etag
+
+    conditions = cherrypy.request.headers.get('If-None-Match')
+    if conditions:
+        # If-None-Match uses the weak comparison
+        tags = [tag.strip() for tag in conditions.split(',')]
+        tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        if etag[2:] in tags or '*' in tags:
+            raise cherrypy.HTTPRedirect([], 304)
+
+
+def render_json(data, stream=True):
+    if is_pretty_requested():
+        return _json_pretty_encoder.encode(data).encode('utf-8')
+
+    if (
+        stream
+        and isinstance(data, list)
+        and len(data) >= STREAM_THRESHOLD
+        and hasattr(_json_encoder, 'iterencode')
+    ):
+        cherrypy.response.stream = True
+        return _stream_json(data)
+
+    response = _json_encoder.encode(data)
+    if isinstance(response, str):
+        response = response.encode('utf-8')
+    return response
+
+
+@timed('render')
+def render(resource, data, etag=False):
+    """
+    Render data according to the Accept request header.
+
+    If etag is True, JSON responses carry an ETag computed from the content
+    and conditional requests are answered with 304 (Not Modified).
+    """
     # get timeout and last refresh
-    s_timeout = float(config.config.get('server', 'session_timeout'))
-    cherrypy.session.acquire_lock()
-    last_req = cherrypy.session.get(REFRESH)
-    cherrypy.session.release_lock()
+    s_timeout = get_session_timeout()
+    last_req = get_session_value(REFRESH)
 
     # last_request is present: calculate remaining time
     if last_req is not None:
@@ -124,8 +295,11 @@ def render(resource, data):
     if can_accept('application/json'):
         content_type = 'application/json;charset=utf-8'
         cherrypy.response.headers['Content-Type'] = content_type
-        response = json.dumps(data, indent=2, separators=(',', ':'))
-        return response.encode('utf-8')
+        if etag:
+            response = render_json(data, stream=False)
+            validate_etag(hashlib.sha1(response).hexdigest())
+            return response
+        return render_json(data)
     elif can_accept_html():
         content = render_cheetah_file(resource, data)
         return content.encode('utf-8')
@@ -19,23 +19,28 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 #
+import asyncio
+import copy
 import glob
 import grp
 import inspect
 import os
 import pwd
 import re
+import selectors
 import sqlite3
 import subprocess
-import sys
+import tempfile
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from configparser import SafeConfigParser
 from datetime import datetime
 from datetime import timedelta
 from multiprocessing import Process
 from multiprocessing import Queue
 from optparse import Values
-from threading import Timer
 
 import cherrypy
 import lxml.etree as ET
@@ -80,123 +85,232 @@ def get_plugin_config_file(name):
     return plugin_conf
 
 
+# Plugins directory listing, plugins configurations and UI tabs, cached until
+# the files they come from change or reload_plugins_cache() is called
+_plugins_cache = {'dir': None, 'confs': {}, 'tabs': {}}
+_plugins_cache_lock = threading.Lock()
+
+
+def _get_file_version(filename):
+    # a file replaced by a new one has a new inode, even if written within
+    # the mtime resolution
+    st = os.stat(filename)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def reload_plugins_cache():
+    with _plugins_cache_lock:
+        _plugins_cache['dir'] = None
+        _plugins_cache['confs'].clear()
+        _plugins_cache['tabs'].clear()
+
+
+def _parse_plugin_conf(plugin_conf):
+    config = SafeConfigParser()
+    config.read(plugin_conf)
+    config_as_dict = dict()
+    for section in config.sections():
+        config_as_dict[section] = {option: config.get(
+            section, option) for option in config.options(section)}
+
+    return config_as_dict
+
+
 def load_plugin_conf(name):
     try:
         plugin_conf = get_plugin_config_file(name)
         if not plugin_conf:
             return None
 
-        config = SafeConfigParser()
-        config.read(plugin_conf)
-        config_as_dict = dict()
-        for section in config.sections():
-            config_as_dict[section] = {option: config.get(
-                section, option) for option in config.options(section)}
+        try:
+            version = _get_file_version(plugin_conf)
+        except OSError:
+            return None
+
+        with _plugins_cache_lock:
+            cached = _plugins_cache['confs'].get(plugin_conf)
+        if cached is None or cached[0] != version:
+            cached = (version, _parse_plugin_conf(plugin_conf))
+            with _plugins_cache_lock:
+                _plugins_cache['confs'][plugin_conf] = cached
 
-        return config_as_dict
+        # callers are free to change the returned configuration
+        return copy.deepcopy(cached[1])
     except ValueError as e:
         cherrypy.log.error_log.error(
             f'Failed to load plugin conf from {plugin_conf}: {e}'
         )
 
 
+def _list_plugins_dir(plugin_dir):
+    version = os.stat(plugin_dir).st_mtime_ns
+    with _plugins_cache_lock:
+        cached = _plugins_cache['dir']
+    if cached is not None and cached[:2] == (plugin_dir, version):
+        return cached[2]
+
+    names = [
+        name for name in os.listdir(plugin_dir)
+        if os.path.isdir(os.path.join(plugin_dir, name))
+    ]
+    with _plugins_cache_lock:
+        _plugins_cache['dir'] = (plugin_dir, version, names)
+    return names
+
+
 def get_plugins(enabled_only=False):
     plugin_dir = paths.plugins_dir
 
     try:
-        dir_contents = os.listdir(plugin_dir)
+        dir_contents = _list_plugins_dir(plugin_dir)
     except OSError:
         return
 
     test_mode = config.config.get('server', 'test').lower() == 'true'
 
     for name in dir_contents:
-        if os.path.isdir(os.path.join(plugin_dir, name)):
-            if name == 'sample' and not test_mode:
-                continue
+        if name == 'sample' and not test_mode:
+            continue
 
-            plugin_config = load_plugin_conf(name)
-            if not plugin_config:
+        plugin_config = load_plugin_conf(name)
+        if not plugin_config:
+            continue
+        try:
+            if plugin_config['wok']['enable'] is None:
                 continue
-            try:
-                if plugin_config['wok']['enable'] is None:
-                    continue
-
-                plugin_enabled = plugin_config['wok']['enable']
-                if enabled_only and not plugin_enabled:
-                    continue
 
-                yield (name, plugin_config)
-            except (TypeError, KeyError):
+            plugin_enabled = plugin_config['wok']['enable']
+            if enabled_only and not plugin_enabled:
                 continue
 
+            yield (name, plugin_config)
+        except (TypeError, KeyError):
+            continue
+
 
 def get_enabled_plugins():
     return get_plugins(enabled_only=True)
 
 
 def get_plugin_app_mounted_in_cherrypy(name):
-    plugin_uri = '/plugins/' + name
+    plugin_uri = config.get_base_plugin_uri(name)
     return cherrypy.tree.apps.get(plugin_uri, None)
 
 
-def get_plugin_dependencies(name):
-    app = get_plugin_app_mounted_in_cherrypy(name)
-    if app is None or not hasattr(app.root, 'depends'):
-        return []
-    return app.root.depends
+def _get_mounted_plugins():
+    # plugin name -> mounted application
+    plugins = {}
+    prefix = config.get_base_plugin_uri('')
+    for uri, app in list(cherrypy.tree.apps.items()):
+        if uri.startswith(prefix) and uri != prefix:
+            plugins[uri[len(prefix):]] = app
+    return plugins
 
 
-def get_all_plugins_dependent_on(name):
-    if not cherrypy.tree.apps:
-        return []
+def get_plugins_dependency_graph():
+    """
+    Return a dict mapping each known plugin to the set of plugins it depends
+    on, as listed in its configuration and, once it is loaded, in the
+    'depends' attribute of its root.
+    """
+    graph = {}
+    for name, plugin_config in get_plugins():
+        graph[name] = set(get_plugin_conf_dependencies(plugin_config))
+
+    for name, app in _get_mounted_plugins().items():
+        # do not load a lazy plugin only to find out its dependencies
+        if isinstance(app.root, LazyPlugin):
+            depends = []
+        else:
+            depends = getattr(app.root, 'depends', None) or []
+        graph.setdefault(name, set()).update(depends)
 
-    dependencies = []
-    for plugin, app in cherrypy.tree.apps.items():
-        if hasattr(app.root, 'depends') and name in app.root.depends:
-            dependencies.append(plugin.replace('/plugins/', ''))
+    return graph
 
-    return dependencies
+
+def _get_reachable_plugins(name, graph):
+    # plugins reachable from name following the graph edges, name excluded
+    reachable = set()
+    pending = [name]
+    while pending:
+        for plugin in graph.get(pending.pop(), ()):
+            if plugin not in reachable and plugin != name:
+                reachable.add(plugin)
+                pending.append(plugin)
+    return reachable
+
+
+def _reverse_graph(graph):
+    reverse = {}
+    for name, depends in graph.items():
+        for dep in depends:
+            reverse.setdefault(dep, set()).add(name)
+    return reverse
+
+
+def _sort_plugins(names, graph):
+    # topological order, dependencies first
+    waves = sort_plugins_in_waves({
+        name: graph.get(name, set()) & set(names) for name in names
+    })
+    return [name for wave in waves for name in wave]
+
+
+def get_plugin_dependencies(name):
+    return sorted(get_plugins_dependency_graph().get(name, []))
+
+
+def get_all_plugins_dependent_on(name):
+    reverse = _reverse_graph(get_plugins_dependency_graph())
+    return sorted(reverse.get(name, []))
 
 
 def get_all_affected_plugins_by_plugin(name):
-    dependencies = get_all_plugins_dependent_on(name)
-    if len(dependencies) == 0:
-        return []
+    reverse = _reverse_graph(get_plugins_dependency_graph())
+    return sorted(_get_reachable_plugins(name, reverse))
 
-    all_affected_plugins = dependencies
-    for dep in dependencies:
-        all_affected_plugins += get_all_affected_plugins_by_plugin(dep)
 
-    return all_affected_plugins
+# serializes plugins enabling and disabling, which may cascade
+_plugins_state_lock = threading.RLock()
 
 
 def disable_plugin(name):
-    plugin_deps = get_all_affected_plugins_by_plugin(name)
-
-    for dep in set(plugin_deps):
-        update_plugin_config_file(dep, False)
-        update_cherrypy_mounted_tree(dep, False)
+    """
+    Disable a plugin and all plugins depending on it, directly or not,
+    dependents first.
+    """
+    graph = get_plugins_dependency_graph()
+    affected = _get_reachable_plugins(name, _reverse_graph(graph)) | {name}
 
-    update_plugin_config_file(name, False)
-    update_cherrypy_mounted_tree(name, False)
+    for plugin in reversed(_sort_plugins(affected, graph)):
+        update_plugin_config_file(plugin, False)
+        update_cherrypy_mounted_tree(plugin, False)
 
 
 def enable_plugin(name):
-    update_plugin_config_file(name, True)
-    update_cherrypy_mounted_tree(name, True)
+    """
+    Enable a plugin and all plugins it depends on, directly or not,
+    dependencies first.
+    """
+    graph = get_plugins_dependency_graph()
+    required = _get_reachable_plugins(name, graph) | {name}
 
-    plugin_deps = get_plugin_dependencies(name)
+    for plugin in _sort_plugins(required, graph):
+        update_plugin_config_file(plugin, True)
+        update_cherrypy_mounted_tree(plugin, True)
 
-    for dep in set(plugin_deps):
-        enable_plugin(dep)
+    # the plugin root may declare more dependencies once loaded
+    for dep in get_plugin_dependencies(name):
+        if dep not in required:
+            enable_plugin(dep)
 
 
 def set_plugin_state(name, state):
-    if state is False:
-        disable_plugin(name)
-    else:
-        enable_plugin(name)
+    with _plugins_state_lock:
+        if state is False:
+            disable_plugin(name)
+        else:
+            enable_plugin(name)
 
 
 def update_plugin_config_file(name, state):
@@ -220,27 +334,55 @@ def update_plugin_config_file(name, state):
             config_contents[i] = f'enable = {str(state)}\n'
             break
 
-    with open(plugin_conf, 'w') as f:
-        f.writelines(config_contents)
+    # write a new file and rename it over the old one, so readers never get
+    # a partially written configuration
+    fd, tmp_file = tempfile.mkstemp(
+        dir=os.path.dirname(plugin_conf), prefix='.wok-', suffix='.conf')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(config_contents)
+        os.chmod(tmp_file, os.stat(plugin_conf).st_mode & 0o7777)
+        os.replace(tmp_file, plugin_conf)
+    except Exception:
+        os.remove(tmp_file)
+        raise
 
 
-def load_plugin(plugin_name, plugin_config):
-    try:
-        class_name = f'{plugin_name[0].upper() + plugin_name[1:]}'
-        plugin_class = f'wok.plugins.{plugin_name}.{class_name}'
-        del plugin_config['wok']
-        plugin_config.update(PluginConfig(plugin_name))
-    except KeyError:
-        return
+# plugin name -> {'time': seconds, 'rss': bytes} spent to load the plugin
+plugins_load_stats = {}
+
 
+def _get_rss():
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def _init_plugin(plugin_name, plugin_class):
+    start = time.time()
+    rss = _get_rss()
     try:
         options = get_plugin_config_options()
-        plugin_app = import_class(plugin_class)(options)
+        if isinstance(plugin_class, str):
+            plugin_class = import_class(plugin_class)
+        plugin_app = plugin_class(options)
     except (ImportError, Exception) as e:
         cherrypy.log.error_log.error(
             f'Failed to import plugin {plugin_class}, error: {str(e)}'
         )
-        return
+        return None
+
+    # the memory usage is for the whole process, so it is only accurate if
+    # no other plugin is being loaded at the same time
+    stats = {'time': time.time() - start, 'rss': max(_get_rss() - rss, 0)}
+    plugins_load_stats[plugin_name] = stats
+    wok_log.info(
+        f"Plugin {plugin_name} loaded in {stats['time']:.3f}s, "
+        f"using {stats['rss'] // 1024} KiB"
+    )
+    return plugin_app
+
+
+def _get_plugin_app_config(plugin_name, plugin_class, plugin_app):
+    plugin_config = {}
 
     # dynamically extend plugin config with custom data, if provided
     get_custom_conf = getattr(plugin_app, 'get_custom_conf', None)
@@ -265,22 +407,266 @@ def load_plugin(plugin_name, plugin_config):
         msg += f'Error: {str(e)}'
         cherrypy.log.error_log.error(msg)
 
+    return plugin_config
+
+
+class LazyPlugin(object):
+    """
+    Stub mounted in place of a plugin application, which imports and
+    initializes the plugin on first use, ie. its first request or the first
+    time another module reads an attribute of the plugin root.
+
+    Once loaded, the plugin replaces the stub as the root of the mounted
+    application.
+    """
+
+    def __init__(self, plugin_name, plugin_class):
+        self.domain = plugin_name
+        self.paths = PluginPaths(plugin_name)
+        self._plugin_class = plugin_class
+        self._plugin_uri = config.get_base_plugin_uri(plugin_name)
+        self._plugin_app = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._plugin_app is not None or self._failed:
+                return self._plugin_app
+
+            plugin_name = self.domain
+            plugin_app = _init_plugin(plugin_name, self._plugin_class)
+            if plugin_app is None:
+                self._failed = True
+                return None
+
+            app = cherrypy.tree.apps.get(self._plugin_uri)
+            if app is not None and app.root is self:
+                app.merge(_get_plugin_app_config(
+                    plugin_name, self._plugin_class, plugin_app))
+                app.root = plugin_app
+
+            self._plugin_app = plugin_app
+            return plugin_app
+
+    def __getattr__(self, name):
+        # only called for the attributes the stub does not have
+        if name.startswith('__') or name.startswith('_plugin'):
+            raise AttributeError(name)
+
+        plugin_app = self.load()
+        if plugin_app is None:
+            raise AttributeError(name)
+        return getattr(plugin_app, name)
+
+
+def _prepare_plugin_config(plugin_name, plugin_config):
+    """
+    Return the plugin class path and update plugin_config with the plugin
+    cherrypy configuration, or return None if the config is not valid.
+    """
+    try:
+        class_name = f'{plugin_name[0].upper() + plugin_name[1:]}'
+        plugin_class = f'wok.plugins.{plugin_name}.{class_name}'
+        del plugin_config['wok']
+        plugin_config.update(PluginConfig(plugin_name))
+    except (KeyError, TypeError):
+        return None
+    return plugin_class
+
+
+def _mount_plugin(plugin_name, plugin_class, plugin_app, plugin_config):
+    plugin_config.update(
+        _get_plugin_app_config(plugin_name, plugin_class, plugin_app))
     cherrypy.tree.mount(
         plugin_app, config.get_base_plugin_uri(plugin_name), plugin_config
     )
 
 
+def load_plugin(plugin_name, plugin_config, lazy=False):
+    plugin_class = _prepare_plugin_config(plugin_name, plugin_config)
+    if plugin_class is None:
+        return
+
+    if lazy:
+        plugin_app = LazyPlugin(plugin_name, plugin_class)
+        cherrypy.tree.mount(plugin_app, plugin_app._plugin_uri, plugin_config)
+        return
+
+    plugin_app = _init_plugin(plugin_name, plugin_class)
+    if plugin_app is None:
+        return
+
+    _mount_plugin(plugin_name, plugin_class, plugin_app, plugin_config)
+
+
+def get_plugin_conf_dependencies(plugin_config):
+    """
+    Return the plugins listed in the 'depends' option of the [wok] section
+    of a plugin configuration, eg. depends = gingerbase, kimchi
+    """
+    try:
+        depends = plugin_config['wok'].get('depends') or ''
+    except (KeyError, AttributeError):
+        return []
+    return [dep.strip() for dep in depends.split(',') if dep.strip()]
+
+
+def sort_plugins_in_waves(dependencies):
+    """
+    Sort plugins so each one comes after the plugins it depends on.
+
+    dependencies maps each plugin name to the list of plugins it depends on.
+    Return a list of waves, each a sorted list of plugins whose dependencies
+    are all in previous waves. Dependencies not in the dict are ignored and
+    plugins in a dependency cycle are put in a last wave.
+    """
+    pending = {
+        name: set(deps) & set(dependencies) - {name}
+        for name, deps in dependencies.items()
+    }
+    done = set()
+    waves = []
+    while pending:
+        wave = sorted(name for name, deps in pending.items() if deps <= done)
+        if not wave:
+            wok_log.warning(
+                f'Dependency cycle between plugins: {", ".join(sorted(pending))}'
+            )
+            waves.append(sorted(pending))
+            break
+
+        for name in wave:
+            del pending[name]
+        done.update(wave)
+        waves.append(wave)
+
+    return waves
+
+
+def load_plugins(plugins, lazy=False, max_workers=1):
+    """
+    Load and mount a list of (plugin name, plugin config) tuples.
+
+    Most plugins only set their 'depends' attribute once initialized, so
+    the order in which they must be initialized is only known for the
+    plugins declaring their dependencies before that, either in the
+    'depends' option of their configuration or as a class attribute. Those
+    plugins are initialized in waves: the plugins of a wave only depend on
+    plugins of previous waves, so they are initialized concurrently, using
+    up to max_workers threads. The other plugins, and the ones depending on
+    them, are then initialized one at a time, as they used to be.
+
+    All plugins are mounted once initialized, ordered by the dependencies
+    of their root, whatever time each one took to initialize.
+    """
+    plugins = dict(plugins)
+    if lazy:
+        for plugin_name in sorted(plugins):
+            load_plugin(plugin_name, plugins[plugin_name], lazy=True)
+        return
+
+    start = time.time()
+    dependencies = {}
+    class_paths = {}
+    classes = {}
+    for name in sorted(plugins):
+        plugin_config = plugins[name]
+        try:
+            declared = 'depends' in plugin_config['wok']
+        except (KeyError, TypeError):
+            declared = False
+        conf_depends = None
+        if declared:
+            conf_depends = get_plugin_conf_dependencies(plugin_config)
+
+        plugin_class = _prepare_plugin_config(name, plugin_config)
+        if plugin_class is None:
+            continue
+        class_paths[name] = plugin_class
+
+        # imports are done one at a time, only the plugins initialization
+        # runs concurrently
+        try:
+            classes[name] = import_class(plugin_class)
+        except ImportError as e:
+            cherrypy.log.error_log.error(
+                f'Failed to import plugin {plugin_class}, error: {str(e)}'
+            )
+            continue
+
+        class_depends = getattr(classes[name], 'depends', None)
+        if not isinstance(class_depends, (list, tuple)):
+            class_depends = None
+        if conf_depends is not None or class_depends is not None:
+            dependencies[name] = (conf_depends or []) + list(
+                class_depends or [])
+
+    # plugins which may depend on a plugin whose dependencies are unknown
+    unknown = set(classes) - set(dependencies)
+    graph = {name: set(deps) for name, deps in dependencies.items()}
+    for name in list(dependencies):
+        if _get_reachable_plugins(name, graph) & unknown:
+            unknown.add(name)
+            del dependencies[name]
+
+    apps = {}
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1),
+                            thread_name_prefix='wok-plugins') as executor:
+        for wave in sort_plugins_in_waves(dependencies):
+            for name, plugin_app in zip(wave, executor.map(
+                    lambda name: _init_plugin(name, classes[name]), wave)):
+                if plugin_app is not None:
+                    apps[name] = plugin_app
+
+    initialized = set()
+    for name in sorted(unknown):
+        plugin_app = _init_plugin(name, classes[name])
+        depends = set(getattr(plugin_app, 'depends', None) or [])
+        late = sorted(depends & unknown - initialized - {name})
+        if late:
+            wok_log.warning(
+                f'Plugin {name} was initialized before {", ".join(late)}, '
+                f'list them in the depends option of its configuration'
+            )
+        initialized.add(name)
+        if plugin_app is not None:
+            apps[name] = plugin_app
+
+    # mount order, same dependencies as get_plugins_dependency_graph()
+    graph = {
+        name: set(dependencies.get(name, []))
+        | set(getattr(plugin_app, 'depends', None) or [])
+        for name, plugin_app in apps.items()
+    }
+    for name in _sort_plugins(list(apps), graph):
+        _mount_plugin(name, class_paths[name], apps[name], plugins[name])
+
+    wok_log.info(
+        f'{len(apps)} plugins loaded in {time.time() - start:.3f}s')
+
+
 def is_plugin_mounted_in_cherrypy(plugin_uri):
     return cherrypy.tree.apps.get(plugin_uri) is not None
 
 
+# plugin uri -> application of the plugins unmounted since the server
+# started, mounted again as is when the plugin is enabled
+_unmounted_plugins = {}
+
+
 def update_cherrypy_mounted_tree(plugin, state):
-    plugin_uri = '/plugin/' + plugin
+    plugin_uri = config.get_base_plugin_uri(plugin)
 
     if state is False and is_plugin_mounted_in_cherrypy(plugin_uri):
-        del cherrypy.tree.apps[plugin_uri]
+        _unmounted_plugins[plugin_uri] = cherrypy.tree.apps.pop(plugin_uri)
 
     if state is True and not is_plugin_mounted_in_cherrypy(plugin_uri):
+        app = _unmounted_plugins.pop(plugin_uri, None)
+        if app is not None:
+            cherrypy.tree.apps[plugin_uri] = app
+            return
+
         plugin_config = load_plugin_conf(plugin)
         load_plugin(plugin, plugin_config)
 
@@ -316,13 +702,31 @@ def get_all_tabs():
 
     tabs = []
     for f in files:
-        try:
-            root = ET.parse(f)
-        except (IOError):
-            wok_log.debug(f'Unable to load {f}')
-            continue
-        tabs.extend([t.text.lower() for t in root.getiterator('title')])
+        tabs.extend(_get_tabs(f))
+
+    return tabs
+
+
+def _get_tabs(filename):
+    try:
+        version = _get_file_version(filename)
+    except OSError:
+        version = None
 
+    with _plugins_cache_lock:
+        cached = _plugins_cache['tabs'].get(filename)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    try:
+        root = ET.parse(filename)
+        tabs = [t.text.lower() for t in root.getiterator('title')]
+    except (IOError):
+        wok_log.debug(f'Unable to load {filename}')
+        tabs = []
+
+    with _plugins_cache_lock:
+        _plugins_cache['tabs'][filename] = (version, tabs)
     return tabs
 
 
@@ -340,54 +744,135 @@ def import_module(module_name, class_name=''):
     return __import__(module_name, globals(), locals(), [class_name])
 
 
-def _set_timer(proc, timeout, timeout_flag):
+_command_slots = None
+_command_slots_lock = threading.Lock()
+
+
+def _get_command_slots():
+    """
+    Return the semaphore bounding the number of commands run at the same
+    time by run_command and its variants.
+    """
+    global _command_slots
+
+    with _command_slots_lock:
+        if _command_slots is None:
+            _command_slots = threading.BoundedSemaphore(
+                config.config.getint('server', 'max_running_commands'))
+    return _command_slots
+
+
+def _get_command_env(env_vars):
+    if env_vars is None:
+        env_vars = os.environ.copy()
+        env_vars['LC_ALL'] = 'en_US.UTF-8'
+    elif env_vars.get('LC_ALL') is None:
+        env_vars['LC_ALL'] = 'en_US.UTF-8'
+    return env_vars
+
+
+def _kill_proc_tree(pid):
     # subprocess.kill() can leave descendants running
     # and halting the execution. Using psutil to
     # get all descendants from the subprocess and
     # kill them recursively.
-    def kill_proc(proc, timeout_flag):
-        try:
-            parent = psutil.Process(proc.pid)
-            for child in parent.get_children(recursive=True):
-                child.kill()
-            # kill the process after no children is left
-            proc.kill()
-        except OSError:
-            pass
-        else:
-            timeout_flag[0] = True
+    try:
+        parent = psutil.Process(pid)
+        for child in parent.children(recursive=True):
+            child.kill()
+        # kill the process after no children is left
+        parent.kill()
+    except (OSError, psutil.Error):
+        pass
 
-    timer = Timer(timeout, kill_proc, [proc, timeout_flag])
-    timer.setDaemon(True)
-    timer.start()
 
-    return timer
+def _decode_line(line):
+    try:
+        return line.decode('utf_8')
+    except UnicodeDecodeError as e:
+        wok_log.error(e)
+        msg = f'The output of the command could not be decoded as utf-8.'
+        msg += f'\nIgnored line: {repr(line)}'
+        wok_log.error(msg)
+        return ''
 
 
-def _get_cmd_output(proc, out_cb):
-    output = []
-    while True:
-        line = ''
-        try:
-            line = proc.stdout.readline()
-            line = line.decode('utf_8')
-        except Exception:
-            type, e, tb = sys.exc_info()
-            wok_log.error(e)
-            msg = f'The output of the command could not be decoded as utf-8.'
-            msg += f'\nIgnored line: {repr(line)}'
+def _read_cmd_output(proc, deadline=None):
+    """
+    Yield the decoded lines of the process output as they are written, and
+    return its error output once the process closes both.
+
+    deadline is a time.monotonic() value after which subprocess.TimeoutExpired
+    is raised.
+    """
+    error = []
+    pending = b''
+    with selectors.DefaultSelector() as selector:
+        selector.register(proc.stdout, selectors.EVENT_READ)
+        selector.register(proc.stderr, selectors.EVENT_READ)
+
+        while selector.get_map():
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise subprocess.TimeoutExpired(proc.args, timeout)
+
+            for key, _ in selector.select(timeout):
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fileobj)
+                elif key.fileobj is proc.stderr:
+                    error.append(data)
+                else:
+                    # only the last incomplete line is kept between reads
+                    *lines, pending = (pending + data).split(b'\n')
+                    for line in lines:
+                        yield _decode_line(line + b'\n')
+
+    if pending:
+        yield _decode_line(pending)
+
+    return b''.join(error)
+
+
+def _log_cmd_result(cmd, out, error, returncode, silent):
+    # returns the error message, if any
+    if out:
+        wok_log.debug(f'out:\n{out}')
+
+    if returncode != 0:
+        msg = (
+            f'rc: {returncode} error: {decode_value(error)} returned '
+            f"from cmd: {decode_value(' '.join(cmd))}"
+        )
+
+        if silent:
+            wok_log.debug(msg)
+        else:
             wok_log.error(msg)
-            pass
+        return msg
+    elif error:
+        wok_log.debug(
+            f'error: {decode_value(error)} returned from cmd: '
+            f"{decode_value(' '.join(cmd))}"
+        )
+    return None
 
-        output.append(line)
-        if not line:
-            break
-        out_cb(''.join(output))
 
-    return output
+def _raise_cmd_timeout(cmd, timeout):
+    msg = (
+        f'subprocess is killed by signal.SIGKILL for '
+        f'timeout {timeout} seconds'
+    )
+    wok_log.error(msg)
+
+    msg_args = {'cmd': ' '.join(cmd), 'seconds': str(timeout)}
+    raise TimeoutExpired('WOKUTILS0002E', msg_args)
 
 
-def run_command(cmd, timeout=None, silent=False, out_cb=None, env_vars=None):
+def run_command(cmd, timeout=None, silent=False, out_cb=None, env_vars=None,
+                out_cb_delta=False):
     """
     cmd is a sequence of command arguments.
     timeout is a float number in seconds.
@@ -397,6 +882,8 @@ def run_command(cmd, timeout=None, silent=False, out_cb=None, env_vars=None):
     out_cb is a callback that receives the whole command output every time a
     new line is thrown by command. Default value is None, meaning that whole
     output will be returned at the end of execution.
+    out_cb_delta is bool, if True out_cb receives only the new line instead
+    of the whole output.
 
     Returns a tuple (out, error, returncode) where:
     out is the output thrown by command
@@ -404,65 +891,55 @@ def run_command(cmd, timeout=None, silent=False, out_cb=None, env_vars=None):
     returncode is an integer equal to the result of command execution
     """
     proc = None
-    timer = None
-    timeout_flag = [False]
-
-    if env_vars is None:
-        env_vars = os.environ.copy()
-        env_vars['LC_ALL'] = 'en_US.UTF-8'
-    elif env_vars.get('LC_ALL') is None:
-        env_vars['LC_ALL'] = 'en_US.UTF-8'
+    out = ''
+    error = b''
+    timed_out = False
+    env_vars = _get_command_env(env_vars)
 
+    slots = _get_command_slots()
+    slots.acquire()
     try:
         proc = subprocess.Popen(
             cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env_vars
         )
-        if timeout is not None:
-            timer = _set_timer(proc, timeout, timeout_flag)
 
         wok_log.debug(f"Run command: {' '.join(cmd)}")
-        if out_cb is not None:
-            output = _get_cmd_output(proc, out_cb)
-            out = ''.join(output)
-            error = proc.stderr.read()
-            returncode = proc.poll()
-        else:
-            out, error = proc.communicate()
-            returncode = proc.returncode
-
-        if out:
-            wok_log.debug(f'out:\n{out}')
-
-        if returncode != 0:
-            msg = (
-                f'rc: {returncode} error: {decode_value(error)} returned '
-                f"from cmd: {decode_value(' '.join(cmd))}"
-            )
-
-            if silent:
-                wok_log.debug(msg)
-
+        try:
+            if out_cb is not None:
+                deadline = None
+                if timeout is not None:
+                    deadline = time.monotonic() + timeout
+
+                output = []
+                lines = _read_cmd_output(proc, deadline)
+                while True:
+                    try:
+                        line = next(lines)
+                    except StopIteration as e:
+                        error = e.value
+                        break
+                    output.append(line)
+                    out_cb(line if out_cb_delta else ''.join(output))
+                out = ''.join(output)
+                returncode = proc.wait()
             else:
-                wok_log.error(msg)
-                if out_cb is not None:
-                    out_cb(msg)
-        elif error:
-            wok_log.debug(
-                f'error: {decode_value(error)} returned from cmd: '
-                f"{decode_value(' '.join(cmd))}"
-            )
+                out, error = proc.communicate(timeout=timeout)
+                out = out.decode('utf-8')
+                returncode = proc.returncode
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            _kill_proc_tree(proc.pid)
+            proc.communicate()
+            returncode = proc.returncode
 
-        if timeout_flag[0]:
-            msg = (
-                f'subprocess is killed by signal.SIGKILL for '
-                f'timeout {timeout} seconds'
-            )
-            wok_log.error(msg)
+        msg = _log_cmd_result(cmd, out, error, returncode, silent)
+        if msg is not None and not silent and out_cb is not None:
+            out_cb(msg)
 
-            msg_args = {'cmd': ' '.join(cmd), 'seconds': str(timeout)}
-            raise TimeoutExpired('WOKUTILS0002E', msg_args)
+        if timed_out:
+            _raise_cmd_timeout(cmd, timeout)
 
-        return out.decode('utf-8'), error, returncode
+        return out, error, returncode
     except TimeoutExpired:
         raise
     except OSError as e:
@@ -471,17 +948,231 @@ def run_command(cmd, timeout=None, silent=False, out_cb=None, env_vars=None):
 
         return None, f'{msg} {e}', -1
     except Exception as e:
-        msg = f"Failed to run command: {b' '.join(cmd)}."
+        msg = f"Failed to run command: {' '.join(cmd)}."
         msg = msg if proc is None else msg + f'\n  error code: {e}.'
         wok_log.error(msg)
 
         if proc:
-            return out.decode('utf-8'), error, proc.returncode
+            return out, error, proc.returncode
         else:
             return None, msg, -1
     finally:
-        if timer and not timeout_flag[0]:
-            timer.cancel()
+        if proc is not None and proc.poll() is None:
+            _kill_proc_tree(proc.pid)
+            proc.wait()
+        slots.release()
+
+
+def run_command_iter(cmd, timeout=None, env_vars=None):
+    """
+    Run a command and yield the lines of its output, decoded, as they are
+    written.
+
+    The generator returns a tuple (error, returncode) when the command ends,
+    eg. to a 'yield from' expression. TimeoutExpired is raised if the command
+    runs for more than timeout seconds. Closing the generator kills the
+    command.
+    """
+    deadline = None
+    if timeout is not None:
+        deadline = time.monotonic() + timeout
+
+    slots = _get_command_slots()
+    slots.acquire()
+    proc = None
+    try:
+        proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env=_get_command_env(env_vars)
+        )
+        wok_log.debug(f"Run command: {' '.join(cmd)}")
+
+        try:
+            error = yield from _read_cmd_output(proc, deadline)
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+            returncode = proc.wait(remaining)
+        except subprocess.TimeoutExpired:
+            _kill_proc_tree(proc.pid)
+            proc.wait()
+            _raise_cmd_timeout(cmd, timeout)
+
+        _log_cmd_result(cmd, None, error, returncode, silent=True)
+        return error, returncode
+    finally:
+        if proc is not None:
+            if proc.poll() is None:
+                _kill_proc_tree(proc.pid)
+                proc.wait()
+            proc.stdout.close()
+            proc.stderr.close()
+        slots.release()
+
+
+async def run_command_async(cmd, timeout=None, silent=False, env_vars=None):
+    """
+    asyncio version of run_command, without output callback. Returns the
+    same (out, error, returncode) tuple.
+
+    If the calling task is cancelled, the command is killed and its slot,
+    once acquired, released.
+    """
+    loop = asyncio.get_running_loop()
+    slots = _get_command_slots()
+
+    # do not block the event loop while waiting for a free slot. The thread
+    # waiting for it can not be interrupted, so when the task is cancelled,
+    # the slot is released as soon as the thread gets it
+    acquire = loop.run_in_executor(None, slots.acquire)
+    try:
+        await asyncio.shield(acquire)
+    except asyncio.CancelledError:
+        acquire.add_done_callback(
+            lambda f: f.cancelled() or f.exception() or slots.release())
+        raise
+
+    proc = None
+    try:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                env=_get_command_env(env_vars)
+            )
+        except OSError as e:
+            msg = f"Impossible to execute {' '.join(cmd)}"
+            wok_log.debug(msg)
+            return None, f'{msg} {e}', -1
+
+        wok_log.debug(f"Run command: {' '.join(cmd)}")
+        try:
+            out, error = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            _kill_proc_tree(proc.pid)
+            await proc.wait()
+            _raise_cmd_timeout(cmd, timeout)
+
+        out = out.decode('utf-8')
+        _log_cmd_result(cmd, out, error, proc.returncode, silent)
+        return out, error, proc.returncode
+    finally:
+        # the task was cancelled while the command was running
+        if proc is not None and proc.returncode is None:
+            _kill_proc_tree(proc.pid)
+        slots.release()
+
+
+# Default time, in seconds, a cached command result is reused
+COMMAND_CACHE_TTL = 30
+# Number of cached results above which the expired ones are dropped
+COMMAND_CACHE_PURGE_SIZE = 256
+
+# (cmd, env) -> (time run, expiration time, (out, error, returncode))
+_command_cache = {}
+# (cmd, env) -> _CommandCall of the commands being run
+_command_calls = {}
+_command_cache_stats = {'hits': 0, 'misses': 0, 'shared': 0}
+_command_cache_lock = threading.Lock()
+
+
+class _CommandCall(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+def _get_command_cache_key(cmd, env_vars):
+    env = None if env_vars is None else tuple(sorted(env_vars.items()))
+    return (tuple(cmd), env)
+
+
+def run_command_cached(cmd, ttl=COMMAND_CACHE_TTL, timeout=None, silent=False,
+                       env_vars=None):
+    """
+    Memoizing run_command, for commands which only read the system state.
+
+    A successful result (returncode 0) is reused by the calls with the same
+    cmd and env_vars, as long as it is less than ttl seconds old. Concurrent
+    calls for a command which is already running wait for its result instead
+    of running it again.
+    """
+    key = _get_command_cache_key(cmd, env_vars)
+
+    with _command_cache_lock:
+        cached = _command_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < ttl:
+            _command_cache_stats['hits'] += 1
+            return cached[2]
+
+        call = _command_calls.get(key)
+        if call is not None:
+            _command_cache_stats['shared'] += 1
+            leader = False
+        else:
+            _command_cache_stats['misses'] += 1
+            call = _command_calls[key] = _CommandCall()
+            leader = True
+
+    if not leader:
+        call.done.wait()
+        if call.exception is not None:
+            raise call.exception
+        return call.result
+
+    try:
+        # run_command may change env_vars
+        env = None if env_vars is None else dict(env_vars)
+        call.result = run_command(cmd, timeout, silent, env_vars=env)
+    except Exception as e:
+        call.exception = e
+        raise
+    finally:
+        with _command_cache_lock:
+            del _command_calls[key]
+            if call.result is not None and call.result[2] == 0:
+                now = time.monotonic()
+                if len(_command_cache) >= COMMAND_CACHE_PURGE_SIZE:
+                    for k in [k for k, v in _command_cache.items()
+                              if v[1] <= now]:
+                        del _command_cache[k]
+                _command_cache[key] = (now, now + ttl, call.result)
+        call.done.set()
+
+    return call.result
+
+
+def invalidate_command_cache(cmd=None):
+    """
+    Drop the cached results of a command, whatever its env_vars, or of all
+    commands if cmd is None.
+    """
+    with _command_cache_lock:
+        if cmd is None:
+            _command_cache.clear()
+            return
+
+        cmd = tuple(cmd)
+        for key in [k for k in _command_cache if k[0] == cmd]:
+            del _command_cache[key]
+
+
+def get_command_cache_stats():
+    """
+    Return the command cache counters: hits, misses (the command was run),
+    shared (the result of a running command was waited for), the hit rate
+    and the number of cached results.
+    """
+    with _command_cache_lock:
+        stats = dict(_command_cache_stats)
+        now = time.monotonic()
+        stats['size'] = len(
+            [v for v in _command_cache.values() if v[1] > now])
+
+    calls = stats['hits'] + stats['misses'] + stats['shared']
+    stats['hit_rate'] = (stats['hits'] + stats['shared']) / calls \
+        if calls else 0.0
+    return stats
 
 
 def parse_cmd_output(output, output_items):
@@ -495,7 +1186,7 @@ def parse_cmd_output(output, output_items):
 def patch_find_nfs_target(nfs_server):
     cmd = ['showmount', '--no-headers', '--exports', nfs_server]
     try:
-        out = run_command(cmd, 10)[0]
+        out = run_command_cached(cmd, timeout=10)[0]
     except TimeoutExpired:
         msg = f'server {nfs_server} query timeout.'
         msg += ' may not have any path exported'
@@ -0,0 +1,349 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+"""
+Load-testing benchmark for the Wok REST API.
+
+A Wok server is started in test mode, with the sample plugin, and each
+scenario is run for a fixed time by concurrent clients, over persistent
+connections. The throughput and latency percentiles of each scenario are
+reported, and may be saved as a baseline to compare later runs against.
+
+It is not run with the unit tests. Run it from the tests directory:
+
+    PYTHONPATH=../src:../ python3 benchmark.py --save-baseline base.json
+    (apply a change)
+    PYTHONPATH=../src:../ python3 benchmark.py --baseline base.json
+
+The exit status is 1 when a scenario regressed more than the threshold.
+Results are only comparable on the same machine, with the same options.
+"""
+import argparse
+import base64
+import http.client
+import json
+import math
+import platform
+import sys
+import threading
+import time
+
+import utils
+from wok.utils import get_enabled_plugins
+
+
+SAMPLE_URI = '/plugins/sample'
+
+# Number of rectangles created in the sample plugin before the benchmark
+RECTANGLES = 100
+
+# Interval, in seconds, to poll the tasks created by the 'task' scenario
+TASK_POLL_INTERVAL = 0.05
+
+
+class Client(object):
+    """
+    HTTP client using a persistent connection to the test server.
+    """
+
+    def __init__(self, user='admin'):
+        self.conn = http.client.HTTPConnection(utils.HOST, utils.PORT)
+        password = utils.fake_user[user]
+        auth = base64.b64encode(f'{user}:{password}'.encode('utf-8'))
+        self.headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'AUTHORIZATION': f"Basic {auth.decode('utf-8')}",
+        }
+
+    def request(self, path, data=None, method='GET', auth=True):
+        headers = dict(self.headers)
+        if not auth:
+            del headers['AUTHORIZATION']
+
+        self.conn.request(method, path, data, headers)
+        resp = self.conn.getresponse()
+        body = resp.read()
+        return resp.status, body
+
+    def close(self):
+        self.conn.close()
+
+
+def _get_rectangles(client, worker, i):
+    return client.request(f'{SAMPLE_URI}/rectangles')
+
+
+def _get_rectangle(client, worker, i):
+    return client.request(f'{SAMPLE_URI}/rectangles/rect{i % RECTANGLES}')
+
+
+def _update_rectangle(client, worker, i):
+    data = json.dumps({'length': i % 10 + 1})
+    return client.request(
+        f'{SAMPLE_URI}/rectangles/rect{worker % RECTANGLES}', data, 'PUT')
+
+
+def _enable_plugin(client, worker, i):
+    # the sample plugin is already enabled: the action does not change it
+    return client.request('/config/plugins/sample/enable', '{}', 'POST')
+
+
+def _run_task(client, worker, i):
+    data = json.dumps({'duration': 1, 'interval': 1000})
+    status, body = client.request('/profiler/start', data, 'POST')
+    if status != 202:
+        return status, body
+
+    task_id = json.loads(body)['id']
+    while True:
+        status, body = client.request(f'/tasks/{task_id}')
+        if status != 200 or json.loads(body)['status'] != 'running':
+            return status, body
+        time.sleep(TASK_POLL_INTERVAL)
+
+
+def _login(client, worker, i):
+    user = 'admin'
+    data = json.dumps({'username': user, 'password': utils.fake_user[user]})
+    return client.request('/login', data, 'POST', auth=False)
+
+
+def _get_logs(client, worker, i):
+    return client.request('/logs')
+
+
+# Scenarios: (name, function, number of clients). A function receives a
+# client, the index of the client and the iteration number, and returns the
+# response status and body. When the number of clients is None, the
+# --concurrency option is used.
+SCENARIOS = [
+    ('collection', _get_rectangles, None),
+    ('resource', _get_rectangle, None),
+    ('update', _update_rectangle, None),
+    ('action', _enable_plugin, None),
+    # only one profiler may run at a time, so tasks are not concurrent
+    ('task', _run_task, 1),
+    ('login', _login, None),
+    ('logs', _get_logs, None),
+]
+
+
+def percentile(values, percent):
+    """
+    Return the nearest-rank percentile of a sorted list of values.
+    """
+    if not values:
+        return 0.0
+    rank = math.ceil(percent / 100.0 * len(values))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def _run_clients(fn, clients, duration):
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    deadline = time.perf_counter() + duration
+
+    def _worker(index):
+        client = Client()
+        i = 0
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                status, _ = fn(client, index, i)
+                latencies[index].append(time.perf_counter() - start)
+                if status >= 400:
+                    errors[index] += 1
+                i += 1
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=_worker, args=(index,))
+               for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return sorted(sum(latencies, [])), sum(errors), elapsed
+
+
+def run_scenario(fn, clients, duration, warmup):
+    if warmup > 0:
+        _run_clients(fn, clients, warmup)
+
+    latencies, errors, elapsed = _run_clients(fn, clients, duration)
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        'clients': clients,
+        'requests': len(ms),
+        'errors': errors,
+        'throughput': len(ms) / elapsed,
+        'mean': sum(ms) / len(ms) if ms else 0.0,
+        'p50': percentile(ms, 50),
+        'p90': percentile(ms, 90),
+        'p99': percentile(ms, 99),
+        'max': ms[-1] if ms else 0.0,
+    }
+
+
+def setup_sample_data():
+    client = Client()
+    try:
+        for i in range(RECTANGLES):
+            data = json.dumps({'name': f'rect{i}', 'length': i + 1,
+                               'width': i + 2})
+            status, body = client.request(
+                f'{SAMPLE_URI}/rectangles', data, 'POST')
+            if status != 201:
+                raise RuntimeError(f'Unable to create rectangle: {body}')
+    finally:
+        client.close()
+
+
+def print_results(results):
+    print(f"{'scenario':<12}{'clients':>8}{'requests':>10}{'errors':>8}"
+          f"{'req/s':>10}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}"
+          f"{'max':>9}")
+    for name, res in results.items():
+        print(f"{name:<12}{res['clients']:>8}{res['requests']:>10}"
+              f"{res['errors']:>8}{res['throughput']:>10.1f}"
+              f"{res['mean']:>9.2f}{res['p50']:>9.2f}{res['p90']:>9.2f}"
+              f"{res['p99']:>9.2f}{res['max']:>9.2f}")
+    print('Latencies in milliseconds.')
+
+
+def _change(current, base):
+    if not base:
+        return 0.0
+    return (current - base) / base * 100
+
+
+def compare_results(results, baseline, threshold):
+    """
+    Print the changes from the baseline results and return the names of the
+    scenarios whose throughput dropped, or whose median or 99th percentile
+    latency grew, more than threshold percent.
+    """
+    regressions = []
+    print(f"{'scenario':<12}{'req/s':>10}{'p50':>10}{'p99':>10}")
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f'{name:<12}{"(not in baseline)":>30}')
+            continue
+
+        throughput = _change(res['throughput'], base['throughput'])
+        p50 = _change(res['p50'], base['p50'])
+        p99 = _change(res['p99'], base['p99'])
+        regressed = (throughput < -threshold or p50 > threshold or
+                     p99 > threshold)
+        if regressed:
+            regressions.append(name)
+
+        print(f"{name:<12}{throughput:>+9.1f}%{p50:>+9.1f}%{p99:>+9.1f}%"
+              f"{'  REGRESSION' if regressed else ''}")
+
+    return regressions
+
+
+def get_settings(args):
+    return {
+        'duration': args.duration,
+        'concurrency': args.concurrency,
+        'python': platform.python_version(),
+        'machine': platform.node(),
+    }
+
+
+def parse_args(argv):
+    names = [name for name, _, _ in SCENARIOS]
+    parser = argparse.ArgumentParser(
+        description='Load-testing benchmark for the Wok REST API.')
+    parser.add_argument('-d', '--duration', type=float, default=10,
+                        help='seconds to run each scenario (default: 10)')
+    parser.add_argument('-c', '--concurrency', type=int, default=8,
+                        help='number of concurrent clients (default: 8)')
+    parser.add_argument('-w', '--warmup', type=float, default=1,
+                        help='seconds to run each scenario before measuring '
+                             '(default: 1)')
+    parser.add_argument('-s', '--scenario', action='append', choices=names,
+                        help='scenario to run, may be repeated (default: '
+                             'all)')
+    parser.add_argument('--save-baseline', metavar='FILE',
+                        help='save the results to FILE')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare the results to the ones saved in FILE')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='change, in percent, reported as a regression '
+                             'when comparing to a baseline (default: 10)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if 'sample' not in [plugin for plugin, _ in get_enabled_plugins()]:
+        sys.exit('The sample plugin must be enabled to run the benchmark.')
+
+    utils.patch_auth()
+    server = utils.run_server(test_mode=True)
+    try:
+        setup_sample_data()
+
+        results = {}
+        for name, fn, clients in SCENARIOS:
+            if args.scenario and name not in args.scenario:
+                continue
+            print(f'Running {name}...', file=sys.stderr)
+            results[name] = run_scenario(
+                fn, clients or args.concurrency, args.duration, args.warmup)
+    finally:
+        server.stop()
+
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'settings': get_settings(args), 'results': results},
+                      f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        print()
+        if baseline.get('settings') != get_settings(args):
+            print(f"Warning: baseline settings {baseline.get('settings')} "
+                  'differ from the current ones, results may not be '
+                  'comparable.')
+        regressions = compare_results(
+            results, baseline.get('results', {}), args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -24,6 +24,8 @@ from functools import partial
 import mock
 import utils
 from wok.asynctask import AsyncTask
+from wok.model.notifications import add_notification
+from wok.model.notifications import del_notification
 from wok.rollbackcontext import RollbackContext
 from wok.utils import set_plugin_state
 
@@ -111,6 +113,30 @@ class APITests(unittest.TestCase):
                     break
             self.assertFalse(plugin_state)
 
+    def test_notifications_etag(self):
+        resp = self.request('/notifications')
+        self.assertEqual(200, resp.status)
+        resp.read()
+        etag = resp.getheader('ETag')
+        self.assertIsNotNone(etag)
+
+        hdrs = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'If-None-Match': etag,
+        }
+        resp = self.request('/notifications', None, 'GET', hdrs)
+        self.assertEqual(304, resp.status)
+        self.assertEqual(b'', resp.read())
+
+        # the model version changes with the notifications
+        add_notification('WOKCONFIG0001I')
+        self.addCleanup(del_notification, 'WOKCONFIG0001I')
+        resp = self.request('/notifications', None, 'GET', hdrs)
+        self.assertEqual(200, resp.status)
+        self.assertNotEqual(etag, resp.getheader('ETag'))
+        self.assertIn('WOKCONFIG0001I', resp.read().decode('utf-8'))
+
     def test_plugins_api_404(self):
         resp = self.request('/plugins')
         self.assertEqual(404, resp.status)
@@ -0,0 +1,173 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+from wok import auth
+from wok.config import config
+
+
+class CountingUser(auth.User):
+    auth_type = 'counting'
+    passwords = {'alice': 'secret'}
+    calls = {'authenticate': 0, 'groups': 0, 'role': 0}
+
+    def _get_groups(self):
+        self.calls['groups'] += 1
+        return ['wheel']
+
+    def _get_role(self):
+        self.calls['role'] += 1
+        return 'admin'
+
+    @classmethod
+    def authenticate(cls, username, password):
+        cls.calls['authenticate'] += 1
+        return cls.passwords.get(username) == password
+
+
+class AuthCacheTests(unittest.TestCase):
+    def setUp(self):
+        ttl = config.get('authentication', 'auth_cache_ttl')
+        self.addCleanup(config.set, 'authentication', 'auth_cache_ttl', ttl)
+        config.set('authentication', 'auth_cache_ttl', '60')
+
+        auth.auth_cache.clear()
+        self.addCleanup(auth.auth_cache.clear)
+        for key in CountingUser.calls:
+            CountingUser.calls[key] = 0
+
+    def _get_user(self, username, password):
+        return auth.User.get({'auth_type': 'counting', 'username': username,
+                              'password': password})
+
+    def test_credentials_cache(self):
+        cache = auth.AuthCache()
+        self.assertFalse(cache.check_credentials('pam', 'alice', 'secret'))
+
+        cache.add_credentials('pam', 'alice', 'secret')
+        self.assertTrue(cache.check_credentials('pam', 'alice', 'secret'))
+        self.assertFalse(cache.check_credentials('pam', 'alice', 'Secret'))
+        self.assertFalse(cache.check_credentials('ldap', 'alice', 'secret'))
+
+        # the password itself is not kept
+        self.assertNotIn(b'secret', repr(cache._credentials).encode())
+
+        config.set('authentication', 'auth_cache_ttl', '0')
+        cache.clear()
+        cache.add_credentials('pam', 'alice', 'secret')
+        self.assertFalse(cache.check_credentials('pam', 'alice', 'secret'))
+
+    def test_user_get_cached(self):
+        for _ in range(3):
+            user = self._get_user('alice', 'secret')
+            self.assertEqual(['wheel'], user.groups)
+            self.assertEqual('admin', user.role)
+        self.assertEqual(
+            {'authenticate': 1, 'groups': 1, 'role': 1}, CountingUser.calls)
+
+        # wrong credentials are always verified and never cached
+        self.assertIsNone(self._get_user('alice', 'wrong'))
+        self.assertIsNone(self._get_user('alice', 'wrong'))
+        self.assertEqual(3, CountingUser.calls['authenticate'])
+
+        # the cache only lasts auth_cache_ttl seconds
+        config.set('authentication', 'auth_cache_ttl', '0')
+        auth.auth_cache.clear()
+        self._get_user('alice', 'secret')
+        self._get_user('alice', 'secret')
+        self.assertEqual(
+            {'authenticate': 5, 'groups': 3, 'role': 3}, CountingUser.calls)
+
+    def test_ldap_pool(self):
+        connections = []
+
+        class FakeConnection(object):
+            closed = False
+
+            def unbind_s(self):
+                self.closed = True
+
+        def _connect(uri):
+            connections.append(FakeConnection())
+            return connections[-1]
+
+        pool = auth.LDAPConnectionPool(max_idle=1)
+        first = pool.get('ldap://localhost', _connect)
+        second = pool.get('ldap://localhost', _connect)
+        self.assertEqual(2, len(connections))
+
+        pool.put('ldap://localhost', first)
+        pool.put('ldap://localhost', second)
+        self.assertTrue(second.closed)
+        self.assertIs(first, pool.get('ldap://localhost', _connect))
+        self.assertIsNot(first, pool.get('ldap://other', _connect))
+
+
+class TokenTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.key_path = os.path.join(tmp_dir, 'api-token.key')
+
+        patcher = mock.patch('wok.auth.get_api_token_key_path',
+                             return_value=self.key_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        auth._token_key = None
+        self.addCleanup(setattr, auth, '_token_key', None)
+
+    def test_token_key(self):
+        key = auth.get_token_key()
+        self.assertEqual(auth.TOKEN_KEY_SIZE, len(key))
+        self.assertEqual(0o600, os.stat(self.key_path).st_mode & 0o777)
+
+        # the key is kept across restarts
+        auth._token_key = None
+        self.assertEqual(key, auth.get_token_key())
+
+    def test_issue_verify_token(self):
+        token, expires = auth.issue_token('alice', ['wheel'], 'admin', 60)
+        self.assertAlmostEqual(time.time() + 60, expires, delta=2)
+
+        claims = auth.verify_token(token)
+        self.assertEqual('alice', claims['sub'])
+        self.assertEqual(['wheel'], claims['groups'])
+        self.assertEqual('admin', claims['role'])
+        self.assertEqual(expires, claims['exp'])
+
+        prefix, payload, signature = token.split('.')
+        forged = auth._b64encode(
+            b'{"sub":"alice","role":"admin","exp":9999999999}')
+        for invalid in ('', 'garbage', token + 'x', token[:-2],
+                        f'{prefix}.{forged}.{signature}',
+                        f'wok0.{payload}.{signature}', 'wok1.\u00e9.x'):
+            self.assertIsNone(auth.verify_token(invalid), invalid)
+
+        # tokens are signed with the key of the server
+        auth._token_key = os.urandom(auth.TOKEN_KEY_SIZE)
+        self.assertIsNone(auth.verify_token(token))
+
+    def test_expired_token(self):
+        token, _ = auth.issue_token('alice', None, 'user', -1)
+        self.assertIsNone(auth.verify_token(token))
@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import json
 import unittest
 from functools import partial
 
@@ -55,3 +56,22 @@ class AuthorizationTests(unittest.TestCase):
         self.assertEqual(403, resp.status)
         resp = self.request('/config/plugins/sample/disable', '{}', 'POST')
         self.assertEqual(403, resp.status)
+
+    def _token_headers(self, user):
+        resp = request('/token', '{}', 'POST', user=user)
+        self.assertEqual(200, resp.status)
+        token = json.loads(resp.read())['token']
+        return {'AUTHORIZATION': f'Bearer {token}',
+                'Accept': 'application/json'}
+
+    def test_token_access(self):
+        # the role of the token user is checked like the session one
+        hdrs = self._token_headers('user')
+        resp = request('/metrics', None, 'GET', hdrs)
+        self.assertEqual(403, resp.status)
+        resp = request('/tasks', None, 'GET', hdrs)
+        self.assertEqual(200, resp.status)
+
+        hdrs = self._token_headers('admin')
+        resp = request('/metrics', None, 'GET', hdrs)
+        self.assertEqual(200, resp.status)
@@ -0,0 +1,278 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import json
+import time
+import unittest
+
+import cherrypy
+from cherrypy import _cprequest
+from cherrypy.lib import httputil
+from wok import metrics
+from wok.control.base import build_dispatch_table
+from wok.control.base import Collection
+from wok.control.base import Resource
+from wok.control.utils import parse_paging_params
+from wok.template import set_request_identity
+
+
+class Disk(Resource):
+    @property
+    def data(self):
+        return self.info
+
+
+class Disks(Collection):
+    def __init__(self, model):
+        super(Disks, self).__init__(model)
+        self.resource = Disk
+
+
+class PagingModel(object):
+    def disks_get_list(self, _sort=None, _limit=None, _offset=None):
+        return []
+
+
+class UnsortedPagingModel(object):
+    def disks_get_list(self, _limit=None, _offset=None):
+        return []
+
+
+class DisksModel(object):
+    idents = ['sda', 'sdb', 'broken', 'secret', 'sdc']
+
+    def disks_get_list(self):
+        return self.idents
+
+    def disk_lookup(self, ident):
+        time.sleep(0.05)
+        if ident == 'broken':
+            raise Exception('Unable to read the disk')
+        info = {'name': ident}
+        if ident == 'secret':
+            info['users'] = ['bob']
+        return info
+
+
+class BulkDisksModel(DisksModel):
+    def __init__(self):
+        self.calls = []
+
+    def disk_lookup(self, ident):
+        self.calls.append(('lookup', ident))
+        return super(BulkDisksModel, self).disk_lookup(ident)
+
+    def disk_lookup_many(self, idents):
+        self.calls.append(('lookup_many', idents))
+        if 'broken' in idents:
+            raise Exception('Unable to read the disks')
+        return {ident: {'name': ident} for ident in idents}
+
+
+class CheckedDisk(Disk):
+    def lookup(self):
+        self.info = self.model.disk_lookup(*self.model_args)
+        self.info['checked'] = True
+
+
+class CheckedDisksModel(BulkDisksModel):
+    checkeddisk_lookup_many = BulkDisksModel.disk_lookup_many
+
+    def disks_get_list_detailed(self):
+        self.calls.append(('get_list_detailed',))
+        return [(ident, {'name': ident}) for ident in self.idents]
+
+
+class NamedDisksModel(DisksModel):
+    idents = ['sda', 'sdb', 'sdc']
+
+    def nameddisks_get_list(self, _sort=None, _limit=None, _offset=None):
+        return self.idents
+
+
+class NamedDisks(Disks):
+    def _get_resources(self, flag_filter):
+        resources = super(NamedDisks, self)._get_resources(flag_filter)
+        return [res for res in resources if res.ident != 'sdb']
+
+    def filter_data(self, resources, fields_filter):
+        data = super(NamedDisks, self).filter_data(resources, fields_filter)
+        return [dict(item, named=True) for item in data]
+
+
+class Folder(Resource):
+    def __init__(self, model, ident):
+        super(Folder, self).__init__(model, ident)
+        # a folder holds folders
+        self.folders = Folders(model)
+
+
+class Folders(Collection):
+    def __init__(self, model):
+        super(Folders, self).__init__(model)
+        self.resource = Folder
+
+
+class CollectionTests(unittest.TestCase):
+    def _load_request(self):
+        request = _cprequest.Request(httputil.Host('127.0.0.1', 80),
+                                     httputil.Host('127.0.0.1', 1234))
+        serving = cherrypy.serving
+        self.addCleanup(serving.__dict__.update, dict(serving.__dict__))
+        self.addCleanup(serving.__dict__.clear)
+        serving.load(request, _cprequest.Response())
+        set_request_identity(
+            {'username': 'alice', 'groups': [], 'role': 'user'})
+        return request
+
+    def _list(self, collection):
+        resources = collection._iter_resources({})
+        return [data['name'] for data in
+                collection._iter_filtered_data(resources, {})]
+
+    def test_parallel_lookup(self):
+        request = self._load_request()
+        # the hooks of a request not run are the ones shared by all requests
+        request.hooks = _cprequest.HookMap(_cprequest.hookpoints)
+        metrics.start_request()
+        self.addCleanup(metrics.reset_metrics)
+
+        collection = Disks(DisksModel())
+        collection.parallel_lookup = True
+        start = time.perf_counter()
+        names = self._list(collection)
+        elapsed = time.perf_counter() - start
+
+        # resources failing to be looked up or not authorized are skipped
+        self.assertEqual(['sda', 'sdb', 'sdc'], names)
+
+        # concurrent lookups are not counted more than once
+        self.assertLessEqual(request.wok_timings['model'], elapsed)
+
+        collection.parallel_lookup = False
+        self.assertEqual(names, self._list(collection))
+
+    def test_bulk_lookup(self):
+        self._load_request()
+        model = BulkDisksModel()
+        model.idents = ['sda', 'sdb']
+        collection = Disks(model)
+        self.assertEqual(['sda', 'sdb'], self._list(collection))
+        self.assertEqual([('lookup_many', ['sda', 'sdb'])], model.calls)
+
+        # a failed batch is looked up one by one
+        model.calls = []
+        model.idents = ['sda', 'broken', 'sdc']
+        self.assertEqual(['sda', 'sdc'], self._list(collection))
+        self.assertEqual(
+            [('lookup_many', ['sda', 'broken', 'sdc']), ('lookup', 'sda'),
+             ('lookup', 'broken'), ('lookup', 'sdc')],
+            model.calls)
+
+    def test_bulk_lookup_fallback(self):
+        self._load_request()
+
+        # the model has no lookup_many
+        collection = Disks(DisksModel())
+        self.assertEqual(['sda', 'sdb', 'sdc'], self._list(collection))
+
+        # the resource overrides lookup
+        model = CheckedDisksModel()
+        model.idents = ['sda', 'sdb']
+        collection = Disks(model)
+        collection.resource = CheckedDisk
+        data = list(collection._iter_filtered_data(
+            collection._iter_resources({}), {}))
+        self.assertEqual(
+            [{'name': 'sda', 'checked': True},
+             {'name': 'sdb', 'checked': True}], data)
+        self.assertEqual([('lookup', 'sda'), ('lookup', 'sdb')], model.calls)
+
+        # the collection model lists the resources with their info
+        model.calls = []
+        collection.resource = Disk
+        data = list(collection._iter_filtered_data(
+            collection._iter_resources({}), {}))
+        self.assertEqual([{'name': 'sda'}, {'name': 'sdb'}], data)
+        self.assertEqual([('get_list_detailed',)], model.calls)
+
+    def _push(self, model, params, fields_filter=None, model_paging=True):
+        collection = Disks(model)
+        collection.model_paging = model_paging
+        flag_filter = dict(params)
+        paging = parse_paging_params(flag_filter)
+        pushed = collection._push_paging_params(
+            paging, flag_filter, fields_filter or {})
+        return pushed, flag_filter
+
+    def test_push_paging_params(self):
+        params = {'_sort': 'name', '_limit': '2', '_offset': '4'}
+        pushed, flag_filter = self._push(PagingModel(), params)
+        self.assertEqual({'_sort', '_limit', '_offset'}, pushed)
+        self.assertEqual({'_sort': ['name'], '_limit': 2, '_offset': 4},
+                         flag_filter)
+
+        # filtered collections are paged after filtering
+        pushed, flag_filter = self._push(PagingModel(), params,
+                                         fields_filter={'name': 'sda'})
+        self.assertEqual({'_sort'}, pushed)
+
+        # the collection may drop resources returned by the model
+        pushed, _ = self._push(PagingModel(), params, model_paging=False)
+        self.assertEqual({'_sort'}, pushed)
+
+    def test_push_paging_params_no_sort(self):
+        # the page of an unsorted model is not the page of the sorted data
+        params = {'_sort': 'name', '_limit': '2'}
+        pushed, flag_filter = self._push(UnsortedPagingModel(), params)
+        self.assertEqual(set(), pushed)
+        self.assertEqual({}, flag_filter)
+
+        pushed, flag_filter = self._push(UnsortedPagingModel(),
+                                         {'_limit': '2'})
+        self.assertEqual({'_limit', '_offset'}, pushed)
+        self.assertEqual({'_limit': 2}, flag_filter)
+
+    def test_overridden_hooks(self):
+        request = self._load_request()
+        request.headers = httputil.HeaderMap({'Accept': 'application/json'})
+        collection = NamedDisks(NamedDisksModel())
+        self.assertEqual(
+            [{'name': 'sda', 'named': True}, {'name': 'sdc', 'named': True}],
+            json.loads(collection.get({})))
+
+        # the collection drops resources, so the model does not page them
+        collection.model_paging = True
+        flag_filter = {'_limit': 2}
+        pushed = collection._push_paging_params(dict(flag_filter),
+                                                flag_filter, {})
+        self.assertEqual(set(), pushed)
+
+    def test_dispatch_table_cycle(self):
+        root = Disk(DisksModel(), 'root')
+        root.disks = Disks(root.model)
+        # a controller referring to its parent
+        root.disks.root = root
+        root.folders = Folders(root.model)
+
+        table = build_dispatch_table(root)
+        self.assertEqual(
+            ['/disks', '/disks/<ident>', '/folders', '/folders/<ident>',
+             '/folders/<ident>/folders'],
+            sorted(table))
+        self.assertEqual('disk_lookup', table['/disks/<ident>']['lookup'])
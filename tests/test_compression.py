@@ -0,0 +1,84 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import gzip
+import unittest
+
+import cherrypy
+import mock
+from cherrypy import _cprequest
+from cherrypy.lib import httputil
+from wok import compression
+
+
+BODY = b'{"name": "wok"}' * 100
+
+
+class CompressionTests(unittest.TestCase):
+    def _load(self, accept_encoding, body=BODY, stream=False):
+        request = _cprequest.Request(httputil.Host('127.0.0.1', 80),
+                                     httputil.Host('127.0.0.1', 1234))
+        request.headers = httputil.HeaderMap()
+        if accept_encoding is not None:
+            request.headers['Accept-Encoding'] = accept_encoding
+        response = _cprequest.Response()
+        response.headers['Content-Type'] = 'application/json;charset=utf-8'
+        response.body = [body]
+        response.stream = stream
+
+        serving = cherrypy.serving
+        self.addCleanup(serving.__dict__.update, dict(serving.__dict__))
+        self.addCleanup(serving.__dict__.clear)
+        serving.load(request, response)
+        return response
+
+    def test_gzip(self):
+        response = self._load('gzip, deflate')
+        compression.compress()
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(BODY, gzip.decompress(response.collapse_body()))
+
+    def test_brotli(self):
+        brotli = mock.Mock()
+        brotli.compress.return_value = b'compressed'
+        with mock.patch.object(compression, 'brotli', brotli):
+            response = self._load('gzip, br')
+            compression.compress(level=4)
+
+        brotli.compress.assert_called_once_with(BODY, quality=4)
+        self.assertEqual('br', response.headers['Content-Encoding'])
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(b'compressed', response.collapse_body())
+
+    def test_unsupported_encoding(self):
+        # the body is sent uncompressed rather than refused
+        with mock.patch.object(compression, 'brotli', None):
+            for accept_encoding in ('deflate', 'br', None):
+                response = self._load(accept_encoding)
+                compression.compress()
+                self.assertNotIn('Content-Encoding', response.headers)
+                self.assertEqual('Accept-Encoding', response.headers['Vary'])
+                self.assertEqual(BODY, response.collapse_body())
+
+    def test_small_body(self):
+        response = self._load('gzip', body=b'{}')
+        compression.compress()
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertNotIn('Vary', response.headers)
+        self.assertEqual(b'{}', response.collapse_body())
@@ -0,0 +1,170 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import http.client
+import http.server
+import json
+import threading
+import time
+import unittest
+
+import mock
+from wok.config import config
+from wok.exception import InvalidParameter
+from wok.model import federation
+
+
+class StubPeerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path == '/slow':
+            time.sleep(self.server.delay)
+
+        if self.path == '/fail':
+            status, body = 500, b'{}'
+        else:
+            status = 200
+            body = json.dumps({'path': self.path}).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubPeer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay=0):
+        super(StubPeer, self).__init__(('127.0.0.1', 0), StubPeerHandler)
+        self.requests = []
+        self.delay = delay
+        self.url = f'https://127.0.0.1:{self.server_address[1]}'
+
+    def handle_error(self, request, client_address):
+        # the federation model gives up on slow peers
+        pass
+
+
+def _plain_connection(netloc, timeout=None, context=None):
+    # stub peers do not use SSL
+    return http.client.HTTPConnection(netloc, timeout=timeout)
+
+
+class FederationTests(unittest.TestCase):
+    def setUp(self):
+        self.peers = []
+        patcher = mock.patch.object(federation.http.client, 'HTTPSConnection',
+                                    _plain_connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(federation, 'get_peers',
+                                    lambda: [p.url for p in self.peers])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _set_config(self, name, value):
+        self.addCleanup(config.set, 'server', name,
+                        config.get('server', name))
+        config.set('server', name, value)
+
+    def _start_peer(self, delay=0):
+        peer = StubPeer(delay)
+        thread = threading.Thread(target=peer.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(peer.server_close)
+        self.addCleanup(peer.shutdown)
+        self.peers.append(peer)
+        return peer
+
+    def _get_model(self):
+        model = federation.FederationModel()
+        self.addCleanup(model._get_executor().shutdown)
+        return model
+
+    def test_fan_out(self):
+        peers = [self._start_peer(), self._start_peer()]
+        model = self._get_model()
+
+        data = model.get_list('/tasks?status=running', 'Basic secret')
+        self.assertEqual({}, data['errors'])
+        self.assertEqual(
+            {p.url: {'path': '/tasks?status=running'} for p in peers},
+            data['results'])
+
+        # credentials are not forwarded by default
+        for peer in peers:
+            _, headers = peer.requests[0]
+            self.assertNotIn('Authorization', headers)
+
+    def test_errors(self):
+        self._set_config('federation_timeout', '1')
+        ok, slow = self._start_peer(), self._start_peer(delay=3)
+        down = 'https://127.0.0.1:1'
+        self.peers.append(mock.Mock(url=down))
+        model = self._get_model()
+
+        data = model.get_list('/slow')
+        self.assertEqual({ok.url: {'path': '/slow'}}, data['results'])
+        self.assertEqual({slow.url, down}, set(data['errors']))
+
+        data = model.get_list('/fail')
+        self.assertEqual({}, data['results'])
+        self.assertIn('500', data['errors'][ok.url])
+
+    def test_invalid_path(self):
+        model = self._get_model()
+        for path in ('tasks', '//evil.example.com/tasks', '/federation',
+                     '/federation?path=/tasks', '/plugins/../federation'):
+            self.assertRaises(InvalidParameter, model.get_list, path)
+
+    def test_forward_auth(self):
+        peer = self._start_peer()
+
+        # credentials are only sent to peers with a verified certificate
+        self._set_config('federation_forward_auth', 'on')
+        model = self._get_model()
+        self.assertFalse(model.forward_auth)
+
+        self._set_config('federation_verify_ssl', 'on')
+        model = self._get_model()
+        self.assertTrue(model.forward_auth)
+        model.get_list('/tasks', 'Basic secret')
+        _, headers = peer.requests[-1]
+        self.assertEqual('Basic secret', headers['Authorization'])
+
+    def test_connection_retry(self):
+        peer = self._start_peer()
+        model = self._get_model()
+        model.get_list('/tasks')
+
+        # the peer closed the pooled connection
+        netloc = peer.url.split('//', 1)[1]
+        conn = model.pool._idle[netloc][0]
+        conn.sock.shutdown(2)
+
+        data = model.get_list('/tasks')
+        self.assertEqual({peer.url: {'path': '/tasks'}}, data['results'])
+        self.assertEqual({}, data['errors'])
@@ -0,0 +1,60 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import unittest
+
+from wok.control.filters import compile_filter
+from wok.exception import InvalidParameter
+
+
+class FiltersTests(unittest.TestCase):
+    def setUp(self):
+        self.data = [
+            {'name': 'vm-1', 'status': 'running', 'size': 5},
+            {'name': 'vm-2', 'status': 'failed', 'size': 20},
+            {'name': 'guest', 'status': 'finished', 'size': 12.5},
+        ]
+
+    def _filter(self, params):
+        matches = compile_filter(params)
+        return [d['name'] for d in self.data if matches(d)]
+
+    def test_default_filter(self):
+        self.assertEqual(['vm-1', 'vm-2'], self._filter({'name': 'vm'}))
+        self.assertEqual(['vm-2'], self._filter({'size': '20'}))
+        self.assertEqual(
+            ['vm-1', 'guest'], self._filter({'status': ['running', 'finished']})
+        )
+        self.assertEqual([], self._filter({'missing': 'x'}))
+        # invalid regular expressions only match by equality
+        self.assertEqual([], self._filter({'name': '[vm'}))
+
+    def test_operators(self):
+        self.assertEqual(['vm-2', 'guest'], self._filter({'size__gt': '10'}))
+        self.assertEqual(['vm-1'], self._filter({'size__le': '5'}))
+        self.assertEqual(['vm-1', 'vm-2'], self._filter({'name__prefix': 'vm'}))
+        self.assertEqual(
+            ['vm-1', 'vm-2'], self._filter({'status__in': 'running,failed'})
+        )
+        self.assertEqual(['vm-2', 'guest'], self._filter({'status__ne': 'running'}))
+        self.assertEqual(
+            ['vm-2'], self._filter({'name__prefix': 'vm', 'size__ge': '20'})
+        )
+
+    def test_invalid_number(self):
+        self.assertRaises(InvalidParameter, compile_filter, {'size__gt': 'big'})
@@ -0,0 +1,48 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import os
+import subprocess
+import sys
+import unittest
+
+import wok
+
+
+class ImportTests(unittest.TestCase):
+    def test_import_modules(self):
+        # each module is imported first in a new interpreter, as an import
+        # cycle only breaks when it is entered from some of its modules
+        wok_dir = os.path.dirname(os.path.abspath(wok.__file__))
+        modules = []
+        for package in ('', 'control', 'model'):
+            for name in sorted(os.listdir(os.path.join(wok_dir, package))):
+                if not name.endswith('.py') or name == '__init__.py':
+                    continue
+                path = [p for p in ('wok', package, name[:-3]) if p]
+                modules.append('.'.join(path))
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        for module in modules:
+            with self.subTest(module=module):
+                proc = subprocess.run(
+                    [sys.executable, '-c', f'import {module}'], env=env,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    universal_newlines=True)
+                self.assertEqual(0, proc.returncode, proc.stdout)
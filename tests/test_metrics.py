@@ -0,0 +1,120 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import time
+import types
+import unittest
+
+import cherrypy
+import mock
+from wok import metrics
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        metrics.reset_metrics()
+        self.addCleanup(metrics.reset_metrics)
+
+    def _start_request(self, slow_threshold=0):
+        request = types.SimpleNamespace(
+            method='GET', path_info='/tasks', app=None, hooks=mock.Mock())
+        response = types.SimpleNamespace(status='200 OK')
+        # restore the serving state of this thread, which other tests use
+        serving = cherrypy.serving
+        self.addCleanup(serving.__dict__.update, dict(serving.__dict__))
+        self.addCleanup(serving.__dict__.clear)
+        serving.load(request, response)
+
+        metrics.start_request(slow_threshold)
+        request.hooks.attach.assert_called_once_with(
+            'on_end_request', metrics.end_request)
+        return request
+
+    def test_histogram(self):
+        histogram = metrics.Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+
+        self.assertEqual(4, histogram.count)
+        self.assertAlmostEqual(2.65, histogram.sum)
+        self.assertEqual([(0.1, 2), (1.0, 3), ('+Inf', 4)],
+                         histogram.cumulative_counts())
+
+    def test_request_phases(self):
+        request = self._start_request()
+        metrics.set_request_route('Tasks')
+
+        # nested phases are not counted in the outer one
+        with metrics.request_phase('render'):
+            time.sleep(0.02)
+            with metrics.request_phase('model'):
+                time.sleep(0.05)
+        timings = dict(request.wok_timings)
+        metrics.end_request()
+
+        self.assertEqual({'render', 'model'}, set(timings))
+        self.assertGreaterEqual(timings['model'], 0.05)
+        self.assertGreaterEqual(timings['render'], 0.02)
+        self.assertLess(timings['render'], 0.05)
+
+        # phases out of a measured request are ignored
+        with metrics.request_phase('model'):
+            pass
+        self.assertIsNone(request.wok_timings)
+
+        text = metrics.render_metrics()
+        labels = 'app="",route="Tasks",method="GET"'
+        for phase in ('total', 'render', 'model'):
+            self.assertIn(
+                'wok_request_duration_seconds_count'
+                f'{{{labels},phase="{phase}"}} 1\n', text)
+        self.assertIn(
+            'wok_request_duration_seconds_bucket'
+            f'{{{labels},phase="model",le="+Inf"}} 1\n', text)
+        self.assertNotIn('phase="auth"', text)
+        self.assertIn(f'wok_requests_total{{{labels},status="200"}} 1\n',
+                      text)
+        self.assertIn('# TYPE wok_command_cache_hits_total counter\n', text)
+
+    @mock.patch('wok.metrics.wok_log')
+    def test_slow_request_log(self, mock_log):
+        self._start_request(slow_threshold=10)
+        metrics.end_request()
+        mock_log.warning.assert_not_called()
+
+        self._start_request(slow_threshold=0.01)
+        with metrics.request_phase('validation'):
+            time.sleep(0.02)
+        metrics.end_request()
+        mock_log.warning.assert_called_once()
+        message = mock_log.warning.call_args[0][0]
+        self.assertIn('Slow request: GET /tasks (200)', message)
+        self.assertIn('validation: ', message)
+        self.assertIn('other: ', message)
+
+    def test_label_escaping(self):
+        self.assertEqual(
+            r'{route="a\"b\\c\nd"}',
+            metrics._format_labels(route='a"b\\c\nd'))
+
+    @mock.patch.dict('wok.utils.plugins_load_stats',
+                     {'kimchi': {'time': 0.5, 'rss': 2048}}, clear=True)
+    def test_plugin_load_stats(self):
+        text = metrics.render_metrics()
+        self.assertIn('wok_plugin_load_seconds{plugin="kimchi"} 0.5\n', text)
+        self.assertIn('wok_plugin_load_rss_bytes{plugin="kimchi"} 2048\n', text)
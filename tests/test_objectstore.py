@@ -59,6 +59,10 @@ class ObjectStoreTests(unittest.TestCase):
             item = session.get('fǒǒ', 'těst1')
             self.assertEqual(1, item[u'α'])
 
+            # Test get many
+            items = session.get_many('fǒǒ', ['těst1', 'těst2', 'těst3'])
+            self.assertEqual({'těst1': {'α': 1}, 'těst2': {'β': 2}}, items)
+
             # Test delete
             session.delete('fǒǒ', 'těst2')
             self.assertEqual(1, len(session.get_list('fǒǒ')))
@@ -0,0 +1,99 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from wok.config import config
+from wok.model.peers import PeersModel
+from wok.rollbackcontext import RollbackContext
+
+
+# slptool replacement which lists the services written in a file
+FAKE_SLPTOOL = """#!/bin/sh
+if [ "$1" = "findsrvs" ]; then
+    cat "%s"
+fi
+"""
+
+
+class PeersTests(unittest.TestCase):
+    def setUp(self):
+        self.rollback = RollbackContext()
+
+        tmp_dir = tempfile.mkdtemp()
+        self.rollback.prependDefer(shutil.rmtree, tmp_dir)
+        self.services = os.path.join(tmp_dir, 'services')
+        self._set_services([])
+
+        slptool = os.path.join(tmp_dir, 'slptool')
+        with open(slptool, 'w') as f:
+            f.write(FAKE_SLPTOOL % self.services)
+        os.chmod(slptool, 0o755)
+
+        path = os.environ['PATH']
+        os.environ['PATH'] = f'{tmp_dir}:{path}'
+        self.rollback.prependDefer(os.environ.__setitem__, 'PATH', path)
+
+        federation = config.get('server', 'federation')
+        config.set('server', 'federation', 'on')
+        self.rollback.prependDefer(
+            config.set, 'server', 'federation', federation)
+
+    def tearDown(self):
+        self.rollback.commitAll()
+
+    def _set_services(self, peers):
+        with open(self.services, 'w') as f:
+            for peer in peers:
+                f.write(f'service:wokd://{peer},65535\n')
+
+    @mock.patch('wok.model.peers.send_wok_notification')
+    def test_peers_discovery(self, mock_notification):
+        model = PeersModel()
+        self.rollback.prependDefer(model.refresh_task.cancel)
+        model.discovery_thread.join()
+        self.assertEqual([], model.get_list())
+
+        # the list is served from memory until the next refresh
+        self._set_services(['peer1:8001', model.url, 'peer0:8001'])
+        self.assertEqual([], model.get_list())
+
+        mock_notification.reset_mock()
+        self.assertEqual(
+            ['https://peer0:8001', 'https://peer1:8001'],
+            model.get_list(refresh=True),
+        )
+        mock_notification.assert_called_once_with('', 'peers', 'PUT')
+        first_seen = model.peers['https://peer0:8001']['first_seen']
+        self.assertIsNotNone(model.last_refresh)
+
+        # no notification when the peers did not change
+        mock_notification.reset_mock()
+        model.refresh()
+        self.assertFalse(mock_notification.called)
+        self.assertEqual(
+            first_seen, model.peers['https://peer0:8001']['first_seen'])
+
+        self._set_services(['peer1:8001'])
+        model.refresh()
+        self.assertEqual(['https://peer1:8001'], model.get_list())
+        mock_notification.assert_called_once_with('', 'peers', 'PUT')
@@ -22,6 +22,7 @@ import json
 import unittest
 from functools import partial
 
+import cherrypy
 import utils
 from wok.utils import get_enabled_plugins
 
@@ -99,6 +100,28 @@ class PluginTests(unittest.TestCase):
         name_list = self._get_rectangles_list()
         self.assertEqual([], name_list)
 
+    def test_rectangles_paging(self):
+        self._create_rectangle_and_assert('r1', 30, 10)
+        self._create_rectangle_and_assert('r2', 10, 20)
+        self._create_rectangle_and_assert('r3', 20, 30)
+
+        resp = self.request('/plugins/sample/rectangles?_sort=-length&_limit=2')
+        rectangles = json.loads(resp.read())
+        self.assertEqual(['r1', 'r3'], [r['name'] for r in rectangles])
+
+        resp = self.request(
+            '/plugins/sample/rectangles?_sort=width&_offset=1&_fields=name')
+        rectangles = json.loads(resp.read())
+        self.assertEqual([{'name': 'r2'}, {'name': 'r3'}], rectangles)
+
+        resp = self.request('/plugins/sample/rectangles?_limit=-1')
+        self.assertEqual(400, resp.status)
+
+        for name in ['r1', 'r2', 'r3']:
+            resp = self.request(
+                f'/plugins/sample/rectangles/{name}', '{}', 'DELETE')
+            self.assertEqual(204, resp.status)
+
     def test_bad_params(self):
         # Bad name
         resp = self._create_rectangle(1.0, 30, 40)
@@ -112,3 +135,21 @@ class PluginTests(unittest.TestCase):
         req = json.dumps({'name': 'nowidth', 'length': 40})
         resp = self.request('/plugins/sample/rectangles', req, 'POST')
         self.assertEqual(400, resp.status)
+
+    def test_dispatch_table(self):
+        app = cherrypy.tree.apps['/plugins/sample']
+        table = app.root.dispatch_table
+
+        self.assertEqual(
+            {'get_list': 'rectangles_get_list', 'create': 'rectangles_create'},
+            table['/rectangles'],
+        )
+        self.assertEqual(
+            {
+                'lookup': 'rectangle_lookup',
+                'update': 'rectangle_update',
+                'delete': 'rectangle_delete',
+            },
+            table['/rectangles/<ident>'],
+        )
+        self.assertIsNone(table['/description']['delete'])
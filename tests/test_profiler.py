@@ -0,0 +1,64 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import threading
+import time
+import unittest
+
+from wok.profiler import SamplingProfiler
+
+
+def _busy_function(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+class SamplingProfilerTests(unittest.TestCase):
+    def test_sampling(self):
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=_busy_function, args=(stop,), name='wok-busy')
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(stop.set)
+
+        profiler = SamplingProfiler(interval=0.005)
+        profiler.run(0.2)
+        self.assertGreater(profiler.samples, 1)
+
+        lines = profiler.collapsed().splitlines()
+        busy = [line for line in lines if line.startswith('wok-busy;')]
+        self.assertTrue(busy)
+        stack, count = busy[0].rsplit(' ', 1)
+        self.assertIn(f'_busy_function ({__file__}:', stack)
+        self.assertGreater(int(count), 0)
+
+        # the thread running the profiler is not sampled
+        self.assertFalse(any('test_sampling (' in line for line in lines))
+
+    def test_stop(self):
+        profiler = SamplingProfiler(interval=0.01)
+        thread = threading.Thread(target=profiler.run, args=(60,))
+        start = time.monotonic()
+        thread.start()
+        time.sleep(0.05)
+        profiler.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertGreater(profiler.samples, 0)
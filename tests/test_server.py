@@ -22,11 +22,13 @@ import base64
 import json
 import tempfile
 import threading
+import time
 import unittest
 from functools import partial
 
 import cherrypy
 import utils
+from wok.asynctask import AsyncTask
 from wok.control.base import Collection
 from wok.control.base import Resource
 
@@ -116,6 +118,25 @@ class ServerTests(unittest.TestCase):
             else:
                 self.fail('Expected exception not raised')
 
+    def test_json_format(self):
+        resp = self.request('/config')
+        self.assertEqual(200, resp.status)
+        body = resp.read().decode('utf-8')
+        self.assertNotIn('\n', body)
+        self.assertNotIn('": ', body)
+
+        resp = self.request('/config?pretty=1')
+        self.assertEqual(200, resp.status)
+        pretty = resp.read().decode('utf-8')
+        self.assertIn('\n  "', pretty)
+        self.assertEqual(json.loads(body), json.loads(pretty))
+
+        # the parameter is not taken as a collection filter
+        AsyncTask('/tasks/json', lambda cb, opaque: cb('OK', True))
+        resp = self.request('/tasks?pretty=1')
+        self.assertEqual(200, resp.status)
+        self.assertNotEqual([], json.loads(resp.read()))
+
     def test_404(self):
         """
         A non-existent path should return HTTP:404
@@ -243,6 +264,38 @@ class ServerTests(unittest.TestCase):
         resp = self.request('/tasks', None, 'GET', hdrs)
         self.assertEqual(401, resp.status)
 
+    def test_auth_token(self):
+        resp = self.request('/token', json.dumps({'expires_in': 600}), 'POST')
+        self.assertEqual(200, resp.status)
+        token_info = json.loads(resp.read())
+        self.assertEqual(['expires', 'token'], sorted(token_info.keys()))
+
+        hdrs = {
+            'AUTHORIZATION': f"Bearer {token_info['token']}",
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+        }
+        resp = self.request('/tasks', None, 'GET', hdrs)
+        self.assertEqual(200, resp.status)
+
+        # a token can not be used to get another one
+        resp = self.request('/token', '{}', 'POST', dict(hdrs))
+        self.assertEqual(403, resp.status)
+
+        hdrs['AUTHORIZATION'] = f"Bearer {token_info['token']}x"
+        resp = self.request('/tasks', None, 'GET', hdrs)
+        self.assertEqual(401, resp.status)
+
+        resp = self.request('/token', json.dumps({'expires_in': 1}), 'POST')
+        self.assertEqual(400, resp.status)
+
+        # the lifetime is capped by the token_expiry option
+        resp = self.request(
+            '/token', json.dumps({'expires_in': 2592000}), 'POST')
+        self.assertEqual(200, resp.status)
+        expires = json.loads(resp.read())['expires']
+        self.assertLessEqual(expires, time.time() + 3600)
+
     # TODO: uncomment and adapt when some wok API accepts parameters to test
 
 
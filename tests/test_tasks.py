@@ -20,6 +20,7 @@ import time
 import unittest
 
 from wok.asynctask import AsyncTask
+from wok.asynctask import get_tasks_version
 from wok.asynctask import tasks_queue
 from wok.model import model
 
@@ -145,3 +146,14 @@ class AsyncTaskTests(unittest.TestCase):
         time.sleep(10)
         tasks_queue[taskid].kill()
         self.assertEqual('killed', self._task_lookup(taskid)['status'])
+
+    def test_tasks_version(self):
+        version = get_tasks_version()
+        task = AsyncTask('', self._quick_op, 'Hello')
+        wait_task(self._task_lookup, task.id)
+        self.assertNotEqual(version, get_tasks_version())
+
+        version = get_tasks_version()
+        self.assertEqual(version, get_tasks_version())
+        task.remove()
+        self.assertNotEqual(version, get_tasks_version())
@@ -0,0 +1,159 @@
+#
+# Project Wok
+#
+# Copyright IBM Corp, 2017
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import cherrypy
+import mock
+from cherrypy import _cprequest
+from cherrypy.lib import httputil
+from cherrypy.lib import sessions
+from wok import template
+from wok.rollbackcontext import RollbackContext
+from wok.template import get_session_value
+from wok.template import get_template_class
+from wok.template import render_json
+
+
+class TemplateTests(unittest.TestCase):
+    def _write_template(self, filename, content):
+        with open(filename, 'w') as f:
+            f.write(content)
+
+    def test_template_class_cache(self):
+        with RollbackContext() as rollback:
+            _, filename = tempfile.mkstemp(suffix='.tmpl')
+            rollback.prependDefer(os.remove, filename)
+
+            self._write_template(filename, 'Hello $data')
+            klass = get_template_class(filename)
+            self.assertIs(klass, get_template_class(filename))
+            self.assertEqual(
+                'Hello wok', klass(searchList={'data': 'wok'}).respond())
+
+            # a modified template must be compiled again
+            self._write_template(filename, 'Bye $data')
+            mtime = os.stat(filename).st_mtime
+            os.utime(filename, (mtime + 10, mtime + 10))
+            klass = get_template_class(filename)
+            self.assertEqual(
+                'Bye wok', klass(searchList={'data': 'wok'}).respond())
+
+    def test_missing_template(self):
+        self.assertRaises(
+            OSError, get_template_class, '/tmp/wok-no-such-template.tmpl')
+
+
+class SessionValueTests(unittest.TestCase):
+    def _set_session(self, session):
+        session.acquire_lock()
+        session['username'] = 'alice'
+        session.release_lock()
+        serving = cherrypy.serving
+        previous = serving.__dict__.get('session')
+        serving.session = session
+        if previous is None:
+            self.addCleanup(delattr, serving, 'session')
+        else:
+            self.addCleanup(setattr, serving, 'session', previous)
+
+    def test_ram_session_no_lock(self):
+        session = sessions.RamSession()
+        self._set_session(session)
+        with mock.patch.object(session, 'acquire_lock') as acquire_lock:
+            self.assertEqual('alice', get_session_value('username'))
+            self.assertIsNone(get_session_value('role'))
+            acquire_lock.assert_not_called()
+
+    def test_file_session_lock(self):
+        storage_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, storage_path)
+        session = sessions.FileSession(storage_path=storage_path)
+        self._set_session(session)
+        with mock.patch.object(session, 'acquire_lock') as acquire_lock, \
+                mock.patch.object(session, 'release_lock') as release_lock:
+            self.assertEqual('alice', get_session_value('username'))
+            acquire_lock.assert_called_once_with()
+            release_lock.assert_called_once_with()
+
+
+class BytesEncoder(object):
+    def encode(self, data):
+        return json.dumps(data).encode('utf-8')
+
+    def iterencode(self, data):
+        for part in json.JSONEncoder().iterencode(data):
+            yield part.encode('utf-8')
+
+
+class RenderJSONTests(unittest.TestCase):
+    def setUp(self):
+        request = _cprequest.Request(httputil.Host('127.0.0.1', 80),
+                                     httputil.Host('127.0.0.1', 1234))
+        request.params = {}
+        self.response = _cprequest.Response()
+        serving = cherrypy.serving
+        self.addCleanup(serving.__dict__.update, dict(serving.__dict__))
+        self.addCleanup(serving.__dict__.clear)
+        serving.load(request, self.response)
+
+        self.addCleanup(template.set_json_encoder, template._json_encoder)
+
+    def _render(self, data):
+        body = render_json(data)
+        if not isinstance(body, bytes):
+            body = b''.join(body)
+        return body
+
+    def test_compact(self):
+        data = {'name': 'wok', 'plugins': ['kimchi', 'ginger']}
+        body = self._render(data)
+        self.assertEqual(b'{"name":"wok","plugins":["kimchi","ginger"]}', body)
+        self.assertFalse(self.response.stream)
+
+    def test_pretty(self):
+        cherrypy.request.params['pretty'] = '1'
+        data = [{'name': 'wok'}] * template.STREAM_THRESHOLD
+        body = self._render(data)
+        self.assertEqual(json.dumps(data, indent=2, separators=(',', ':')),
+                         body.decode('utf-8'))
+        self.assertFalse(self.response.stream)
+
+    def test_stream(self):
+        data = [{'name': f'vm-{i}'} for i in range(template.STREAM_THRESHOLD)]
+        body = render_json(data)
+        self.assertTrue(self.response.stream)
+        self.assertEqual(data, json.loads(b''.join(body)))
+
+        # lists are only streamed when requested
+        self.response.stream = False
+        self.assertEqual(data, json.loads(render_json(data, stream=False)))
+        self.assertFalse(self.response.stream)
+
+    def test_custom_encoder(self):
+        template.set_json_encoder(BytesEncoder())
+        data = {'name': 'wok'}
+        self.assertEqual(b'{"name": "wok"}', self._render(data))
+
+        data = [data] * template.STREAM_THRESHOLD
+        self.assertEqual(data, json.loads(self._render(data)))
+        self.assertTrue(self.response.stream)
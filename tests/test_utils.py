@@ -18,15 +18,34 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import asyncio
 import os
+import signal
 import tempfile
+import threading
+import time
 import unittest
+import wsgiref.util
 
+import cherrypy
 import mock
+from wok import utils
 from wok.exception import InvalidParameter
+from wok.exception import TimeoutExpired
 from wok.rollbackcontext import RollbackContext
 from wok.utils import convert_data_size
+from wok.utils import get_command_cache_stats
+from wok.utils import get_plugin_conf_dependencies
+from wok.utils import invalidate_command_cache
+from wok.utils import LazyPlugin
+from wok.utils import load_plugin_conf
+from wok.utils import run_command
+from wok.utils import run_command_async
+from wok.utils import run_command_cached
+from wok.utils import run_command_iter
 from wok.utils import set_plugin_state
+from wok.utils import sort_plugins_in_waves
+from wok.utils import update_plugin_config_file
 
 
 class UtilsTests(unittest.TestCase):
@@ -142,3 +161,366 @@ very_interesting_option = True
                 self.assertEqual(
                     updated_conf, self._get_config_file_template(enable=True)
                 )
+
+    def test_sort_plugins_in_waves(self):
+        self.assertEqual(
+            ['gingerbase'],
+            get_plugin_conf_dependencies(
+                {'wok': {'enable': 'True', 'depends': 'gingerbase, '}}),
+        )
+        self.assertEqual([], get_plugin_conf_dependencies({'wok': {}}))
+
+        waves = sort_plugins_in_waves({
+            'kimchi': ['gingerbase'],
+            'ginger': ['gingerbase', 'unknown'],
+            'gingerbase': [],
+            'sample': [],
+            'plugin': ['kimchi', 'ginger'],
+        })
+        self.assertEqual(
+            [['gingerbase', 'sample'], ['ginger', 'kimchi'], ['plugin']], waves)
+
+        # plugins in a cycle are loaded last
+        waves = sort_plugins_in_waves({'a': ['b'], 'b': ['a'], 'c': []})
+        self.assertEqual([['c'], ['a', 'b']], waves)
+
+    @mock.patch('wok.utils.get_plugin_config_file')
+    def test_load_plugin_conf_cache(self, mock_config_file):
+        with RollbackContext() as rollback:
+            config_file_name = self._create_fake_config_file()
+            rollback.prependDefer(os.remove, config_file_name)
+            mock_config_file.return_value = config_file_name
+
+            conf = load_plugin_conf('pluginA')
+            self.assertEqual('True', conf['wok']['enable'])
+
+            # the returned configuration is a copy of the cached one
+            del conf['wok']
+            with mock.patch('wok.utils._parse_plugin_conf') as mock_parse:
+                conf = load_plugin_conf('pluginA')
+                self.assertFalse(mock_parse.called)
+            self.assertEqual('True', conf['wok']['enable'])
+
+            # a modified file is parsed again
+            update_plugin_config_file('pluginA', False)
+            self.assertEqual('False', load_plugin_conf('pluginA')['wok']['enable'])
+
+    @mock.patch('wok.utils.get_plugins_dependency_graph')
+    @mock.patch('wok.utils.update_plugin_config_file')
+    @mock.patch('wok.utils.update_cherrypy_mounted_tree')
+    def test_set_plugin_state_cascade(self, mock_update_cherrypy,
+                                      mock_update_config, mock_graph):
+        mock_graph.return_value = {
+            'kimchi': {'gingerbase'},
+            'ginger': {'gingerbase'},
+            'gingerbase': set(),
+            'plugin': {'kimchi'},
+        }
+
+        set_plugin_state('plugin', True)
+        self.assertEqual(
+            [mock.call('gingerbase', True), mock.call('kimchi', True),
+             mock.call('plugin', True)],
+            mock_update_cherrypy.call_args_list,
+        )
+        self.assertEqual(
+            mock_update_cherrypy.call_args_list,
+            mock_update_config.call_args_list,
+        )
+
+        mock_update_cherrypy.reset_mock()
+        set_plugin_state('gingerbase', False)
+        self.assertEqual(
+            [mock.call('plugin', False), mock.call('kimchi', False),
+             mock.call('ginger', False), mock.call('gingerbase', False)],
+            mock_update_cherrypy.call_args_list,
+        )
+
+    def test_run_command_output_callback(self):
+        cmd = ['sh', '-c', 'echo a; echo b']
+
+        outputs = []
+        out, error, rc = run_command(cmd, out_cb=outputs.append)
+        self.assertEqual(('a\nb\n', 0), (out, rc))
+        self.assertEqual(['a\n', 'a\nb\n'], outputs)
+
+        outputs = []
+        run_command(cmd, out_cb=outputs.append, out_cb_delta=True)
+        self.assertEqual(['a\n', 'b\n'], outputs)
+
+    def test_run_command_iter(self):
+        lines = []
+        gen = run_command_iter(['sh', '-c', 'echo a; echo b >&2; echo c; exit 3'])
+        try:
+            while True:
+                lines.append(next(gen))
+        except StopIteration as e:
+            self.assertEqual((b'b\n', 3), e.value)
+        self.assertEqual(['a\n', 'c\n'], lines)
+
+        self.assertRaises(
+            TimeoutExpired, list, run_command_iter(['sleep', '5'], timeout=0.2)
+        )
+
+    def test_run_command_async(self):
+        out, error, rc = asyncio.run(
+            run_command_async(['sh', '-c', 'echo a; exit 2']))
+        self.assertEqual(('a\n', 2), (out, rc))
+
+        self.assertRaises(
+            TimeoutExpired, asyncio.run,
+            run_command_async(['sleep', '5'], timeout=0.2))
+
+    @mock.patch('wok.utils._command_slots', threading.BoundedSemaphore(1))
+    def test_run_command_async_cancel(self):
+        slots = utils._get_command_slots()
+
+        procs = []
+        create_subprocess_exec = asyncio.create_subprocess_exec
+
+        async def create(*args, **kwargs):
+            procs.append(await create_subprocess_exec(*args, **kwargs))
+            return procs[-1]
+
+        async def cancel_running():
+            task = asyncio.ensure_future(run_command_async(['sleep', '5']))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return await procs[0].wait()
+
+        # the command is killed and its slot released
+        with mock.patch.object(utils.asyncio, 'create_subprocess_exec',
+                               create):
+            returncode = asyncio.run(cancel_running())
+        self.assertEqual(-signal.SIGKILL, returncode)
+        self.assertTrue(slots.acquire(blocking=False))
+
+        async def cancel_waiting():
+            # the slot is taken by another command
+            task = asyncio.ensure_future(run_command_async(['true']))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            slots.release()
+            await asyncio.sleep(0.2)
+
+        # the slot the task was waiting for is released once acquired
+        asyncio.run(cancel_waiting())
+        self.assertTrue(slots.acquire(blocking=False))
+        slots.release()
+
+    @mock.patch('wok.utils.run_command')
+    def test_run_command_cached(self, mock_run_command):
+        def _run_command(cmd, timeout, silent, env_vars=None):
+            started.set()
+            release.wait()
+            return ('out', b'', 0)
+
+        started = threading.Event()
+        release = threading.Event()
+        mock_run_command.side_effect = _run_command
+        invalidate_command_cache()
+        stats = get_command_cache_stats()
+        cmd = ['showmount', '--no-headers', '--exports', 'server']
+
+        # concurrent calls run the command only once
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(run_command_cached(cmd)))
+            for i in range(3)
+        ]
+        threads[0].start()
+        started.wait()
+        for t in threads[1:]:
+            t.start()
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual([('out', b'', 0)] * 3, results)
+        self.assertEqual(1, mock_run_command.call_count)
+
+        # the result is cached until it is older than ttl or invalidated
+        self.assertEqual(('out', b'', 0), run_command_cached(cmd))
+        self.assertEqual(1, mock_run_command.call_count)
+        run_command_cached(cmd, ttl=0)
+        self.assertEqual(2, mock_run_command.call_count)
+        invalidate_command_cache(cmd)
+        run_command_cached(cmd)
+        self.assertEqual(3, mock_run_command.call_count)
+
+        # failures are not cached
+        mock_run_command.side_effect = None
+        mock_run_command.return_value = ('', b'error', 1)
+        run_command_cached(['false'])
+        run_command_cached(['false'])
+        self.assertEqual(5, mock_run_command.call_count)
+
+        new_stats = get_command_cache_stats()
+        self.assertEqual(1, new_stats['hits'] - stats['hits'])
+        self.assertEqual(2, new_stats['shared'] - stats['shared'])
+        self.assertEqual(5, new_stats['misses'] - stats['misses'])
+
+
+class FakePlugin(object):
+    instances = 0
+
+    def __init__(self, options):
+        FakePlugin.instances += 1
+        self.description = 'fake plugin'
+
+    def get_custom_conf(self):
+        return {'/help': {'tools.staticdir.on': True}}
+
+    @cherrypy.expose
+    def index(self):
+        return 'fake'
+
+
+class LazyPluginTests(unittest.TestCase):
+    def setUp(self):
+        FakePlugin.instances = 0
+        patcher = mock.patch.dict(utils.plugins_load_stats, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _mount(self):
+        stub = LazyPlugin('lazyfake', FakePlugin)
+        uri = stub._plugin_uri
+        app = cherrypy.tree.mount(stub, uri, {'/': {'tools.encode.on': True}})
+        self.addCleanup(cherrypy.tree.apps.pop, uri)
+        return stub, app
+
+    def test_load_on_attribute(self):
+        stub, app = self._mount()
+        self.assertEqual(0, FakePlugin.instances)
+        self.assertIs(stub, app.root)
+
+        self.assertEqual('fake plugin', stub.description)
+        self.assertEqual(1, FakePlugin.instances)
+        self.assertIsInstance(app.root, FakePlugin)
+
+        # the plugin configuration is merged into the application one
+        self.assertEqual({'tools.encode.on': True}, app.config['/'])
+        self.assertEqual({'tools.staticdir.on': True}, app.config['/help'])
+        self.assertIn('lazyfake', utils.plugins_load_stats)
+
+        # the plugin is loaded only once
+        self.assertEqual('fake', stub.index())
+        self.assertEqual(1, FakePlugin.instances)
+
+    def test_load_on_request(self):
+        stub, app = self._mount()
+        self.assertEqual(0, FakePlugin.instances)
+
+        # the dispatcher reads the stub attributes to find the handler
+        environ = {'SCRIPT_NAME': stub._plugin_uri, 'PATH_INFO': '/'}
+        wsgiref.util.setup_testing_defaults(environ)
+        serving = cherrypy.serving
+        self.addCleanup(serving.__dict__.update, dict(serving.__dict__))
+        self.addCleanup(serving.__dict__.clear)
+        start_response = mock.Mock()
+        body = b''.join(app(environ, start_response))
+
+        self.assertEqual(1, FakePlugin.instances)
+        self.assertIsInstance(app.root, FakePlugin)
+        self.assertEqual('200 OK', start_response.call_args[0][0])
+        self.assertEqual(b'fake', body)
+
+    def test_load_failure(self):
+        stub = LazyPlugin('lazyfake', 'wok.plugins.lazyfake.Lazyfake')
+        self.assertRaises(AttributeError, getattr, stub, 'description')
+        self.assertNotIn('lazyfake', utils.plugins_load_stats)
+
+
+class LoadPluginsTests(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        patcher = mock.patch.dict(utils.plugins_load_stats, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _plugin_class(self, name, depends=None, class_depends=None,
+                      delay=0):
+        events = self.events
+
+        class Plugin(FakePlugin):
+            def __init__(self, options):
+                events.append(('start', name))
+                time.sleep(delay)
+                if depends is not None:
+                    self.depends = depends
+                events.append(('end', name))
+
+        if class_depends is not None:
+            Plugin.depends = class_depends
+        return Plugin
+
+    def _load(self, classes, configs=None):
+        def import_class(class_path):
+            name = class_path.split('.')[2]
+            if class_path.endswith('.sub_nodes') or name not in classes:
+                raise ImportError(class_path)
+            return classes[name]
+
+        mounted = []
+
+        def mount(app, uri, config):
+            mounted.append(uri.rsplit('/', 1)[-1])
+
+        configs = configs or {}
+        plugins = [(name, {'wok': dict(configs.get(name, {}), enable=True)})
+                   for name in classes]
+        with mock.patch.object(utils, 'import_class', import_class), \
+                mock.patch.object(cherrypy.tree, 'mount', mount):
+            utils.load_plugins(plugins, max_workers=4)
+        return mounted
+
+    def _started(self, name):
+        return self.events.index(('start', name))
+
+    def _ended(self, name):
+        return self.events.index(('end', name))
+
+    def test_declared_dependencies(self):
+        classes = {
+            'gingerbase': self._plugin_class('gingerbase', delay=0.1,
+                                             class_depends=[]),
+            'kimchi': self._plugin_class('kimchi', class_depends=[]),
+            'ginger': self._plugin_class('ginger',
+                                         class_depends=['gingerbase']),
+        }
+        mounted = self._load(classes,
+                             {'kimchi': {'depends': 'gingerbase'}})
+
+        self.assertGreater(self._started('ginger'), self._ended('gingerbase'))
+        self.assertGreater(self._started('kimchi'), self._ended('gingerbase'))
+        self.assertEqual('gingerbase', mounted[0])
+
+    def test_instance_dependencies(self):
+        # ginger only sets its dependencies once initialized, so it is
+        # initialized after the plugins whose dependencies are known
+        classes = {
+            'ginger': self._plugin_class('ginger', depends=['gingerbase']),
+            'gingerbase': self._plugin_class('gingerbase', delay=0.1,
+                                             class_depends=[]),
+            'kimchi': self._plugin_class('kimchi', depends=['ginger']),
+        }
+        mounted = self._load(classes)
+
+        self.assertGreater(self._started('ginger'), self._ended('gingerbase'))
+        self.assertGreater(self._started('kimchi'), self._ended('ginger'))
+        self.assertEqual(['gingerbase', 'ginger', 'kimchi'], mounted)
+
+        # plugins depending on them are not initialized concurrently
+        self.events[:] = []
+        classes['sample'] = self._plugin_class('sample',
+                                               class_depends=['kimchi'])
+        mounted = self._load(classes)
+        self.assertGreater(self._started('sample'), self._ended('kimchi'))
+        self.assertEqual(['gingerbase', 'ginger', 'kimchi', 'sample'], mounted)